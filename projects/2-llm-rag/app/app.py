@@ -6,12 +6,17 @@ from config import Config
 
 from services.llm_client import LlmClient
 from services.embedding_function import EmbeddingFunction
+from services.embedding_model_registry import EmbeddingModelRegistry
 from services.vector_store import VectorStore
 
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    # Shared by all requests, so each model is probed at most once
+    app.embedding_model_registry = EmbeddingModelRegistry(
+        filepath=app.config["EMBEDDING_MODEL_REGISTRY_FILEPATH"]
+    )
 
     with app.app_context():
         app_boot()
@@ -123,6 +128,7 @@ def get_embedding_function():
         g.embedding_function = EmbeddingFunction(
             infinity_instance_url=current_app.config["INFINITY_INSTANCE_URL"],
             embedding_model=current_app.config["EMBEDDING_MODEL"],
+            model_registry=current_app.embedding_model_registry,
         )
 
     return g.embedding_function
@@ -11,6 +11,10 @@ class Config:
 
     INFINITY_INSTANCE_URL = os.getenv("INFINITY_INSTANCE_URL")
     EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+    # Dimensions etc. of probed embedding models
+    EMBEDDING_MODEL_REGISTRY_FILEPATH = (
+        os.path.dirname(__file__) + "/cache/embedding-models.json"
+    )
 
     OLLAMA_INSTANCE_URL = os.getenv("OLLAMA_INSTANCE_URL")
     MODEL = os.getenv("MODEL")
@@ -1,13 +1,20 @@
 from langchain.embeddings.infinity import InfinityEmbeddings
 
+from services.embedding_model_registry import (
+    EmbeddingModelInfo,
+    EmbeddingModelRegistry,
+)
+
 
 class EmbeddingFunction:
     def __init__(
         self,
         infinity_instance_url: str,
         embedding_model: str = "all-MiniLM-L6-v2",
+        model_registry: EmbeddingModelRegistry | None = None,
     ):
         self.embedding_model = embedding_model
+        self.model_registry = model_registry or EmbeddingModelRegistry()
         self.ef = InfinityEmbeddings(
             model=self.embedding_model, infinity_api_url=infinity_instance_url
         )
@@ -38,13 +45,16 @@ class EmbeddingFunction:
         return text
 
     def get_embedding_dimensions(self) -> int:
-        # TODO: don't hardcode / get dynamically?
-        mapping = {"all-MiniLM-L6-v2": 384}
-        placeholder_dimensions = 0
+        # Known or cached models don't need the embedding server
+        info = self.model_registry.get_or_probe(
+            self.embedding_model, self.probe_model_info
+        )
 
-        try:
-            dimensions = mapping[self.embedding_model]
-        except:
-            dimensions = placeholder_dimensions
+        return info.dimensions
 
-        return dimensions
+    def probe_model_info(self) -> EmbeddingModelInfo:
+        test_embeddings = self.ef.embed_query("")
+
+        return EmbeddingModelInfo(
+            model=self.embedding_model, dimensions=len(test_embeddings)
+        )
@@ -26,17 +26,6 @@ class VectorStore:
         )
 
         self.index_name = "app_documents"
-        self.index_settings = {
-            "settings": {"index": {"number_of_shards": 4}, "index.knn": True},
-            "mappings": {
-                "properties": {
-                    "embeddings": {
-                        "type": "knn_vector",
-                        "dimension": self.embedding_function.get_embedding_dimensions(),
-                    },
-                }
-            },
-        }
 
         self.ensure_index_exists()
 
@@ -72,13 +61,29 @@ class VectorStore:
         except:
             self.refresh_index()
 
+    def get_index_settings(self) -> dict:
+        # Only needed when (re)creating the index
+        return {
+            "settings": {"index": {"number_of_shards": 4}, "index.knn": True},
+            "mappings": {
+                "properties": {
+                    "embeddings": {
+                        "type": "knn_vector",
+                        "dimension": self.embedding_function.get_embedding_dimensions(),
+                    },
+                }
+            },
+        }
+
     def refresh_index(self):
         try:
             self.search_client.indices.delete(self.index_name)
         except:
             do_nothing = None
 
-        self.search_client.indices.create(self.index_name, body=self.index_settings)
+        self.search_client.indices.create(
+            self.index_name, body=self.get_index_settings()
+        )
         self.load_documents_from_disk_into_index()
 
     def ensure_search_pipeline_exists(self):
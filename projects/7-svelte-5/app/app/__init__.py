@@ -2,21 +2,46 @@ import json
 import os
 import threading
 
-from flask import Flask, current_app, g, jsonify, render_template, request, Response
+from flask import (
+    Flask,
+    current_app,
+    g,
+    jsonify,
+    render_template,
+    request,
+    Response,
+    stream_with_context,
+)
 from werkzeug.exceptions import HTTPException
 
 from app.config import Config
 from app.database import db_init_app, db
 from app.models import User, Chat
 
+from app.lib.embedding_model_registry import EmbeddingModelRegistry
+from app.lib.response_cache import MemoryResponseCache, SqliteResponseCache
+from app.lib.sse_utils import format_server_sent_event
+
+from app.services.admission_controller import AdmissionController, AdmissionRejected
 from app.services.app_logger import AppLogger
 from app.services.chat_manager import ChatManager
 from app.services.cli_commands import register_cli_commands
 from app.services.image_gen import ImageGen, ImageGenStub
+from app.services.image_processor import ImageProcessor
+from app.services.media_cleanup import FileDeletionQueue, OrphanedMediaSweeper
+from app.services.model_router import LARGE_TIER, SMALL_TIER, ModelRouter
 from app.services.app_llm import AppLlm
 from app.services.llm_http_client import LlmHttpClient
 from app.services.embedding_service import EmbeddingService
-from app.services.content_store import ContentStore, OpenSearchConfig
+from app.services.content_store import ContentStore
+from app.services.data_loader import DataLoader
+from app.services.local_search_backend import LocalSearchBackend
+from app.services.reranker import CrossEncoderReranker, InfinityReranker
+from app.services.search_backends import (
+    IndexProfile,
+    OpenSearchBackend,
+    OpenSearchConfig,
+)
 
 
 def create_app():
@@ -30,6 +55,14 @@ def create_app():
         register_cli_commands(app)
         app_boot(app)
 
+    @app.errorhandler(AdmissionRejected)
+    def too_many_requests(e):
+        return (
+            jsonify({"error": "busy", "retry_after": e.retry_after}),
+            429,
+            {"Retry-After": str(e.retry_after)},
+        )
+
     @app.errorhandler(404)
     def not_found(e):
         user = get_user()
@@ -94,27 +127,38 @@ def create_app():
                 input=user_input
             )
 
-            image_filename = app.image_gen.gen_image_from_prompt(
-                prompt=image_gen_prompt
-            )
-
-            chat_message = app.chat_manager.get_generated_image_and_save_messages(
-                image_filename=image_filename,
+            return get_image_gen_progress_response(
+                app=app,
                 prompt=user_input,
+                image_gen_prompt=image_gen_prompt,
                 chat=chat,
                 user=user,
             )
-
-            return jsonify({"output": chat_message.content})
         else:
-            app.chat_manager.create_chat_message(
-                content=user_input, chat=chat, user=user
-            )
-
-            return Response(
-                app.chat_manager.get_llm_response_stream_and_save_messages(chat=chat),
+            # Before the message is saved, a rejected prompt leaves no trace
+            ticket = app.admission_controller.acquire(LARGE_TIER)
+
+            try:
+                app.chat_manager.create_chat_message(
+                    content=user_input, chat=chat, user=user
+                )
+            except Exception:
+                app.admission_controller.release(ticket)
+                raise
+
+            def release_ticket():
+                app.admission_controller.release(ticket)
+
+            response = Response(
+                app.chat_manager.get_llm_response_stream_and_save_messages(
+                    chat=chat, on_stream_end=release_ticket
+                ),
                 mimetype="text/event-stream",
             )
+            # Also if the stream never started (release is idempotent)
+            response.call_on_close(release_ticket)
+
+            return response
 
     @app.route("/image-generate", methods=["POST"])
     def image_generate():
@@ -134,6 +178,21 @@ def create_app():
 
         return jsonify({"output": chat_message.content})
 
+    @app.route("/image-generate-stream", methods=["POST"])
+    def image_generate_stream():
+        user_input = request.json["prompt"].strip()
+
+        user = get_user()
+        chat = get_chat()
+
+        return get_image_gen_progress_response(
+            app=app,
+            prompt=user_input,
+            image_gen_prompt=user_input,
+            chat=chat,
+            user=user,
+        )
+
     # @app.route("/chats", methods=["GET"])
     # def chats():
     #     chats = db.session.execute(db.select(Chat)).scalars().all()
@@ -155,7 +214,8 @@ def create_app():
     def refresh() -> str:
         user = get_user()
 
-        app.content_store.refresh_index()
+        ingestion_stats = app.content_store.refresh_index()
+        app.logger_service.log(f"Index refreshed: {ingestion_stats}")
 
         return render_template(
             "page.html",
@@ -180,6 +240,24 @@ def create_app():
 
         return jsonify(result), 200
 
+    @app.route("/stats", methods=["GET"])
+    def stats():
+        return (
+            jsonify(
+                {
+                    "prompt_cache": app.llm_http_client.get_prompt_cache_stats(),
+                    "model_router": app.model_router.get_stats(),
+                    "llm_coalescing": app.llm_http_client.get_coalescing_stats(),
+                    "llm_response_cache": (
+                        app.llm_http_client.get_response_cache_stats()
+                    ),
+                    "admission": app.admission_controller.get_stats(),
+                    "search_cache": app.content_store.get_cache_stats(),
+                }
+            ),
+            200,
+        )
+
     return app
 
 
@@ -188,36 +266,154 @@ def attach_services(app: Flask) -> None:
         log_dir=app.config["LOGS_DIR"], log_file=app.config["LOG_FILE"]
     )
 
+    model_router_fallbacks = {}
+
+    for fallback in app.config["MODEL_ROUTER_FALLBACKS"].split(","):
+        if fallback:
+            tier, fallback_tier = fallback.split(":")
+            model_router_fallbacks.setdefault(tier, []).append(fallback_tier)
+
+    app.model_router = ModelRouter(
+        tiers={
+            LARGE_TIER: app.config["INFERENCE_API_URLS"],
+            SMALL_TIER: app.config["INFERENCE_SMALL_API_URLS"],
+        },
+        fallbacks=model_router_fallbacks,
+        strategy=app.config["MODEL_ROUTER_STRATEGY"],
+        ejection_seconds=app.config["MODEL_ROUTER_EJECTION_SECONDS"],
+        logger=app.logger_service,
+    )
+
+    app.admission_controller = AdmissionController(
+        limits={
+            LARGE_TIER: app.config["ADMISSION_MAX_CONCURRENCY"],
+            SMALL_TIER: app.config["ADMISSION_SMALL_MAX_CONCURRENCY"],
+        },
+        max_queue_size=app.config["ADMISSION_MAX_QUEUE_SIZE"],
+        queue_timeout_seconds=app.config["ADMISSION_QUEUE_TIMEOUT_SECONDS"],
+    )
+
+    if app.config["LLM_RESPONSE_CACHE_BACKEND"] == "memory":
+        response_cache = MemoryResponseCache(
+            max_entries=app.config["LLM_RESPONSE_CACHE_MAX_ENTRIES"],
+            ttl_seconds=app.config["LLM_RESPONSE_CACHE_TTL_SECONDS"],
+        )
+    elif app.config["LLM_RESPONSE_CACHE_BACKEND"] == "sqlite":
+        response_cache = SqliteResponseCache(
+            filepath=app.config["LLM_RESPONSE_CACHE_FILEPATH"],
+            max_entries=app.config["LLM_RESPONSE_CACHE_MAX_ENTRIES"],
+            ttl_seconds=app.config["LLM_RESPONSE_CACHE_TTL_SECONDS"],
+        )
+    else:
+        response_cache = None
+
     app.llm_http_client = LlmHttpClient(
-        inference_api_url=current_app.config["INFERENCE_API_URL"]
+        inference_api_url=current_app.config["INFERENCE_API_URL"],
+        cache_prompt=current_app.config["INFERENCE_CACHE_PROMPT"],
+        num_slots=current_app.config["INFERENCE_NUM_SLOTS"],
+        model_router=app.model_router,
+        coalesce_streams=current_app.config["LLM_COALESCE_STREAMS"],
+        response_cache=response_cache,
+        admission_controller=app.admission_controller,
     )
 
     app.embedding_service = EmbeddingService(
         inference_api_url=current_app.config["INFINITY_INSTANCE_URL"],
         model=current_app.config["EMBEDDING_MODEL"],
-    )
-
-    search_config = OpenSearchConfig(
-        hostname=current_app.config["SEARCH_HOSTNAME"],
-        port=current_app.config["SEARCH_PORT"],
-        auth=(
-            current_app.config["SEARCH_USER"],
-            current_app.config["SEARCH_PASSWORD"],
+        encoding_format=current_app.config["EMBEDDING_ENCODING_FORMAT"],
+        model_registry=EmbeddingModelRegistry(
+            filepath=current_app.config["EMBEDDING_MODEL_REGISTRY_FILEPATH"]
         ),
     )
 
+    if app.config["SEARCH_BACKEND"] == "local":
+        search_backend = LocalSearchBackend(
+            index_dir=app.config["LOCAL_SEARCH_INDEX_DIR"],
+            use_hnsw=app.config["LOCAL_SEARCH_USE_HNSW"],
+            quantization=app.config["VECTOR_QUANTIZATION"],
+        )
+    else:
+        search_config = OpenSearchConfig(
+            hostname=current_app.config["SEARCH_HOSTNAME"],
+            port=current_app.config["SEARCH_PORT"],
+            auth=(
+                current_app.config["SEARCH_USER"],
+                current_app.config["SEARCH_PASSWORD"],
+            ),
+        )
+        index_profile = IndexProfile(
+            engine=app.config["OPENSEARCH_KNN_ENGINE"],
+            space_type=app.config["OPENSEARCH_KNN_SPACE_TYPE"],
+            m=app.config["OPENSEARCH_KNN_M"],
+            ef_construction=app.config["OPENSEARCH_KNN_EF_CONSTRUCTION"],
+            ef_search=app.config["OPENSEARCH_KNN_EF_SEARCH"],
+            number_of_shards=app.config["OPENSEARCH_NUMBER_OF_SHARDS"],
+            number_of_replicas=app.config["OPENSEARCH_NUMBER_OF_REPLICAS"],
+        )
+        search_backend = OpenSearchBackend(
+            search_config=search_config,
+            quantization=app.config["VECTOR_QUANTIZATION"],
+            index_profile=index_profile,
+        )
+
+    if app.config["RERANK_BACKEND"] == "infinity":
+        reranker = InfinityReranker(
+            inference_api_url=app.config["INFINITY_INSTANCE_URL"],
+            model=app.config["RERANK_MODEL"],
+            batch_size=app.config["RERANK_BATCH_SIZE"],
+        )
+    elif app.config["RERANK_BACKEND"] == "cross_encoder":
+        reranker = CrossEncoderReranker(
+            model=app.config["RERANK_MODEL"],
+            batch_size=app.config["RERANK_BATCH_SIZE"],
+        )
+    else:
+        reranker = None
+
+    if reranker:
+        reranker.load()
+
     app.content_store = ContentStore(
-        search_config=search_config,
+        search_backend=search_backend,
         content_dir=current_app.config["CONTENT_DIR"],
         embedding_service=app.embedding_service,
+        data_loader=DataLoader(
+            content_dir=current_app.config["CONTENT_DIR"],
+            chunk_size=app.config["CHUNK_SIZE_TOKENS"],
+            chunk_overlap=app.config["CHUNK_OVERLAP_TOKENS"],
+            tokenizer_name=app.config["CHUNK_TOKENIZER"],
+            max_workers=app.config["INGESTION_WORKERS"],
+        ),
+        fusion_method=app.config["SEARCH_FUSION_METHOD"],
+        fusion_weights=app.config["SEARCH_FUSION_WEIGHTS"],
+        fusion_candidates=app.config["SEARCH_FUSION_CANDIDATES"],
+        rrf_k=app.config["SEARCH_FUSION_RRF_K"],
+        embedding_cache_size=app.config["SEARCH_EMBEDDING_CACHE_SIZE"],
+        results_cache_size=app.config["SEARCH_RESULTS_CACHE_SIZE"],
+        results_cache_ttl_seconds=app.config["SEARCH_RESULTS_CACHE_TTL_SECONDS"],
+        reranker=reranker,
+        rerank_candidates=app.config["RERANK_CANDIDATES"],
+        rerank_deadline_seconds=app.config["RERANK_DEADLINE_SECONDS"],
+        ingestion_batch_size=app.config["INGESTION_BATCH_SIZE"],
+        ingestion_index_batch_size=app.config["INGESTION_INDEX_BATCH_SIZE"],
+        ingestion_queue_size=app.config["INGESTION_QUEUE_SIZE"],
+        ingestion_embedding_workers=app.config["INGESTION_EMBEDDING_WORKERS"],
+        dedup_threshold=app.config["INGESTION_DEDUP_THRESHOLD"],
+        dedup_max_entries=app.config["INGESTION_DEDUP_MAX_ENTRIES"],
     )
 
     app.app_llm = AppLlm(
         content_store=app.content_store,
-        inference_small_api_url=app.config["INFERENCE_SMALL_API_URL"],
         llm_http_client=app.llm_http_client,
         logger=app.logger_service,
         debug=app.config["DEBUG"],
+        bytecode_cache_dir=app.config["PROMPT_TEMPLATES_BYTECODE_CACHE_DIR"],
+        compiled_templates_dir=(
+            None if app.config["DEBUG"] else app.config["PROMPT_TEMPLATES_COMPILED_DIR"]
+        ),
+        prompt_layout=app.config["PROMPT_LAYOUT"],
+        cached_callers=app.config["LLM_RESPONSE_CACHE_CALLERS"],
+        chat_max_tokens=app.config["CHAT_MAX_TOKENS"] or None,
     )
 
     generated_images_dir = app.config["GENERATED_IMAGES_DIR"]
@@ -226,13 +422,41 @@ def attach_services(app: Flask) -> None:
     if app.config["FAKE_GENERATION"]:
         app.image_gen = ImageGenStub()
     else:
-        app.image_gen = ImageGen(images_dir=generated_images_dir)
+        app.image_gen = ImageGen(
+            images_dir=generated_images_dir,
+            device=app.config["IMAGE_GEN_DEVICE"],
+            dtype=app.config["IMAGE_GEN_DTYPE"],
+            num_threads=app.config["IMAGE_GEN_NUM_THREADS"],
+            backend=app.config["IMAGE_GEN_BACKEND"],
+            export_dir=app.config["IMAGE_GEN_EXPORT_DIR"],
+            height=app.config["IMAGE_GEN_HEIGHT"],
+            width=app.config["IMAGE_GEN_WIDTH"],
+            num_inference_steps=app.config["IMAGE_GEN_NUM_INFERENCE_STEPS"],
+        )
+
+    app.image_processor = ImageProcessor(
+        images_dir=generated_images_dir,
+        widths=app.config["GENERATED_IMAGE_VARIANT_WIDTHS"],
+        formats=app.config["GENERATED_IMAGE_VARIANT_FORMATS"],
+        logger=app.logger_service,
+    )
+
+    app.file_deletion_queue = FileDeletionQueue(logger=app.logger_service)
 
     app.chat_manager = ChatManager(
         db_uri=current_app.config["SQLALCHEMY_DATABASE_URI"],
         app_llm=app.app_llm,
         image_gen=app.image_gen,
         images_dir_url_path=app.config["GENERATED_IMAGES_DIR_URL_PATH"],
+        image_processor=app.image_processor,
+        file_deletion_queue=app.file_deletion_queue,
+    )
+
+    app.orphaned_media_sweeper = OrphanedMediaSweeper(
+        media_dir=generated_images_dir,
+        create_session=app.chat_manager.create_new_session,
+        file_deletion_queue=app.file_deletion_queue,
+        logger=app.logger_service,
     )
 
 
@@ -246,6 +470,55 @@ def app_boot(app: Flask) -> None:
     thread.start()
 
 
+def server_boot(app: Flask) -> None:
+    # Background jobs that should run once per deployment, not in every
+    # process that creates the app (CLI commands, WSGI workers)
+    health_check_interval_seconds = app.config[
+        "MODEL_ROUTER_HEALTH_CHECK_INTERVAL_SECONDS"
+    ]
+
+    if health_check_interval_seconds > 0:
+        app.model_router.start(interval_seconds=health_check_interval_seconds)
+
+    sweep_interval_seconds = app.config["ORPHANED_MEDIA_SWEEP_INTERVAL_SECONDS"]
+
+    if sweep_interval_seconds > 0:
+        app.orphaned_media_sweeper.start(interval_seconds=sweep_interval_seconds)
+
+
+def get_image_gen_progress_response(
+    app: Flask, prompt: str, image_gen_prompt: str, chat: Chat, user: User
+) -> Response:
+    # Streams step progress (and latent previews) as server sent events, the
+    # final "done" event carries the chat message, same as the JSON endpoint
+    def generate():
+        events = app.image_gen.gen_image_from_prompt_stream(
+            prompt=image_gen_prompt,
+            include_previews=app.config["IMAGE_GEN_STREAM_PREVIEWS"],
+        )
+
+        for event in events:
+            if event["type"] == "done":
+                chat_message = app.chat_manager.get_generated_image_and_save_messages(
+                    image_filename=event["filename"],
+                    prompt=prompt,
+                    chat=chat,
+                    user=user,
+                )
+
+                yield format_server_sent_event(
+                    {"output": chat_message.content}, event="done"
+                )
+            else:
+                yield format_server_sent_event(event, event=event["type"])
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={app.config["STREAM_TYPE_HEADER"]: "image-progress"},
+    )
+
+
 def get_user() -> User:
     if "user" not in g:
         g.user = db.session.execute(db.select(User).limit(1)).scalar_one()
@@ -1,5 +1,13 @@
-from app import create_app
+import os
+
+from app import create_app, server_boot
 
 if __name__ == "__main__":
     app = create_app()
+
+    # With the reloader the app is created in a watcher process as well, only
+    # the child it spawns serves requests
+    if not app.config["DEBUG"] or os.getenv("WERKZEUG_RUN_MAIN") == "true":
+        server_boot(app)
+
     app.run(host="0.0.0.0", port=app.config["APP_PORT"], debug=app.config["DEBUG"])
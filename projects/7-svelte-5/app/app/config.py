@@ -29,6 +29,11 @@ class Config:
     LOGS_DIR = os.path.join(PROJECT_DIR, "logs")
     LOG_FILE = "app.log"
 
+    CACHE_DIR = os.path.join(PROJECT_DIR, "cache")
+    PROMPT_TEMPLATES_BYTECODE_CACHE_DIR = os.path.join(CACHE_DIR, "prompts-bytecode")
+    # Populated by `flask compile_prompts`, used when present
+    PROMPT_TEMPLATES_COMPILED_DIR = os.path.join(CACHE_DIR, "prompts-compiled")
+
     STATIC_FILES_DIR_NAME = "static"
     STATIC_FILES_DIR = os.path.join(PROJECT_DIR, STATIC_FILES_DIR_NAME)
 
@@ -37,6 +42,37 @@ class Config:
     GENERATED_IMAGES_DIR_URL_PATH = (
         f"/{STATIC_FILES_DIR_NAME}/{GENERATED_IMAGES_DIR_NAME}"
     )
+    # Smaller copies of generated images served to the chat (originals are kept)
+    GENERATED_IMAGE_VARIANT_WIDTHS = [256, 512]
+    GENERATED_IMAGE_VARIANT_FORMATS = ["avif", "webp"]
+    # Periodic sweep in the `python -m app` server only, 0 disables it. Other
+    # setups (e.g. several WSGI workers) can run `flask sweep_orphaned_media`
+    # from cron instead
+    ORPHANED_MEDIA_SWEEP_INTERVAL_SECONDS = int(
+        os.getenv("ORPHANED_MEDIA_SWEEP_INTERVAL_SECONDS", "3600")
+    )
+
+    # Image gen
+    # device: auto | cuda | cpu, dtype: auto | float32 | bfloat16 | float16
+    # backend: torch | openvino | onnx (openvino / onnx need optimum installed)
+    IMAGE_GEN_DEVICE = os.getenv("IMAGE_GEN_DEVICE", "auto")
+    IMAGE_GEN_DTYPE = os.getenv("IMAGE_GEN_DTYPE", "auto")
+    IMAGE_GEN_NUM_THREADS = int(os.getenv("IMAGE_GEN_NUM_THREADS", "0"))
+    IMAGE_GEN_BACKEND = os.getenv("IMAGE_GEN_BACKEND", "torch")
+    IMAGE_GEN_EXPORT_DIR = os.path.join(PROJECT_DIR, "exported-models")
+    IMAGE_GEN_HEIGHT = int(os.getenv("IMAGE_GEN_HEIGHT", "512"))
+    IMAGE_GEN_WIDTH = int(os.getenv("IMAGE_GEN_WIDTH", "512"))
+    IMAGE_GEN_NUM_INFERENCE_STEPS = int(os.getenv("IMAGE_GEN_NUM_INFERENCE_STEPS", "4"))
+    IMAGE_GEN_STREAM_PREVIEWS = os.getenv(
+        "IMAGE_GEN_STREAM_PREVIEWS", "True"
+    ).lower() in (
+        "true",
+        "1",
+        "t",
+    )
+
+    # Lets the chat component tell image progress streams from text streams
+    STREAM_TYPE_HEADER = "X-Stream-Type"
 
     DB_ADAPTER = os.getenv("DB_ADAPTER")
     DB_HOSTNAME = os.getenv("DB_HOSTNAME")
@@ -49,13 +85,179 @@ class Config:
 
     INFERENCE_API_URL = os.getenv("INFERENCE_API_URL")
     MODEL = os.getenv("INFERENCE_MODEL_NAME")
+    # llama.cpp prompt (KV) cache reuse between requests of a chat
+    INFERENCE_CACHE_PROMPT = os.getenv("INFERENCE_CACHE_PROMPT", "True").lower() in (
+        "true",
+        "1",
+        "t",
+    )
+    # Server slots (--parallel), chats are pinned to one, 0 = let the server pick
+    INFERENCE_NUM_SLOTS = int(os.getenv("INFERENCE_NUM_SLOTS", "1"))
+    # prefix_stable (RAG context after the last message, summaries kept for a
+    # few turns) | rag_first
+    PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "prefix_stable")
+    # Longest chat answer in tokens, 0 = until the model stops (other calls
+    # have fixed limits, see GENERATION_PROFILES)
+    CHAT_MAX_TOKENS = int(os.getenv("CHAT_MAX_TOKENS", "1024"))
+    # Identical concurrent chat streams share one generation
+    LLM_COALESCE_STREAMS = os.getenv("LLM_COALESCE_STREAMS", "False").lower() in (
+        "true",
+        "1",
+        "t",
+    )
+
+    # none | memory | sqlite (kept across restarts and shared by workers)
+    LLM_RESPONSE_CACHE_BACKEND = os.getenv("LLM_RESPONSE_CACHE_BACKEND", "none")
+    LLM_RESPONSE_CACHE_FILEPATH = os.path.join(CACHE_DIR, "llm-responses.sqlite3")
+    LLM_RESPONSE_CACHE_MAX_ENTRIES = int(
+        os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", "10000")
+    )
+    # 0 = no expiry
+    LLM_RESPONSE_CACHE_TTL_SECONDS = int(
+        os.getenv("LLM_RESPONSE_CACHE_TTL_SECONDS", "86400")
+    )
+    # AppLlm methods using the cache, comma separated
+    LLM_RESPONSE_CACHE_CALLERS = [
+        caller
+        for caller in os.getenv(
+            "LLM_RESPONSE_CACHE_CALLERS",
+            "classify_message,get_diffusion_prompt_from_input,get_chat_summary",
+        ).split(",")
+        if caller
+    ]
 
     INFERENCE_SMALL_API_URL = os.getenv("INFERENCE_SMALL_API_URL")
+    # Replicas per model tier, comma separated, default to the single URLs
+    INFERENCE_API_URLS = [
+        url
+        for url in (
+            os.getenv("INFERENCE_API_URLS", "") or INFERENCE_API_URL or ""
+        ).split(",")
+        if url
+    ]
+    INFERENCE_SMALL_API_URLS = [
+        url
+        for url in (
+            os.getenv("INFERENCE_SMALL_API_URLS", "") or INFERENCE_SMALL_API_URL or ""
+        ).split(",")
+        if url
+    ]
+    # least_outstanding | ewma_latency
+    MODEL_ROUTER_STRATEGY = os.getenv("MODEL_ROUTER_STRATEGY", "least_outstanding")
+    # tier:fallback tier pairs, comma separated
+    MODEL_ROUTER_FALLBACKS = os.getenv("MODEL_ROUTER_FALLBACKS", "small:large")
+    MODEL_ROUTER_EJECTION_SECONDS = float(
+        os.getenv("MODEL_ROUTER_EJECTION_SECONDS", "30")
+    )
+    # Health checks run in the `python -m app` server only, 0 disables them.
+    # Failing requests still eject backends either way
+    MODEL_ROUTER_HEALTH_CHECK_INTERVAL_SECONDS = int(
+        os.getenv("MODEL_ROUTER_HEALTH_CHECK_INTERVAL_SECONDS", "10")
+    )
+
+    # Generations in flight per tier (0 = unlimited), the large tier defaults
+    # to one per server slot
+    ADMISSION_MAX_CONCURRENCY = int(
+        os.getenv("ADMISSION_MAX_CONCURRENCY")
+        or max(INFERENCE_NUM_SLOTS, 1) * max(len(INFERENCE_API_URLS), 1)
+    )
+    ADMISSION_SMALL_MAX_CONCURRENCY = int(
+        os.getenv("ADMISSION_SMALL_MAX_CONCURRENCY", "4")
+    )
+    # Requests waiting per tier, more are answered with 429 right away
+    ADMISSION_MAX_QUEUE_SIZE = int(os.getenv("ADMISSION_MAX_QUEUE_SIZE", "16"))
+    ADMISSION_QUEUE_TIMEOUT_SECONDS = float(
+        os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10")
+    )
 
     INFINITY_INSTANCE_URL = os.getenv("INFINITY_INSTANCE_URL")
     EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+    # float | base64 (float32 bytes, smaller and faster to decode)
+    EMBEDDING_ENCODING_FORMAT = os.getenv("EMBEDDING_ENCODING_FORMAT", "base64")
+    # Dimensions etc. of probed embedding models
+    EMBEDDING_MODEL_REGISTRY_FILEPATH = os.path.join(CACHE_DIR, "embedding-models.json")
 
     SEARCH_HOSTNAME = os.getenv("OPENSEARCH_HOSTNAME")
     SEARCH_PORT = os.getenv("OPENSEARCH_REST_API_PORT_HOST")
     SEARCH_USER = os.getenv("OPENSEARCH_USER")
     SEARCH_PASSWORD = os.getenv("OPENSEARCH_PASSWORD")
+    # kNN index profile, changing the engine, space type, m or ef_construction
+    # needs a reindex. ef_search is a query time setting.
+    # nmslib | faiss | lucene (int8 vectors need lucene)
+    OPENSEARCH_KNN_ENGINE = os.getenv("OPENSEARCH_KNN_ENGINE", "") or (
+        "lucene" if os.getenv("VECTOR_QUANTIZATION") == "int8" else "nmslib"
+    )
+    # l2 | cosinesimil | innerproduct (int8 vectors need cosinesimil)
+    OPENSEARCH_KNN_SPACE_TYPE = os.getenv("OPENSEARCH_KNN_SPACE_TYPE", "") or (
+        "cosinesimil" if os.getenv("VECTOR_QUANTIZATION") == "int8" else "l2"
+    )
+    OPENSEARCH_KNN_M = int(os.getenv("OPENSEARCH_KNN_M", "16"))
+    OPENSEARCH_KNN_EF_CONSTRUCTION = int(
+        os.getenv("OPENSEARCH_KNN_EF_CONSTRUCTION", "100")
+    )
+    OPENSEARCH_KNN_EF_SEARCH = int(os.getenv("OPENSEARCH_KNN_EF_SEARCH", "100"))
+    OPENSEARCH_NUMBER_OF_SHARDS = int(os.getenv("OPENSEARCH_NUMBER_OF_SHARDS", "4"))
+    OPENSEARCH_NUMBER_OF_REPLICAS = int(os.getenv("OPENSEARCH_NUMBER_OF_REPLICAS", "1"))
+
+    # Document chunks, in tokens of CHUNK_TOKENIZER (a Hugging Face tokenizer,
+    # usually the embedding model) or approximated when that's empty
+    CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "200"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "20"))
+    CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "") or None
+    # Processes parsing and chunking files
+    INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "1"))
+    # Chunks per embedding request / per index write, batches buffered between
+    # ingestion stages
+    INGESTION_BATCH_SIZE = int(os.getenv("INGESTION_BATCH_SIZE", "32"))
+    INGESTION_INDEX_BATCH_SIZE = int(os.getenv("INGESTION_INDEX_BATCH_SIZE", "256"))
+    INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", "4"))
+    # Concurrent embedding requests
+    INGESTION_EMBEDDING_WORKERS = int(os.getenv("INGESTION_EMBEDDING_WORKERS", "2"))
+    # Near duplicate chunks (MinHash Jaccard estimate) are skipped, 0 disables
+    INGESTION_DEDUP_THRESHOLD = float(os.getenv("INGESTION_DEDUP_THRESHOLD", "0.9"))
+    # Chunks compared against, about 1.5 KB each, older ones are forgotten.
+    # 0 = all chunks of the run
+    INGESTION_DEDUP_MAX_ENTRIES = int(
+        os.getenv("INGESTION_DEDUP_MAX_ENTRIES", "100000")
+    )
+
+    # opensearch | local (in process index, no OpenSearch needed)
+    SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "opensearch")
+    # none | int8 (stored vectors about 4x smaller, needs a reindex to change)
+    VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+    LOCAL_SEARCH_INDEX_DIR = os.path.join(PROJECT_DIR, "search-index")
+    # Needs hnswlib installed
+    LOCAL_SEARCH_USE_HNSW = os.getenv("LOCAL_SEARCH_USE_HNSW", "False").lower() in (
+        "true",
+        "1",
+        "t",
+    )
+
+    # Empty: hybrid search is done by the backend, rrf | min_max: keyword and
+    # vector queries run in parallel and get fused in the app
+    SEARCH_FUSION_METHOD = os.getenv("SEARCH_FUSION_METHOD", "") or None
+    # keyword, vector
+    SEARCH_FUSION_WEIGHTS = [
+        float(weight)
+        for weight in os.getenv("SEARCH_FUSION_WEIGHTS", "0.3,0.7").split(",")
+    ]
+    # Results fetched per query before fusing
+    SEARCH_FUSION_CANDIDATES = int(os.getenv("SEARCH_FUSION_CANDIDATES", "20"))
+    SEARCH_FUSION_RRF_K = int(os.getenv("SEARCH_FUSION_RRF_K", "60"))
+
+    # Entries, 0 disables the cache
+    SEARCH_EMBEDDING_CACHE_SIZE = int(os.getenv("SEARCH_EMBEDDING_CACHE_SIZE", "1024"))
+    SEARCH_RESULTS_CACHE_SIZE = int(os.getenv("SEARCH_RESULTS_CACHE_SIZE", "512"))
+    # Seconds, 0 = no expiry. The local backend notices a `flask reindex` run
+    # by itself, with OpenSearch this is how long results can predate it
+    SEARCH_RESULTS_CACHE_TTL_SECONDS = int(
+        os.getenv("SEARCH_RESULTS_CACHE_TTL_SECONDS", "300")
+    )
+
+    # Empty: no reranking, infinity: /rerank on the Infinity instance,
+    # cross_encoder: in process (needs sentence-transformers)
+    RERANK_BACKEND = os.getenv("RERANK_BACKEND", "")
+    RERANK_MODEL = os.getenv("RERANK_MODEL", "mixedbread-ai/mxbai-rerank-xsmall-v1")
+    RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+    RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+    RERANK_DEADLINE_SECONDS = float(os.getenv("RERANK_DEADLINE_SECONDS", "1.0"))
@@ -0,0 +1,293 @@
+import math
+import os
+import pickle
+import re
+import threading
+
+from array import array
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Keep this short, BM25's idf already discounts common words
+STOP_WORDS = frozenset(
+    (
+        "a an and are as at be by for from has in is it of on or that the to was "
+        "with"
+    ).split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOP_WORDS
+    ]
+
+
+#########
+# Varint
+#########
+def encode_varint(value: int, output: bytearray) -> None:
+    # 7 bits per byte, high bit set means more bytes follow
+    while value >= 0x80:
+        output.append((value & 0x7F) | 0x80)
+        value >>= 7
+
+    output.append(value)
+
+
+def decode_varints(data: bytes | bytearray) -> list[int]:
+    values = []
+    value = 0
+    shift = 0
+
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+
+    return values
+
+
+class PostingList:
+    """
+    (doc number, term frequency) pairs for one term. Doc numbers only ever
+    increase, so they are stored as deltas, and both values as varints.
+    """
+
+    __slots__ = ("data", "last_doc_number", "doc_frequency")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.last_doc_number = 0
+        self.doc_frequency = 0
+
+    def add(self, doc_number: int, term_frequency: int) -> None:
+        encode_varint(doc_number - self.last_doc_number, self.data)
+        encode_varint(term_frequency, self.data)
+
+        self.last_doc_number = doc_number
+        self.doc_frequency += 1
+
+    def __iter__(self):
+        values = decode_varints(self.data)
+        doc_number = 0
+
+        for i in range(0, len(values), 2):
+            doc_number += values[i]
+
+            yield doc_number, values[i + 1]
+
+
+class BM25Index:
+    """
+    Inverted index with BM25 scoring, documents are added and deleted by id.
+    Deletes are tombstones until enough pile up, then postings get rebuilt.
+    https://en.wikipedia.org/wiki/Okapi_BM25
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, compact_ratio: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+
+        self.lock = threading.RLock()
+
+        self.postings: dict[str, PostingList] = {}
+        # Internal doc number -> id (None once deleted) and token count
+        self.doc_ids: list[str | None] = []
+        self.doc_lengths = array("I")
+        self.doc_numbers: dict[str, int] = {}
+
+        self.total_length = 0
+        self.deleted_count = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_numbers)
+
+    @property
+    def average_doc_length(self) -> float:
+        return self.total_length / len(self) if len(self) else 0.0
+
+    ##########
+    # Writes
+    ##########
+    def add(self, doc_id: str, text: str) -> None:
+        with self.lock:
+            if doc_id in self.doc_numbers:
+                self.delete(doc_id)
+
+            term_frequencies = Counter(tokenize(text))
+            doc_number = len(self.doc_ids)
+            doc_length = sum(term_frequencies.values())
+
+            self.doc_ids.append(doc_id)
+            self.doc_lengths.append(doc_length)
+            self.doc_numbers[doc_id] = doc_number
+            self.total_length += doc_length
+
+            for term, term_frequency in term_frequencies.items():
+                if term not in self.postings:
+                    self.postings[term] = PostingList()
+
+                self.postings[term].add(doc_number, term_frequency)
+
+    def delete(self, doc_id: str) -> bool:
+        with self.lock:
+            doc_number = self.doc_numbers.pop(doc_id, None)
+
+            if doc_number is None:
+                return False
+
+            self.total_length -= self.doc_lengths[doc_number]
+            self.doc_ids[doc_number] = None
+            self.deleted_count += 1
+
+            if self.deleted_count > self.compact_ratio * len(self.doc_ids):
+                self.compact()
+
+            return True
+
+    def compact(self) -> None:
+        # Drop tombstoned docs from the postings and renumber the live ones
+        with self.lock:
+            new_doc_numbers = {}
+            doc_ids = []
+            doc_lengths = array("I")
+
+            for doc_number, doc_id in enumerate(self.doc_ids):
+                if doc_id is not None:
+                    new_doc_numbers[doc_number] = len(doc_ids)
+                    doc_ids.append(doc_id)
+                    doc_lengths.append(self.doc_lengths[doc_number])
+
+            postings = {}
+
+            for term, posting_list in self.postings.items():
+                new_posting_list = PostingList()
+
+                for doc_number, term_frequency in posting_list:
+                    if doc_number in new_doc_numbers:
+                        new_posting_list.add(
+                            new_doc_numbers[doc_number], term_frequency
+                        )
+
+                if new_posting_list.doc_frequency:
+                    postings[term] = new_posting_list
+
+            self.postings = postings
+            self.doc_ids = doc_ids
+            self.doc_lengths = doc_lengths
+            self.doc_numbers = {
+                doc_id: doc_number for doc_number, doc_id in enumerate(doc_ids)
+            }
+            self.deleted_count = 0
+
+    #########
+    # Search
+    #########
+    def search(self, text: str, size: int = 3) -> list[tuple[str, float]]:
+        with self.lock:
+            number_of_docs = len(self)
+
+            if number_of_docs == 0:
+                return []
+
+            average_doc_length = self.average_doc_length
+            scores: dict[int, float] = {}
+
+            for term in set(tokenize(text)):
+                posting_list = self.postings.get(term)
+
+                if posting_list is None:
+                    continue
+
+                # Tombstoned docs are still counted until the next compaction
+                doc_frequency = posting_list.doc_frequency
+                idf = math.log(
+                    1 + (number_of_docs - doc_frequency + 0.5) / (doc_frequency + 0.5)
+                )
+
+                for doc_number, term_frequency in posting_list:
+                    if self.doc_ids[doc_number] is None:
+                        continue
+
+                    length_norm = (
+                        1
+                        - self.b
+                        + self.b * (self.doc_lengths[doc_number] / average_doc_length)
+                    )
+                    scores[doc_number] = scores.get(doc_number, 0.0) + idf * (
+                        term_frequency
+                        * (self.k1 + 1)
+                        / (term_frequency + self.k1 * length_norm)
+                    )
+
+            top_scores = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+            return [
+                (self.doc_ids[doc_number], score)
+                for doc_number, score in top_scores[:size]
+            ]
+
+    ##############
+    # Persistence
+    ##############
+    def save(self, filepath: str) -> None:
+        with self.lock:
+            state = {
+                "k1": self.k1,
+                "b": self.b,
+                "postings": {
+                    term: (
+                        bytes(posting_list.data),
+                        posting_list.last_doc_number,
+                        posting_list.doc_frequency,
+                    )
+                    for term, posting_list in self.postings.items()
+                },
+                "doc_ids": self.doc_ids,
+                "doc_lengths": self.doc_lengths.tobytes(),
+                "total_length": self.total_length,
+                "deleted_count": self.deleted_count,
+            }
+
+        temp_filepath = f"{filepath}.tmp"
+
+        with open(temp_filepath, "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temp_filepath, filepath)
+
+    @classmethod
+    def load(cls, filepath: str) -> "BM25Index":
+        with open(filepath, "rb") as file:
+            state = pickle.load(file)
+
+        index = cls(k1=state["k1"], b=state["b"])
+
+        for term, (data, last_doc_number, doc_frequency) in state["postings"].items():
+            posting_list = PostingList()
+            posting_list.data = bytearray(data)
+            posting_list.last_doc_number = last_doc_number
+            posting_list.doc_frequency = doc_frequency
+            index.postings[term] = posting_list
+
+        index.doc_ids = state["doc_ids"]
+        index.doc_lengths.frombytes(state["doc_lengths"])
+        index.doc_numbers = {
+            doc_id: doc_number
+            for doc_number, doc_id in enumerate(index.doc_ids)
+            if doc_id is not None
+        }
+        index.total_length = state["total_length"]
+        index.deleted_count = state["deleted_count"]
+
+        return index
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class EmbeddingModelInfo:
+    model: str
+    dimensions: int
+    # mean | cls | last_token, None when unknown (probed models)
+    pooling: str | None = None
+    # Unit length output, dot product == cosine similarity
+    normalized: bool | None = None
+
+
+# Common models, so these never need a probe
+KNOWN_MODELS = {
+    info.model: info
+    for info in (
+        EmbeddingModelInfo("sentence-transformers/all-MiniLM-L6-v2", 384, "mean", True),
+        EmbeddingModelInfo("all-MiniLM-L6-v2", 384, "mean", True),
+        EmbeddingModelInfo(
+            "sentence-transformers/all-MiniLM-L12-v2", 384, "mean", True
+        ),
+        EmbeddingModelInfo("BAAI/bge-small-en-v1.5", 384, "cls", True),
+        EmbeddingModelInfo("BAAI/bge-base-en-v1.5", 768, "cls", True),
+        EmbeddingModelInfo("BAAI/bge-large-en-v1.5", 1024, "cls", True),
+        EmbeddingModelInfo("nomic-ai/nomic-embed-text-v1.5", 768, "mean", True),
+        EmbeddingModelInfo("mixedbread-ai/mxbai-embed-large-v1", 1024, "cls", True),
+    )
+}
+
+
+class EmbeddingModelRegistry:
+    """
+    Embedding model metadata cached in memory and in a JSON file. Unknown
+    models are probed lazily, at most once per model even with concurrent
+    callers, and the result survives restarts.
+    """
+
+    def __init__(self, filepath: str | None = None):
+        self.filepath = filepath
+        self.models: dict[str, EmbeddingModelInfo] = dict(KNOWN_MODELS)
+        self.lock = threading.Lock()
+        self.probe_locks: dict[str, threading.Lock] = {}
+        self.probes = 0
+
+        self.load()
+
+    def get(self, model: str) -> EmbeddingModelInfo | None:
+        return self.models.get(model)
+
+    def set(self, info: EmbeddingModelInfo) -> None:
+        with self.lock:
+            if self.models.get(info.model) == info:
+                return
+
+            self.models[info.model] = info
+            self.save()
+
+    def get_or_probe(
+        self, model: str, probe: Callable[[], EmbeddingModelInfo]
+    ) -> EmbeddingModelInfo:
+        if info := self.get(model):
+            return info
+
+        with self.lock:
+            probe_lock = self.probe_locks.setdefault(model, threading.Lock())
+
+        # Callers for the same model wait for the first probe instead of
+        # sending their own
+        with probe_lock:
+            if info := self.get(model):
+                return info
+
+            info = probe()
+            self.probes += 1
+            self.set(info)
+
+            return info
+
+    ########
+    # Disk
+    ########
+    def load(self) -> None:
+        if not self.filepath or not os.path.exists(self.filepath):
+            return
+
+        try:
+            with open(self.filepath, "r") as file:
+                stored_models = json.load(file)
+        except (OSError, ValueError):
+            # A broken cache only costs a probe
+            return
+
+        for model_info in stored_models:
+            info = EmbeddingModelInfo(**model_info)
+            self.models[info.model] = info
+
+    def save(self) -> None:
+        if not self.filepath:
+            return
+
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        stored_models = [
+            asdict(info)
+            for model, info in self.models.items()
+            if KNOWN_MODELS.get(model) != info
+        ]
+        temp_filepath = f"{self.filepath}.tmp"
+
+        with open(temp_filepath, "w") as file:
+            json.dump(stored_models, file, indent=2)
+
+        os.replace(temp_filepath, self.filepath)
@@ -0,0 +1,65 @@
+from collections.abc import Callable
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """
+    Generation limits for one kind of LLM call. max_tokens, stop and
+    temperature go to the server, stop_when is checked client side on the
+    content received so far and ends the generation once it returns True.
+    """
+
+    # None = the server's default
+    max_tokens: int | None = None
+    stop: tuple[str, ...] = ()
+    temperature: float | None = None
+    stop_when: Callable[[str], bool] | None = None
+
+    def get_request_params(self) -> dict:
+        params = {}
+
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+
+        if self.stop:
+            params["stop"] = list(self.stop)
+
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+
+        return params
+
+
+def get_json_object_end(text: str) -> int | None:
+    """
+    Index right after the first complete top level JSON object in text, None
+    while it's still open. Braces inside strings don't count.
+    """
+    depth = 0
+    is_in_string = False
+    is_escaped = False
+
+    for index, character in enumerate(text):
+        if is_in_string:
+            if is_escaped:
+                is_escaped = False
+            elif character == "\\":
+                is_escaped = True
+            elif character == '"':
+                is_in_string = False
+        elif character == '"':
+            is_in_string = True
+        elif character == "{":
+            depth += 1
+        elif character == "}" and depth > 0:
+            depth -= 1
+
+            if depth == 0:
+                return index + 1
+
+    return None
+
+
+def is_json_object_complete(text: str) -> bool:
+    return get_json_object_end(text) is not None
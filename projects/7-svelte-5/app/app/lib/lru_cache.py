@@ -0,0 +1,74 @@
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Hashable
+
+MISSING = object()
+
+
+class LruCache:
+    """
+    Thread safe least recently used cache with hit / miss counters. Entries
+    older than ttl_seconds (0 = never) count as misses.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+
+        self.lock = threading.Lock()
+        # key -> (stored_at, value)
+        self.items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            entry = self.items.get(key, MISSING)
+
+            if entry is not MISSING and self.is_expired(entry[0]):
+                del self.items[key]
+                entry = MISSING
+
+            if entry is MISSING:
+                self.misses += 1
+                return default
+
+            self.items.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+
+        with self.lock:
+            self.items[key] = (time.monotonic(), value)
+            self.items.move_to_end(key)
+
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def is_expired(self, stored_at: float) -> bool:
+        return (
+            bool(self.ttl_seconds) and time.monotonic() - stored_at > self.ttl_seconds
+        )
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.items),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
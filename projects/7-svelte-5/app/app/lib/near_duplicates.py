@@ -0,0 +1,151 @@
+import re
+import zlib
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Mersenne prime for the universal hash (a * x + b) % p. Shingle hashes are
+# 32 bit and a, b < 2**31, so nothing overflows uint64.
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+
+def get_shingle_hashes(text: str, shingle_size: int = 5) -> np.ndarray:
+    # Word shingles, so whitespace and punctuation changes don't matter
+    words = WORD_PATTERN.findall(text.lower())
+
+    if len(words) < shingle_size:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [
+            " ".join(words[i : i + shingle_size])
+            for i in range(len(words) - shingle_size + 1)
+        ]
+
+    unique_shingles = set(shingles)
+
+    return np.fromiter(
+        (zlib.crc32(shingle.encode()) for shingle in unique_shingles),
+        dtype=np.uint64,
+        count=len(unique_shingles),
+    )
+
+
+def get_lsh_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    """
+    (bands, rows per band) whose S curve threshold (1 / bands) ** (1 / rows)
+    is closest to the Jaccard threshold.
+    """
+    options = [
+        (num_perm // rows, rows)
+        for rows in range(1, num_perm + 1)
+        if num_perm % rows == 0
+    ]
+
+    return min(
+        options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold)
+    )
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures over word shingles, bucketed with LSH so each new text
+    is only compared against likely candidates. Texts whose estimated Jaccard
+    similarity with an indexed one reaches the threshold are duplicates.
+    A signature is num_perm uint64 (1 KB by default) plus its bucket entries,
+    past max_entries (0 = no limit) the oldest texts are forgotten, so only
+    duplicates of those get through.
+    https://en.wikipedia.org/wiki/MinHash
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        num_perm: int = 128,
+        shingle_size: int = 5,
+        seed: int = 1,
+        max_entries: int = 0,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = get_lsh_bands(num_perm, threshold)
+
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+
+        # Insertion ordered, the first key is the oldest
+        self.signatures: dict[str, np.ndarray] = {}
+        self.buckets: list[dict[bytes, list[str]]] = [{} for _ in range(self.bands)]
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def get_signature(self, text: str) -> np.ndarray:
+        shingle_hashes = get_shingle_hashes(text, shingle_size=self.shingle_size)
+        # (shingles, num_perm) permuted hashes, min over the shingles
+        permuted_hashes = (np.outer(shingle_hashes, self.a) + self.b) % MERSENNE_PRIME
+
+        return permuted_hashes.min(axis=0)
+
+    def get_band_keys(self, signature: np.ndarray) -> list[bytes]:
+        return [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def find_duplicate(
+        self, signature: np.ndarray, band_keys: list[bytes]
+    ) -> str | None:
+        checked_keys = set()
+
+        for band, band_key in enumerate(band_keys):
+            for key in self.buckets[band].get(band_key, []):
+                if key in checked_keys:
+                    continue
+
+                checked_keys.add(key)
+                similarity = np.mean(self.signatures[key] == signature)
+
+                if similarity >= self.threshold:
+                    return key
+
+        return None
+
+    def add_if_new(self, key: str, text: str) -> str | None:
+        """
+        Returns the key of the indexed near duplicate, or None after adding
+        the text to the index.
+        """
+        signature = self.get_signature(text)
+        band_keys = self.get_band_keys(signature)
+        duplicate_key = self.find_duplicate(signature, band_keys)
+
+        if duplicate_key is not None:
+            return duplicate_key
+
+        self.signatures[key] = signature
+
+        for band, band_key in enumerate(band_keys):
+            self.buckets[band].setdefault(band_key, []).append(key)
+
+        if self.max_entries and len(self.signatures) > self.max_entries:
+            self.evict_oldest()
+
+        return None
+
+    def evict_oldest(self) -> None:
+        key = next(iter(self.signatures))
+        signature = self.signatures.pop(key)
+
+        for band, band_key in enumerate(self.get_band_keys(signature)):
+            bucket = self.buckets[band][band_key]
+            bucket.remove(key)
+
+            if not bucket:
+                del self.buckets[band][band_key]
+
+        self.evicted += 1
@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+import zlib
+
+from app.lib.lru_cache import LruCache
+
+
+def serialize_messages(messages: list[dict]) -> str:
+    # Stand-in for the prompt the server renders, same order, same bytes
+    return json.dumps(messages, ensure_ascii=False, separators=(",", ":"))
+
+
+def get_common_prefix_length(a: str, b: str) -> int:
+    return len(os.path.commonprefix([a, b]))
+
+
+def get_slot_id(cache_key: str, num_slots: int) -> int:
+    # Stable across processes (unlike hash()), so a chat keeps its slot
+    return zlib.crc32(str(cache_key).encode()) % num_slots
+
+
+class PrefixReuseTracker:
+    """
+    How much of each prompt repeats the previous prompt with the same cache
+    key (i.e. the same chat). That's the part a prefix / KV cache on the
+    inference server can skip. Server reported cached tokens are counted
+    separately when the backend returns them.
+    """
+
+    def __init__(self, max_keys: int = 1024):
+        self.last_prompts = LruCache(max_size=max_keys)
+        self.lock = threading.Lock()
+
+        self.requests = 0
+        self.prompt_chars = 0
+        self.reused_chars = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record_prompt(self, cache_key: str, prompt: str) -> float:
+        last_prompt = self.last_prompts.get(cache_key, "")
+        reused_chars = get_common_prefix_length(last_prompt, prompt)
+        self.last_prompts.set(cache_key, prompt)
+
+        with self.lock:
+            self.requests += 1
+            self.prompt_chars += len(prompt)
+            self.reused_chars += reused_chars
+
+        return reused_chars / len(prompt) if prompt else 0.0
+
+    def record_server_timings(self, timings: dict) -> None:
+        # llama.cpp: prompt_n tokens were evaluated, cache_n came from the cache
+        cached_tokens = timings.get("cache_n", 0)
+
+        with self.lock:
+            self.prompt_tokens += timings.get("prompt_n", 0) + cached_tokens
+            self.cached_tokens += cached_tokens
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "prefix_reuse_ratio": (
+                    round(self.reused_chars / self.prompt_chars, 3)
+                    if self.prompt_chars
+                    else 0.0
+                ),
+                "server_cached_tokens": self.cached_tokens,
+                "server_cache_ratio": (
+                    round(self.cached_tokens / self.prompt_tokens, 3)
+                    if self.prompt_tokens
+                    else 0.0
+                ),
+            }
@@ -0,0 +1,104 @@
+"""
+Combine ranked search hit lists (OpenSearch style dicts with "_id" and
+"_score") into one list. Used for client-side hybrid search, so it works the
+same for every search backend.
+"""
+
+FUSION_METHODS = ("rrf", "min_max")
+
+# From the original RRF paper, works well without tuning
+# https://plg.uwaterloo.ca/~gvcormac/cormacksigir09-rrf.pdf
+DEFAULT_RRF_K = 60
+
+
+def get_weights(number_of_lists: int, weights: list[float] | None) -> list[float]:
+    if weights is None:
+        return [1.0] * number_of_lists
+
+    if len(weights) != number_of_lists:
+        raise ValueError(
+            f"Got {len(weights)} weights for {number_of_lists} result lists."
+        )
+
+    return list(weights)
+
+
+def build_fused_hits(
+    fused_scores: dict[str, float], hits_by_id: dict[str, dict], size: int
+) -> list[dict]:
+    top_ids = sorted(fused_scores, key=fused_scores.get, reverse=True)
+
+    return [{**hits_by_id[id], "_score": fused_scores[id]} for id in top_ids[:size]]
+
+
+def reciprocal_rank_fusion(
+    result_lists: list[list[dict]],
+    size: int,
+    weights: list[float] | None = None,
+    k: int = DEFAULT_RRF_K,
+) -> list[dict]:
+    """
+    Only ranks are used, so keyword and vector scores don't need to be on
+    the same scale: score = sum(weight / (k + rank)).
+    """
+    weights = get_weights(len(result_lists), weights)
+    fused_scores = {}
+    hits_by_id = {}
+
+    for hits, weight in zip(result_lists, weights):
+        for rank, hit in enumerate(hits, start=1):
+            fused_scores[hit["_id"]] = fused_scores.get(hit["_id"], 0.0) + weight / (
+                k + rank
+            )
+            hits_by_id.setdefault(hit["_id"], hit)
+
+    return build_fused_hits(fused_scores, hits_by_id, size)
+
+
+def min_max_fusion(
+    result_lists: list[list[dict]],
+    size: int,
+    weights: list[float] | None = None,
+) -> list[dict]:
+    """
+    Same as the OpenSearch normalization processor with min_max and
+    arithmetic_mean: scale each list to [0, 1], then a weighted sum.
+    """
+    weights = get_weights(len(result_lists), weights)
+    fused_scores = {}
+    hits_by_id = {}
+
+    for hits, weight in zip(result_lists, weights):
+        if not hits:
+            continue
+
+        scores = [hit["_score"] for hit in hits]
+        min_score, max_score = min(scores), max(scores)
+        score_range = max_score - min_score
+
+        for hit in hits:
+            normalized_score = (
+                (hit["_score"] - min_score) / score_range if score_range else 1.0
+            )
+            fused_scores[hit["_id"]] = (
+                fused_scores.get(hit["_id"], 0.0) + weight * normalized_score
+            )
+            hits_by_id.setdefault(hit["_id"], hit)
+
+    return build_fused_hits(fused_scores, hits_by_id, size)
+
+
+def fuse_results(
+    result_lists: list[list[dict]],
+    size: int,
+    method: str = "rrf",
+    weights: list[float] | None = None,
+    rrf_k: int = DEFAULT_RRF_K,
+) -> list[dict]:
+    if method == "rrf":
+        return reciprocal_rank_fusion(result_lists, size=size, weights=weights, k=rrf_k)
+
+    if method == "min_max":
+        return min_max_fusion(result_lists, size=size, weights=weights)
+
+    raise ValueError(f"Unknown fusion method: {method}, use one of {FUSION_METHODS}")
@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from abc import ABC, abstractmethod
+
+from app.lib.lru_cache import LruCache
+
+RESPONSE_CACHE_BACKENDS = ("memory", "sqlite")
+
+
+class ResponseCache(ABC):
+    """
+    JSON serializable values by string key, entries expire after ttl_seconds
+    (0 = never) and the least recently used ones go past max_entries.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+    @abstractmethod
+    def get(self, key: str):
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value) -> None:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+    @abstractmethod
+    def get_stats(self) -> dict:
+        pass
+
+    def is_expired(self, created_at: float, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - created_at > self.ttl_seconds
+
+
+class MemoryResponseCache(ResponseCache):
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 0):
+        super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        # (created_at, value)
+        self.entries = LruCache(max_size=max_entries)
+        self.expired = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+
+        created_at, value = entry
+
+        if self.is_expired(created_at, time.time()):
+            self.expired += 1
+            return None
+
+        return value
+
+    def set(self, key: str, value) -> None:
+        self.entries.set(key, (time.time(), value))
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def get_stats(self) -> dict:
+        return {**self.entries.get_stats(), "expired": self.expired}
+
+
+class SqliteResponseCache(ResponseCache):
+    """
+    Survives restarts and is shared by every worker process using the file.
+    """
+
+    def __init__(self, filepath: str, max_entries: int = 10000, ttl_seconds: float = 0):
+        super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.filepath = filepath
+
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+            "ON responses (accessed_at)"
+        )
+        self.connection.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, key: str):
+        now = time.time()
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, created_at = row
+
+            if self.is_expired(created_at, now):
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self.connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.connection.commit()
+            self.hits += 1
+
+        return json.loads(value)
+
+    def set(self, key: str, value) -> None:
+        now = time.time()
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            # Least recently used rows past the cap
+            self.connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.connection.commit()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            (size,) = self.connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()
+
+            return {
+                "size": size,
+                "max_size": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+            }
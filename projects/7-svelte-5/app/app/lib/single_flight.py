@@ -0,0 +1,200 @@
+import threading
+
+from collections.abc import Callable, Generator, Hashable, Iterator
+from typing import Any
+
+
+class Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first caller
+    runs the function, the others wait for and get its result (or error).
+    Nothing is kept once the call finished, this is not a cache.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: dict[Hashable, Call] = {}
+
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+
+            if is_leader:
+                call = Call()
+                self.calls[key] = call
+                self.executions += 1
+            else:
+                self.shared += 1
+
+        if not is_leader:
+            call.event.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+            call.event.set()
+
+        return call.result
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "in_flight": len(self.calls),
+                "executions": self.executions,
+                "shared": self.shared,
+            }
+
+
+class Broadcast:
+    """
+    One upstream iterator read by a background thread, every subscriber gets
+    all items from the start. The upstream is closed once every subscriber
+    left early.
+    """
+
+    def __init__(self, on_finished: Callable[[], None]):
+        self.on_finished = on_finished
+
+        self.condition = threading.Condition()
+        self.items: list = []
+        self.is_done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.is_cancelled = False
+
+    def add_subscriber(self) -> bool:
+        # Under the same lock the last leaving subscriber cancels with, so a
+        # new one either keeps the broadcast going or sees it's cancelled
+        with self.condition:
+            if self.is_cancelled:
+                return False
+
+            self.subscribers += 1
+
+            return True
+
+    def start(self, open_stream: Callable[[], Iterator]) -> None:
+        thread = threading.Thread(target=self.pump, args=(open_stream,), daemon=True)
+        thread.start()
+
+    def pump(self, open_stream: Callable[[], Iterator]) -> None:
+        upstream = None
+
+        try:
+            upstream = open_stream()
+
+            for item in upstream:
+                with self.condition:
+                    if self.is_cancelled:
+                        break
+
+                    self.items.append(item)
+                    self.condition.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            # Closing a generator runs its cleanup (i.e. closes the HTTP stream)
+            if upstream is not None and hasattr(upstream, "close"):
+                upstream.close()
+
+            with self.condition:
+                self.is_done = True
+                self.condition.notify_all()
+
+            self.on_finished()
+
+    def subscribe(self) -> Generator[Any, None, None]:
+        index = 0
+
+        try:
+            while True:
+                with self.condition:
+                    while index >= len(self.items) and not self.is_done:
+                        self.condition.wait()
+
+                    if index >= len(self.items):
+                        break
+
+                    item = self.items[index]
+
+                index += 1
+                yield item
+
+            if self.error is not None:
+                raise self.error
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+                if self.subscribers == 0 and not self.is_done:
+                    self.is_cancelled = True
+
+
+class StreamFanOut:
+    """
+    Like SingleFlight for generators: concurrent identical streams share one
+    upstream, later subscribers replay what was already produced.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.broadcasts: dict[Hashable, Broadcast] = {}
+
+        self.executions = 0
+        self.shared = 0
+
+    def subscribe(
+        self, key: Hashable, open_stream: Callable[[], Iterator]
+    ) -> Generator[Any, None, None]:
+        with self.lock:
+            broadcast = self.broadcasts.get(key)
+
+            if broadcast is not None and broadcast.add_subscriber():
+                self.shared += 1
+                is_leader = False
+            else:
+                broadcast = Broadcast(on_finished=lambda: self.remove(key, broadcast))
+                broadcast.add_subscriber()
+                self.broadcasts[key] = broadcast
+                self.executions += 1
+                is_leader = True
+
+        if is_leader:
+            broadcast.start(open_stream)
+
+        return broadcast.subscribe()
+
+    def remove(self, key: Hashable, broadcast: Broadcast) -> None:
+        with self.lock:
+            if self.broadcasts.get(key) is broadcast:
+                del self.broadcasts[key]
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "in_flight": len(self.broadcasts),
+                "executions": self.executions,
+                "shared": self.shared,
+            }
@@ -0,0 +1,13 @@
+import json
+
+
+def format_server_sent_event(data: dict, event: str | None = None) -> str:
+    # https://developer.mozilla.org/en-US/docs/Web/API/Server-sent_events/Using_server-sent_events#event_stream_format
+    message = ""
+
+    if event:
+        message += f"event: {event}\n"
+
+    message += f"data: {json.dumps(data)}\n\n"
+
+    return message
@@ -0,0 +1,38 @@
+import os
+
+from jinja2 import BaseLoader, Environment, ModuleLoader, Template, TemplateNotFound
+
+
+class FreshModuleLoader(ModuleLoader):
+    """
+    ModuleLoader that only serves a precompiled template when its module is
+    at least as new as the source, anything stale or missing raises
+    TemplateNotFound so a ChoiceLoader falls back to the sources.
+    """
+
+    def __init__(self, compiled_dir: str, source_loader: BaseLoader):
+        super().__init__(compiled_dir)
+
+        self.compiled_dir = compiled_dir
+        self.source_loader = source_loader
+
+    def is_fresh(self, environment: Environment, name: str) -> bool:
+        module_path = os.path.join(self.compiled_dir, self.get_module_filename(name))
+
+        if not os.path.exists(module_path):
+            return False
+
+        _, source_path, _ = self.source_loader.get_source(environment, name)
+
+        if source_path is None:
+            return False
+
+        return os.path.getmtime(source_path) <= os.path.getmtime(module_path)
+
+    def load(
+        self, environment: Environment, name: str, globals: dict | None = None
+    ) -> Template:
+        if not self.is_fresh(environment, name):
+            raise TemplateNotFound(name)
+
+        return super().load(environment, name, globals)
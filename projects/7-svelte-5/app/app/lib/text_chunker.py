@@ -0,0 +1,114 @@
+import re
+
+from collections.abc import Callable, Generator, Iterable
+
+# Words and single punctuation marks, close to what wordpiece / BPE tokenizers
+# produce for English prose
+APPROXIMATE_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# A sentence ends at . ! or ? (optionally followed by quotes or brackets) and
+# whitespace, paragraphs at blank lines
+SENTENCE_BOUNDARY_PATTERN = re.compile(
+    r"(?<=[.!?])\s+|(?<=[.!?][\"')\]])\s+|\n\s*\n"
+)
+
+
+def count_tokens_approximately(text: str) -> int:
+    return len(APPROXIMATE_TOKEN_PATTERN.findall(text))
+
+
+def split_sentences(text: str) -> list[str]:
+    return [
+        sentence.strip()
+        for sentence in SENTENCE_BOUNDARY_PATTERN.split(text)
+        if sentence and sentence.strip()
+    ]
+
+
+class TextChunker:
+    """
+    Packs whole sentences into chunks of at most chunk_size tokens, the last
+    sentences of a chunk (up to chunk_overlap tokens) start the next one.
+    Sentences longer than a chunk are split on words.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 200,
+        chunk_overlap: int = 20,
+        token_counter: Callable[[str], int] | None = None,
+    ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap has to be smaller than chunk_size.")
+
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.count_tokens = token_counter or count_tokens_approximately
+
+    def iter_chunks(self, blocks: Iterable[str]) -> Generator[str, None, None]:
+        """
+        blocks are pieces of one document (paragraphs, pages), so a document
+        never has to be in memory as a whole.
+        """
+        sentences: list[tuple[str, int]] = []
+        number_of_tokens = 0
+
+        for block in blocks:
+            for sentence in split_sentences(block):
+                for piece, piece_tokens in self.split_long_sentence(sentence):
+                    if sentences and number_of_tokens + piece_tokens > self.chunk_size:
+                        yield " ".join(text for text, _ in sentences)
+
+                        sentences = self.get_overlap(
+                            sentences, max_tokens=self.chunk_size - piece_tokens
+                        )
+                        number_of_tokens = sum(tokens for _, tokens in sentences)
+
+                    sentences.append((piece, piece_tokens))
+                    number_of_tokens += piece_tokens
+
+        if sentences:
+            yield " ".join(text for text, _ in sentences)
+
+    def split_long_sentence(
+        self, sentence: str
+    ) -> Generator[tuple[str, int], None, None]:
+        sentence_tokens = self.count_tokens(sentence)
+
+        if sentence_tokens <= self.chunk_size:
+            yield sentence, sentence_tokens
+            return
+
+        words = []
+        number_of_tokens = 0
+
+        for word in sentence.split():
+            word_tokens = self.count_tokens(word)
+
+            if words and number_of_tokens + word_tokens > self.chunk_size:
+                yield " ".join(words), number_of_tokens
+                words = []
+                number_of_tokens = 0
+
+            words.append(word)
+            number_of_tokens += word_tokens
+
+        if words:
+            yield " ".join(words), number_of_tokens
+
+    def get_overlap(
+        self, sentences: list[tuple[str, int]], max_tokens: int
+    ) -> list[tuple[str, int]]:
+        # The overlap plus the next sentence still has to fit in a chunk
+        max_tokens = min(self.chunk_overlap, max_tokens)
+        overlap = []
+        number_of_tokens = 0
+
+        for sentence, sentence_tokens in reversed(sentences):
+            if number_of_tokens + sentence_tokens > max_tokens:
+                break
+
+            overlap.insert(0, (sentence, sentence_tokens))
+            number_of_tokens += sentence_tokens
+
+        return overlap
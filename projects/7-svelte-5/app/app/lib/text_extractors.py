@@ -0,0 +1,123 @@
+import importlib.util
+import os
+
+from collections.abc import Callable, Generator
+from html.parser import HTMLParser
+
+# Files are read in pieces of about this size so big files never have to fit
+# in memory
+MAX_BLOCK_CHARACTERS = 64 * 1024
+
+
+def iter_plain_text_blocks(filepath: str) -> Generator[str, None, None]:
+    # Paragraphs, or MAX_BLOCK_CHARACTERS worth of lines if there are no
+    # blank lines for a while
+    lines = []
+    number_of_characters = 0
+
+    with open(filepath, "r", encoding="utf-8", errors="replace") as file:
+        for line in file:
+            if not line.strip() or number_of_characters > MAX_BLOCK_CHARACTERS:
+                if lines:
+                    yield "".join(lines)
+
+                lines = []
+                number_of_characters = 0
+
+            lines.append(line)
+            number_of_characters += len(line)
+
+    if lines:
+        yield "".join(lines)
+
+
+class HtmlTextParser(HTMLParser):
+    SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "head"}
+    BLOCK_TAGS = {
+        "address", "article", "aside", "blockquote", "br", "dd", "div", "dl",
+        "dt", "figcaption", "footer", "h1", "h2", "h3", "h4", "h5", "h6",
+        "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section",
+        "table", "td", "th", "tr", "ul",
+    }  # fmt: skip
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+
+        self.text_parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.text_parts.append("\n\n")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.text_parts.append("\n\n")
+
+    def handle_data(self, data: str) -> None:
+        if not self.skip_depth:
+            self.text_parts.append(data)
+
+    def pop_text(self) -> str:
+        text = "".join(self.text_parts)
+        self.text_parts = []
+
+        return text
+
+
+def iter_html_text_blocks(filepath: str) -> Generator[str, None, None]:
+    parser = HtmlTextParser()
+
+    with open(filepath, "r", encoding="utf-8", errors="replace") as file:
+        while data := file.read(MAX_BLOCK_CHARACTERS):
+            parser.feed(data)
+
+            if text := parser.pop_text():
+                yield text
+
+    parser.close()
+
+    if text := parser.pop_text():
+        yield text
+
+
+def iter_pdf_text_blocks(filepath: str) -> Generator[str, None, None]:
+    # Optional, needs pypdf installed
+    from pypdf import PdfReader
+
+    for page in PdfReader(filepath).pages:
+        yield page.extract_text() or ""
+
+
+TEXT_EXTRACTORS: dict[str, Callable[[str], Generator[str, None, None]]] = {
+    ".txt": iter_plain_text_blocks,
+    ".md": iter_plain_text_blocks,
+    ".html": iter_html_text_blocks,
+    ".htm": iter_html_text_blocks,
+    ".pdf": iter_pdf_text_blocks,
+}
+
+OPTIONAL_EXTRACTOR_MODULES = {".pdf": "pypdf"}
+
+
+def get_supported_extensions() -> list[str]:
+    return [
+        extension
+        for extension in TEXT_EXTRACTORS
+        if extension not in OPTIONAL_EXTRACTOR_MODULES
+        or importlib.util.find_spec(OPTIONAL_EXTRACTOR_MODULES[extension])
+    ]
+
+
+def iter_text_blocks(filepath: str) -> Generator[str, None, None]:
+    extension = os.path.splitext(filepath)[1].lower()
+    extractor = TEXT_EXTRACTORS.get(extension)
+
+    if extractor is None:
+        raise ValueError(f"No text extractor for {extension} files: {filepath}")
+
+    yield from extractor(filepath)
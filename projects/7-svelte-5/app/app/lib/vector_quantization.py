@@ -0,0 +1,83 @@
+import numpy as np
+
+QUANTIZATION_TYPES = ("none", "int8")
+
+
+def quantize_int8(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric scalar quantization with one scale per vector, the largest
+    component maps to +-127. About 4x smaller than float32.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=-1) / 127
+    # np.where so a single (1-D) vector works too
+    scales = np.where(scales == 0, 1.0, scales)
+
+    codes = np.rint(vectors / scales[..., None]).astype(np.int8)
+
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * scales[..., None]
+
+
+class Int8Vectors:
+    """
+    int8 codes + per vector scales that can stand in for a float32 matrix in
+    `matrix @ query`. Scores are computed block by block, so the codes (which
+    may be memory mapped) are never upcast all at once.
+    """
+
+    BLOCK_ROWS = 16384
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def from_float(cls, vectors: np.ndarray) -> "Int8Vectors":
+        return cls(*quantize_int8(vectors))
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, rows) -> "Int8Vectors":
+        return Int8Vectors(np.asarray(self.codes[rows]), np.asarray(self.scales[rows]))
+
+    def __matmul__(self, query: np.ndarray) -> np.ndarray:
+        # The query stays float32 (asymmetric), only stored vectors lose precision
+        query = np.asarray(query, dtype=np.float32)
+        scores = np.empty(len(self.codes), dtype=np.float32)
+
+        for start in range(0, len(self.codes), self.BLOCK_ROWS):
+            end = start + self.BLOCK_ROWS
+            scores[start:end] = (
+                self.codes[start:end].astype(np.float32) @ query
+            ) * self.scales[start:end]
+
+        return scores
+
+    def append(self, vectors: np.ndarray) -> "Int8Vectors":
+        codes, scales = quantize_int8(vectors)
+
+        return Int8Vectors(
+            np.concatenate([self.codes, codes]), np.concatenate([self.scales, scales])
+        )
+
+    def replace(self, rows: np.ndarray, vectors: np.ndarray) -> "Int8Vectors":
+        codes, scales = np.array(self.codes), np.array(self.scales)
+        codes[rows], scales[rows] = quantize_int8(vectors)
+
+        return Int8Vectors(codes, scales)
+
+    def to_float(self) -> np.ndarray:
+        return dequantize_int8(np.asarray(self.codes), np.asarray(self.scales))
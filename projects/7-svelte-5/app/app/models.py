@@ -2,7 +2,17 @@ from datetime import datetime, timezone
 from enum import Enum as StandardEnum
 from uuid import uuid4, UUID
 
-from sqlalchemy import DateTime, Enum, ForeignKey, Integer, String, Text
+from sqlalchemy import (
+    JSON,
+    Boolean,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Integer,
+    String,
+    Text,
+    false,
+)
 from sqlalchemy.orm import Mapped, MappedAsDataclass, mapped_column, relationship
 
 from app.database import db
@@ -84,16 +94,22 @@ def convert_chat_message_to_llm_format(role: str, content: str) -> dict[str, str
 
 
 def chat_messages_as_llm_format(
-    chat, assistant_role_value, use_summary: bool = False, exclude_media: bool = True
+    chat,
+    assistant_role_value,
+    use_summary: bool = False,
+    exclude_media: bool = True,
+    anchor_summary: bool = False,
 ) -> list[dict[str, str]]:
+    chat_messages = chat.chat_messages
+
     if exclude_media:
-        messages = [
-            chat_message.as_llm_format()
-            for chat_message in chat.chat_messages
+        chat_messages = [
+            chat_message
+            for chat_message in chat_messages
             if chat_message.generated_media is None
         ]
-    else:
-        messages = [chat_message.as_llm_format() for chat_message in chat.chat_messages]
+
+    messages = [chat_message.as_llm_format() for chat_message in chat_messages]
 
     if use_summary and chat.chat_summary:
         # replace any messages that are before the summary with the summary
@@ -102,11 +118,20 @@ def chat_messages_as_llm_format(
             content=f"Here is a summary of previous messages: {chat.chat_summary.content}",
         )
 
-        NUMBER_OF_MESSAGES_TO_INCLUDE_AFTER_SUMMARY = 3
-
-        messages = [summary_message] + messages[
-            -NUMBER_OF_MESSAGES_TO_INCLUDE_AFTER_SUMMARY:
-        ]
+        if anchor_summary:
+            # Everything after the summarized message, so the prompt only
+            # grows at the end until the summary is next replaced
+            last_message_id = chat.chat_summary.last_message_id
+            messages = [
+                chat_message.as_llm_format()
+                for chat_message in chat_messages
+                if chat_message.id > last_message_id
+            ]
+        else:
+            NUMBER_OF_MESSAGES_TO_INCLUDE_AFTER_SUMMARY = 3
+            messages = messages[-NUMBER_OF_MESSAGES_TO_INCLUDE_AFTER_SUMMARY:]
+
+        messages = [summary_message] + messages
 
     return messages
 
@@ -117,6 +142,8 @@ def get_image_tag_for_generated_image(
     files_dir_path: str,
     css_classes: str = "img-fluid rounded",
     link_to_image: bool = True,
+    variants: list[dict] | None = None,
+    sizes: str = "(max-width: 768px) 100vw, 50vw",
 ) -> str:
     image_url = f"{files_dir_path}/{filename}"
     alt_text = strip_non_alpha_characters(input=prompt, replacement_character=" ")
@@ -126,6 +153,32 @@ def get_image_tag_for_generated_image(
         f'<img class="{css_classes}" src="{image_url}" alt="{alt_text}" />'
     )
 
+    if variants:
+        # One <source> per format, the browser picks the first format it
+        # supports and the best width for the layout from its srcset
+        sources_markup = ""
+        variants_by_mime_type = {}
+
+        for variant in variants:
+            variants_by_mime_type.setdefault(variant["mime_type"], []).append(variant)
+
+        for mime_type, mime_type_variants in variants_by_mime_type.items():
+            srcset = ", ".join(
+                f'{files_dir_path}/{variant["filename"]} {variant["width"]}w'
+                for variant in mime_type_variants
+            )
+            sources_markup += (
+                f'<source type="{mime_type}" srcset="{srcset}" sizes="{sizes}" />'
+            )
+
+        largest_variant = max(variants, key=lambda variant: variant["width"])
+        image_tag_markup = (
+            f'<img class="{css_classes}" src="{image_url}" alt="{alt_text}" '
+            f'width="{largest_variant["width"]}" '
+            f'height="{largest_variant["height"]}" loading="lazy" />'
+        )
+        image_tag_markup = f"<picture>{sources_markup}{image_tag_markup}</picture>"
+
     if link_to_image:
         image_tag_markup = (
             f'<a class="d-inline-block" href="{image_url}">{image_tag_markup}</a>'
@@ -220,13 +273,17 @@ class Chat(BaseModel):
         return f"<Chat {self.title}({self.id})>"
 
     def messages_as_llm_format(
-        self, use_summary: bool = False, exclude_media: bool = True
+        self,
+        use_summary: bool = False,
+        exclude_media: bool = True,
+        anchor_summary: bool = False,
     ) -> list[dict[str, str]]:
         return chat_messages_as_llm_format(
             chat=self,
             assistant_role_value=ChatMessageRole.ASSISTANT.value,
             use_summary=use_summary,
             exclude_media=exclude_media,
+            anchor_summary=anchor_summary,
         )
 
     def to_dict(
@@ -306,6 +363,11 @@ class ChatMessage(BaseModel):
         Enum(ChatMessageState), default=ChatMessageState.READY, nullable=False
     )
 
+    # The client went away (or the stream failed) before the response finished
+    is_truncated: Mapped[bool] = mapped_column(
+        Boolean, default=False, server_default=false(), nullable=False
+    )
+
     chat_id: Mapped[int] = mapped_column(
         ForeignKey("chats.id", ondelete="CASCADE"), default=None
     )
@@ -373,6 +435,7 @@ class ChatMessage(BaseModel):
             "content": self.content,
             "role": self.role.value,
             "state": self.state.value,
+            "is_truncated": self.is_truncated,
             "created_at": created_at,
             "updated_at": updated_at,
             "generated_media": self.generated_media.to_dict()
@@ -468,6 +531,10 @@ class GeneratedMedia(BaseModel):
     )
     filename: Mapped[str] = mapped_column(default=None)
     prompt: Mapped[str] = mapped_column(default=None, nullable=False)
+    # Smaller encodings / sizes of the file, see ImageProcessor
+    variants: Mapped[list[dict] | None] = mapped_column(
+        JSON, default=None, nullable=True
+    )
 
     user_id: Mapped[int | None] = mapped_column(
         ForeignKey("users.id"), default=None, use_existing_column=True
@@ -498,6 +565,7 @@ class GeneratedMedia(BaseModel):
             "type": self.type.value,
             "filename": self.filename,
             "prompt": self.prompt,
+            "variants": self.variants,
             "created_at": created_at,
             "updated_at": updated_at,
         }
@@ -527,4 +595,5 @@ class GeneratedImage(GeneratedMedia):
             files_dir_path=image_dir_path,
             css_classes=css_classes,
             link_to_image=link_to_image,
+            variants=self.variants,
         )
@@ -0,0 +1,170 @@
+import math
+import threading
+import time
+
+from collections import deque
+from dataclasses import dataclass, field
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, tier: str, retry_after: int):
+        super().__init__(f"Inference tier {tier} is busy, retry in {retry_after}s.")
+        self.tier = tier
+        self.retry_after = retry_after
+
+
+@dataclass
+class AdmissionTicket:
+    tier: str
+    admitted_at: float
+    is_released: bool = False
+
+
+@dataclass
+class TierQueue:
+    # 0 = unlimited
+    limit: int
+    in_flight: int = 0
+    # FIFO, a releasing request hands its slot straight to the first waiter
+    waiters: deque = field(default_factory=deque)
+    # Seconds, None until the first request finished
+    ewma_service_time: float | None = None
+    ewma_wait_time: float = 0.0
+    admitted: int = 0
+    queued: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+
+    def has_free_slot(self) -> bool:
+        return not self.limit or self.in_flight < self.limit
+
+    def to_dict(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "ewma_wait_time": round(self.ewma_wait_time, 3),
+            "ewma_service_time": (
+                round(self.ewma_service_time, 3)
+                if self.ewma_service_time is not None
+                else None
+            ),
+        }
+
+
+class AdmissionController:
+    """
+    Caps the generations in flight per model tier. Requests over the limit
+    wait in a bounded FIFO queue, a full queue or a wait past the timeout is
+    rejected right away with a Retry-After estimate, so the inference servers
+    only see as much work as they can serve at a steady latency.
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, int],
+        max_queue_size: int = 16,
+        queue_timeout_seconds: float = 10.0,
+        ewma_alpha: float = 0.2,
+    ):
+        self.queues = {tier: TierQueue(limit=limit) for tier, limit in limits.items()}
+        self.max_queue_size = max_queue_size
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.ewma_alpha = ewma_alpha
+
+        self.lock = threading.Lock()
+
+    def acquire(self, tier: str, timeout: float | None = None) -> AdmissionTicket:
+        """
+        Blocks until admitted or raises AdmissionRejected, hand the ticket
+        back with release().
+        """
+        queue = self.get_queue(tier)
+        start = time.monotonic()
+
+        with self.lock:
+            if queue.has_free_slot() and not queue.waiters:
+                queue.in_flight += 1
+                queue.admitted += 1
+
+                return AdmissionTicket(tier=tier, admitted_at=start)
+
+            if len(queue.waiters) >= self.max_queue_size:
+                queue.rejected += 1
+
+                raise AdmissionRejected(tier, self.get_retry_after(queue))
+
+            waiter = threading.Event()
+            queue.waiters.append(waiter)
+            queue.queued += 1
+
+        if timeout is None:
+            timeout = self.queue_timeout_seconds
+
+        waiter.wait(timeout)
+
+        with self.lock:
+            # Set under the lock, so a slot handed over right at the timeout
+            # isn't lost
+            if not waiter.is_set():
+                queue.waiters.remove(waiter)
+                queue.timed_out += 1
+
+                raise AdmissionRejected(tier, self.get_retry_after(queue))
+
+            now = time.monotonic()
+            queue.admitted += 1
+            queue.ewma_wait_time += self.ewma_alpha * (
+                now - start - queue.ewma_wait_time
+            )
+
+            return AdmissionTicket(tier=tier, admitted_at=now)
+
+    def release(self, ticket: AdmissionTicket) -> None:
+        queue = self.get_queue(ticket.tier)
+        service_time = time.monotonic() - ticket.admitted_at
+
+        with self.lock:
+            if ticket.is_released:
+                return
+
+            ticket.is_released = True
+
+            if queue.ewma_service_time is None:
+                queue.ewma_service_time = service_time
+            else:
+                queue.ewma_service_time += self.ewma_alpha * (
+                    service_time - queue.ewma_service_time
+                )
+
+            if queue.waiters:
+                queue.waiters.popleft().set()
+            else:
+                queue.in_flight -= 1
+
+    def get_queue(self, tier: str) -> TierQueue:
+        if tier not in self.queues:
+            # Tiers without a configured limit are only counted
+            with self.lock:
+                self.queues.setdefault(tier, TierQueue(limit=0))
+
+        return self.queues[tier]
+
+    def get_retry_after(self, queue: TierQueue) -> int:
+        # Time for everyone waiting (and this request) to get a slot, before
+        # any request finished the queue timeout is the best guess
+        service_time = queue.ewma_service_time or self.queue_timeout_seconds
+        slots = queue.limit or 1
+
+        return max(1, math.ceil(service_time * (len(queue.waiters) + 1) / slots))
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "max_queue_size": self.max_queue_size,
+                "tiers": {tier: queue.to_dict() for tier, queue in self.queues.items()},
+            }
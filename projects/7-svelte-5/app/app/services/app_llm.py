@@ -1,3 +1,4 @@
+import dataclasses
 import json
 import os
 
@@ -5,34 +6,100 @@ from collections.abc import Generator
 from functools import cached_property
 from pathlib import Path
 
-from jinja2 import Template
+from jinja2 import (
+    ChoiceLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    StrictUndefined,
+    Template,
+    meta,
+)
 
 from app.models import ChatMessage, ChatMessageRole
 
+from app.lib.generation_profiles import GenerationProfile, is_json_object_complete
+from app.lib.template_loaders import FreshModuleLoader
+
 from app.services.app_logger import AppLogger
 from app.services.llm_http_client import LlmHttpClient
+from app.services.model_router import SMALL_TIER
 from app.services.content_store import ContentStore
 from app.services.response_types import ResponseTypesFlags
 
+# prefix_stable: earlier messages are sent exactly as stored and the RAG
+# context is appended after the last message, so the server can reuse the KV
+# cache of everything before it. rag_first: the last message is replaced by the
+# RAG prompt (instructions + passages + message).
+PROMPT_LAYOUTS = ("prefix_stable", "rag_first")
+
+# Calls that can use the LLM response cache, their output only depends on the
+# prompt (temperature is ~0) and nothing is streamed
+CACHEABLE_CALLERS = (
+    "classify_message",
+    "get_diffusion_prompt_from_input",
+    "get_chat_summary",
+)
+
+# Generation limits per call, anything not set is left to the server
+GENERATION_PROFILES = {
+    "chat": GenerationProfile(),
+    # A couple of booleans, the JSON is all that's needed
+    "classify_message": GenerationProfile(
+        max_tokens=64, temperature=0.0, stop_when=is_json_object_complete
+    ),
+    # CLIP reads at most 77 tokens of the prompt
+    "get_diffusion_prompt_from_input": GenerationProfile(max_tokens=96, stop=("\n\n",)),
+    "get_chat_summary": GenerationProfile(max_tokens=384),
+}
+
 
 class AppLlm:
     def __init__(
         self,
-        inference_small_api_url: str,
         llm_http_client: LlmHttpClient,
         content_store: ContentStore,
         logger: AppLogger,
         debug: bool = False,
+        bytecode_cache_dir: str | None = None,
+        compiled_templates_dir: str | None = None,
+        prompt_layout: str = "prefix_stable",
+        cached_callers: list[str] | None = None,
+        chat_max_tokens: int | None = None,
     ):
-        self.inference_small_api_url = inference_small_api_url
         self.llm_http_client = llm_http_client
         self.content_store = content_store
         self.logger = logger
         self.debug = debug
 
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"Unknown prompt layout: {prompt_layout}")
+
+        self.prompt_layout = prompt_layout
+
+        for caller in cached_callers or []:
+            if caller not in CACHEABLE_CALLERS:
+                raise ValueError(f"Response cache not supported for: {caller}")
+
+        self.cached_callers = set(cached_callers or [])
+
+        self.generation_profiles = {
+            **GENERATION_PROFILES,
+            "chat": dataclasses.replace(
+                GENERATION_PROFILES["chat"], max_tokens=chat_max_tokens
+            ),
+        }
+
         self.prompt_templates_dir = Path(__file__).parent / "prompts"
         self.prompt_template_file_extension = ".j2"
 
+        self.prompt_environment = self.create_prompt_environment(
+            templates_dir=self.prompt_templates_dir,
+            bytecode_cache_dir=bytecode_cache_dir,
+            compiled_templates_dir=compiled_templates_dir,
+            auto_reload=debug,
+        )
+
         self.prompts = [
             os.path.splitext(template_file)[0]
             for template_file in os.listdir(self.prompt_templates_dir)
@@ -42,22 +109,89 @@ class AppLlm:
         self.prompt_templates = {}
 
         for prompt in self.prompts:
+            template_name = f"{prompt}{self.prompt_template_file_extension}"
             template_string = ""
 
-            with open(
-                f"{self.prompt_templates_dir}/{prompt}{self.prompt_template_file_extension}",
-                "r",
-            ) as file:
+            with open(f"{self.prompt_templates_dir}/{template_name}", "r") as file:
                 template_string = file.read()
 
-            template = Template(template_string)
+            template = self.prompt_environment.get_template(template_name)
 
             self.prompt_templates[prompt] = {
                 "template_string": template_string,
                 "template": template,
+                # Prompts without variables (i.e. the system prompt) only need
+                # to be rendered once
+                "rendered": self.get_static_prompt(template_string, template),
             }
 
-        self.system_prompt = self.prompt_templates["system"]["template_string"]
+        self.system_prompt = self.prompt_templates["system"]["rendered"]
+
+    ########
+    # Setup
+    ########
+    @staticmethod
+    def create_prompt_environment(
+        templates_dir: Path,
+        bytecode_cache_dir: str | None = None,
+        compiled_templates_dir: str | None = None,
+        auto_reload: bool = False,
+    ) -> Environment:
+        # https://jinja.palletsprojects.com/en/3.1.x/api/#loaders
+        loader = FileSystemLoader(templates_dir)
+
+        if compiled_templates_dir and os.path.isdir(compiled_templates_dir):
+            # Precompiled modules (see `flask compile_prompts`) skip parsing and
+            # compiling entirely, fall back to the sources for anything missing
+            # or compiled before its source last changed
+            loader = ChoiceLoader(
+                [
+                    FreshModuleLoader(compiled_templates_dir, source_loader=loader),
+                    loader,
+                ]
+            )
+
+        bytecode_cache = None
+
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+
+        return Environment(
+            loader=loader,
+            bytecode_cache=bytecode_cache,
+            undefined=StrictUndefined,
+            auto_reload=auto_reload,
+        )
+
+    def compile_prompt_templates(self, target_dir: str) -> None:
+        # Always compile from the sources, never from previously compiled modules
+        prompt_environment = self.create_prompt_environment(
+            templates_dir=self.prompt_templates_dir
+        )
+        prompt_environment.compile_templates(
+            target_dir,
+            extensions=[self.prompt_template_file_extension.lstrip(".")],
+            zip=None,
+        )
+
+    def get_static_prompt(self, template_string: str, template: Template) -> str | None:
+        parsed_template = self.prompt_environment.parse(template_string)
+
+        if meta.find_undeclared_variables(parsed_template):
+            return None
+
+        # Rendered from the loaded template, so the static and the templated
+        # prompts always come from the same (compiled or source) version
+        return template.render()
+
+    def render_prompt(self, prompt: str, context: dict | None = None) -> str:
+        prompt_template = self.prompt_templates[prompt]
+
+        if prompt_template["rendered"] is not None:
+            return prompt_template["rendered"]
+
+        return prompt_template["template"].render(context or {})
 
     ############
     # Classifier
@@ -81,9 +215,7 @@ class AppLlm:
     def classify_message(self, message: str = "") -> ResponseTypesFlags | None:
         system_prompt_override = "You are a helpful assistant designed to output JSON."
 
-        message = self.prompt_templates["message_classifier"]["template"].render(
-            {"message": message}
-        )
+        message = self.render_prompt("message_classifier", {"message": message})
 
         message = ChatMessage.convert_chat_message_to_llm_format(
             role=ChatMessageRole.USER.value, content=message
@@ -94,13 +226,17 @@ class AppLlm:
             messages=[message],
             system_prompt_override=system_prompt_override,
             response_format=self.classifier_response_format,
-            inference_api_url_override=self.inference_small_api_url,
+            tier=SMALL_TIER,
+            use_cache=self.is_cached("classify_message"),
+            generation_profile=self.generation_profiles["classify_message"],
         )
 
         response_content = None
 
         if response is not None:
-            response_content = json.loads(response)
+            # Anything after the object (the generation is cut off once it's
+            # complete) is ignored
+            response_content, _ = json.JSONDecoder().raw_decode(response.strip())
             response_content = ResponseTypesFlags(**response_content)
 
         return response_content
@@ -109,14 +245,18 @@ class AppLlm:
     # Image Gen Helper
     ##################
     def get_diffusion_prompt_from_input(self, input: str = "") -> str:
-        diffusion_prompt = self.prompt_templates["diffusion_prompt_from_message"][
-            "template"
-        ].render({"message": input})
+        diffusion_prompt = self.render_prompt(
+            "diffusion_prompt_from_message", {"message": input}
+        )
 
         self.log_llm_messages(caller="get_chat_summary", messages=[diffusion_prompt])
         response_content = self.get_llm_response_for_single_message(
             content=diffusion_prompt,
             system_prompt_override="You are a helpful assistant.",
+            use_cache=self.is_cached("get_diffusion_prompt_from_input"),
+            generation_profile=self.generation_profiles[
+                "get_diffusion_prompt_from_input"
+            ],
         )
 
         return response_content
@@ -125,41 +265,55 @@ class AppLlm:
     # LLM Calls
     ############
     def get_llm_response_stream(
-        self, messages: list[dict], use_rag: bool = True
+        self, messages: list[dict], use_rag: bool = True, cache_key: str | None = None
     ) -> Generator[str, None, None]:
+        # cache_key (the chat) groups requests sharing a prompt prefix
         if use_rag:
             messages = self.render_last_message_with_rag_prompt(messages=messages)
 
         self.log_llm_messages(caller="get_llm_chat_response_stream", messages=messages)
         response = self.llm_http_client.get_llm_response_stream(
-            messages=messages, system_prompt_override=self.system_prompt
+            messages=messages,
+            system_prompt_override=self.system_prompt,
+            cache_key=cache_key,
+            generation_profile=self.generation_profiles["chat"],
         )
 
-        for chunk in response:
-            response_content = ""
+        try:
+            for chunk in response:
+                response_content = ""
 
-            try:
-                if chunk is not None:
-                    response_content = self.clean_output(chunk)
-            except (KeyError, TypeError):
-                pass
+                try:
+                    if chunk is not None:
+                        response_content = self.clean_output(chunk)
+                except (KeyError, TypeError):
+                    pass
 
-            yield response_content
+                yield response_content
+        finally:
+            # Right away instead of whenever the generator is collected
+            response.close()
 
     def get_chat_summary(self, chat_messages: list) -> str:
-        chat_summary_prompt = self.prompt_templates["chat_summary"]["template"].render(
-            {"chat_messages": chat_messages}
+        chat_summary_prompt = self.render_prompt(
+            "chat_summary", {"chat_messages": chat_messages}
         )
 
         self.log_llm_messages(caller="get_chat_summary", messages=[chat_summary_prompt])
         response_content = self.get_llm_response_for_single_message(
-            content=chat_summary_prompt
+            content=chat_summary_prompt,
+            use_cache=self.is_cached("get_chat_summary"),
+            generation_profile=self.generation_profiles["get_chat_summary"],
         )
 
         return response_content
 
     def get_llm_response_for_single_message(
-        self, content: str = "", system_prompt_override: str | None = None
+        self,
+        content: str = "",
+        system_prompt_override: str | None = None,
+        use_cache: bool = False,
+        generation_profile: GenerationProfile | None = None,
     ) -> str:
         system_prompt = system_prompt_override or self.system_prompt
 
@@ -168,7 +322,10 @@ class AppLlm:
         )
 
         response = self.llm_http_client.get_llm_response(
-            messages=[message], system_prompt_override=system_prompt
+            messages=[message],
+            system_prompt_override=system_prompt,
+            use_cache=use_cache,
+            generation_profile=generation_profile,
         )
 
         response_content = ""
@@ -184,8 +341,8 @@ class AppLlm:
     def get_rag_prompt(self, input: str) -> str:
         context = self.get_relevant_context(input)
 
-        chat_prompt = self.prompt_templates["rag_with_sources"]["template"].render(
-            {"question": input, "documents": context}
+        chat_prompt = self.render_prompt(
+            "rag_with_sources", {"question": input, "documents": context}
         )
 
         return chat_prompt
@@ -206,19 +363,38 @@ class AppLlm:
 
         return context
 
-    def render_last_message_with_rag_prompt(self, messages: list[dict]) -> list[dict]:
+    def render_last_message_with_rag_prompt(
+        self, messages: list[dict], context: list | None = None
+    ) -> list[dict]:
         if messages[-1]["role"] != ChatMessageRole.USER.value:
             # this shouldn't happen
             raise
             return messages
 
-        messages[-1]["content"] = self.get_rag_prompt(input=messages[-1]["content"])
+        # Copy, the history is reused as is for the next request
+        last_message = messages[-1].copy()
+        input = last_message["content"]
 
-        return messages
+        if context is None:
+            context = self.get_relevant_context(input)
+
+        if self.prompt_layout == "prefix_stable":
+            last_message["content"] = input + self.render_prompt(
+                "rag_context", {"documents": context}
+            )
+        else:
+            last_message["content"] = self.render_prompt(
+                "rag_with_sources", {"question": input, "documents": context}
+            )
+
+        return messages[:-1] + [last_message]
 
     ########
     # Utils
     ########
+    def is_cached(self, caller: str) -> bool:
+        return caller in self.cached_callers
+
     def log_llm_messages(self, caller: str, messages: list) -> None:
         if not self.debug:
             return
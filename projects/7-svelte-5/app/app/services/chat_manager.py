@@ -1,3 +1,5 @@
+from collections.abc import Callable
+
 from sqlalchemy import create_engine, select
 from sqlalchemy.orm import Session, sessionmaker
 
@@ -17,6 +19,8 @@ from app.lib.fs_utils import delete_file
 
 from app.services.app_llm import AppLlm
 from app.services.image_gen import ImageGen
+from app.services.image_processor import ImageProcessor
+from app.services.media_cleanup import FileDeletionQueue
 
 
 class ChatManager:
@@ -26,14 +30,21 @@ class ChatManager:
         app_llm: AppLlm,
         image_gen: ImageGen,
         images_dir_url_path: str,
+        image_processor: ImageProcessor | None = None,
+        file_deletion_queue: FileDeletionQueue | None = None,
     ):
         self.db_uri = db_uri
         self.app_llm = app_llm
         self.image_gen = image_gen
         self.images_dir_url_path = images_dir_url_path
+        self.image_processor = image_processor
+        self.file_deletion_queue = file_deletion_queue
 
         self.use_rag = False
         self.use_summaries = False
+        # With anchored summaries (prefix stable prompts), messages kept after
+        # the summary before it's regenerated
+        self.summary_refresh_messages = 8
 
         # For threaded code
         self.engine = create_engine(db_uri)
@@ -50,6 +61,8 @@ class ChatManager:
         return chat
 
     def delete_chat_content(self, chat: Chat) -> None:
+        filepaths_to_delete = []
+
         try:
             db.session.execute(db.delete(ChatSummary).where(ChatSummary.chat == chat))
 
@@ -58,6 +71,7 @@ class ChatManager:
                     ChatMessage.generated_media_id,
                     GeneratedMedia.filename,
                     GeneratedMedia.type,
+                    GeneratedMedia.variants,
                 )
                 .join(
                     GeneratedMedia, ChatMessage.generated_media_id == GeneratedMedia.id
@@ -81,16 +95,31 @@ class ChatManager:
 
                 for row in generated_medias:
                     if row.type == GeneratedMediaType.GENERATED_IMAGE:
-                        filepath = self.image_gen.get_image_filepath(
-                            filename=row.filename
-                        )
-                        delete_file(filepath=filepath)
+                        filenames = [
+                            row.filename
+                        ] + ImageProcessor.get_variant_filenames(row.variants)
+
+                        filepaths_to_delete += [
+                            self.image_gen.get_image_filepath(filename=filename)
+                            for filename in filenames
+                        ]
 
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             raise e
 
+        # Only touch the files once the rows are gone, anything missed here
+        # (i.e. a crash before the unlink) is picked up by OrphanedMediaSweeper
+        self.delete_files(filepaths=filepaths_to_delete)
+
+    def delete_files(self, filepaths: list[str]) -> None:
+        if self.file_deletion_queue:
+            self.file_deletion_queue.enqueue(filepaths)
+        else:
+            for filepath in filepaths:
+                delete_file(filepath=filepath)
+
     def create_chat_message(
         self,
         content: str,
@@ -120,8 +149,13 @@ class ChatManager:
             content=prompt, role=ChatMessageRole.USER, chat=chat, user=user
         )
 
+        # The dataclass default for type is the base identity, without it the
+        # row isn't loaded (or cleaned up) as an image
         generated_image = GeneratedImage(
-            filename=image_filename, prompt=prompt, user=user
+            filename=image_filename,
+            prompt=prompt,
+            user=user,
+            type=GeneratedMediaType.GENERATED_IMAGE,
         )
 
         chat_message = ChatMessage(
@@ -135,40 +169,127 @@ class ChatManager:
 
         self._save_to_db([user_chat_message, generated_image, chat_message])
 
+        self.process_generated_image(
+            generated_image=generated_image, chat_message=chat_message
+        )
+
         return chat_message
 
+    def process_generated_image(
+        self, generated_image: GeneratedImage, chat_message: ChatMessage
+    ) -> None:
+        # The original image is served right away, the smaller variants are
+        # encoded in the background and swapped into the message when ready
+        if self.image_processor is None:
+            return
+
+        generated_image_id = generated_image.id
+        chat_message_id = chat_message.id
+
+        self.image_processor.submit(
+            filename=generated_image.filename,
+            on_done=lambda variants: self.save_generated_image_variants(
+                generated_image_id=generated_image_id,
+                chat_message_id=chat_message_id,
+                variants=variants,
+            ),
+        )
+
+    def save_generated_image_variants(
+        self, generated_image_id: int, chat_message_id: int, variants: list[dict]
+    ) -> None:
+        session = self.create_new_session()
+
+        try:
+            generated_image = session.get(GeneratedImage, generated_image_id)
+            chat_message = session.get(ChatMessage, chat_message_id)
+
+            if generated_image is None or chat_message is None:
+                # The chat was cleared while the variants were being encoded
+                self.delete_files(
+                    filepaths=[
+                        self.image_gen.get_image_filepath(filename)
+                        for filename in ImageProcessor.get_variant_filenames(variants)
+                    ]
+                )
+
+                return
+
+            generated_image.variants = variants
+            chat_message.content = generated_image.as_image_tag(
+                image_dir_path=self.images_dir_url_path
+            )
+
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
     def get_llm_response_stream_and_save_messages(
         self,
         chat: Chat,
+        on_stream_end: Callable[[], None] | None = None,
     ):
         session = self.create_new_session()
         session.add(chat)
 
+        # Prefix stable prompts keep the summary until enough messages piled
+        # up after it, instead of replacing the head of the prompt every turn
+        anchor_summary = self.app_llm.prompt_layout == "prefix_stable"
+
         response = self.app_llm.get_llm_response_stream(
-            messages=chat.messages_as_llm_format(use_summary=self.use_summaries),
+            messages=chat.messages_as_llm_format(
+                use_summary=self.use_summaries, anchor_summary=anchor_summary
+            ),
             use_rag=self.use_rag,
+            cache_key=str(chat.id),
         )
 
         full_response = ""
+        is_finished = False
 
         try:
             for token in response:
                 full_response += token
 
                 yield token
+
+            is_finished = True
         finally:
+            # Closing the stream here (the client went away, or it failed)
+            # closes the upstream HTTP stream, which makes the inference
+            # server stop generating
+            response.close()
+
+            # i.e. hands back the stream's admission slot, the summary below
+            # needs its own
+            if on_stream_end is not None:
+                on_stream_end()
+
             # Todo: better way to do this? db.session didn't work
             # Create chat message for LLM response after the stream closes
             # Access sql alchemy directly since this happens after the response closes?
             # https://stackoverflow.com/a/41014157
             response_message = ChatMessage(
-                content=full_response.strip(), role=ChatMessageRole.ASSISTANT, chat=chat
+                content=full_response.strip(),
+                role=ChatMessageRole.ASSISTANT,
+                chat=chat,
+                is_truncated=not is_finished,
             )
 
             try:
                 session.add(response_message)
 
-                if self.use_summaries:
+                # No summary LLM call for an abandoned response
+                if (
+                    is_finished
+                    and self.use_summaries
+                    and self.should_update_summary(
+                        chat=chat, anchor_summary=anchor_summary
+                    )
+                ):
                     # summary generation could take awhile commit it separately
                     # TODO account for token limit if not re-feeding summary
                     # and using raw messages?
@@ -198,6 +319,19 @@ class ChatManager:
             finally:
                 session.close()
 
+    def should_update_summary(self, chat: Chat, anchor_summary: bool) -> bool:
+        if not anchor_summary or chat.chat_summary is None:
+            return True
+
+        last_message_id = chat.chat_summary.last_message_id
+        messages_after_summary = [
+            chat_message
+            for chat_message in chat.chat_messages
+            if chat_message.id is None or chat_message.id > last_message_id
+        ]
+
+        return len(messages_after_summary) >= self.summary_refresh_messages
+
     def _exists(self, model_class: object) -> bool:
         return db.session.execute(select(model_class).limit(1)).scalar() is not None
 
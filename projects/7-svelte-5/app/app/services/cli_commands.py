@@ -1,7 +1,53 @@
+import base64
+import dataclasses
+import itertools
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from types import SimpleNamespace
+
 import click
+import numpy as np
+import torch
+
+from jinja2 import Template
 
 from app.database import db
-from app.models import User, Chat
+from app.models import User, Chat, chat_messages_as_llm_format
+
+from app.lib.prompt_prefix import PrefixReuseTracker, serialize_messages
+from app.lib.vector_quantization import Int8Vectors
+
+from app.services.content_store import ContentStore
+from app.services.embedding_service import EmbeddingService
+from app.services.image_gen import ImageGenStub
+from app.services.local_search_backend import (
+    HnswIndex,
+    LocalSearchBackend,
+    normalize_vectors,
+    top_k_dot_product,
+)
+from app.services.search_backends import OpenSearchBackend
+
+
+def generate_clustered_vectors(
+    num_vectors: int, dimensions: int, num_queries: int, seed: int = 42
+) -> tuple[np.ndarray, np.ndarray]:
+    # Random vectors around a few hundred centers, roughly like real embeddings
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((256, dimensions), dtype=np.float32)
+    vectors = centers[rng.integers(0, len(centers), num_vectors)]
+    vectors += 0.5 * rng.standard_normal(vectors.shape, dtype=np.float32)
+    vectors = normalize_vectors(vectors)
+    queries = normalize_vectors(
+        vectors[rng.integers(0, num_vectors, num_queries)]
+        + 0.1 * rng.standard_normal((num_queries, dimensions), dtype=np.float32)
+    )
+
+    return vectors, queries
 
 
 def register_cli_commands(app) -> None:
@@ -39,3 +85,615 @@ def register_cli_commands(app) -> None:
     def clear_logs():
         app.logger_service.clear_log_file()
         click.echo("Log files cleared")
+
+    @app.cli.command("sweep_orphaned_media")
+    @click.option("--dry-run", is_flag=True, help="Only list the orphaned files.")
+    def sweep_orphaned_media(dry_run: bool):
+        if dry_run:
+            orphaned_filepaths = app.orphaned_media_sweeper.find_orphaned_filepaths()
+        else:
+            orphaned_filepaths = app.orphaned_media_sweeper.sweep()
+            app.file_deletion_queue.join()
+
+        for filepath in orphaned_filepaths:
+            click.echo(filepath)
+
+        output = f"Found {len(orphaned_filepaths)} orphaned media files."
+        click.echo(output)
+        app.logger_service.log(output)
+
+    @app.cli.command("reindex")
+    @click.option(
+        "--workers",
+        default=None,
+        type=int,
+        help="Processes chunking files and concurrent embedding requests.",
+    )
+    @click.option(
+        "--embedding-workers",
+        default=None,
+        type=int,
+        help="Concurrent embedding requests, overrides --workers.",
+    )
+    @click.option("--batch-size", default=None, type=int, help="Chunks per request.")
+    @click.option(
+        "--dedup-max-entries",
+        default=None,
+        type=int,
+        help="Chunks kept for near duplicate checks (about 1.5 KB each), 0 = all.",
+    )
+    def reindex(
+        workers: int | None,
+        embedding_workers: int | None,
+        batch_size: int | None,
+        dedup_max_entries: int | None,
+    ):
+        content_store = app.content_store
+
+        if workers:
+            content_store.data_loader.max_workers = workers
+            content_store.ingestion_embedding_workers = workers
+
+        if embedding_workers:
+            content_store.ingestion_embedding_workers = embedding_workers
+
+        if batch_size:
+            content_store.ingestion_batch_size = batch_size
+
+        if dedup_max_entries is not None:
+            content_store.dedup_max_entries = dedup_max_entries
+
+        total_files = sum(1 for _ in content_store.data_loader.iter_file_paths())
+        click.echo(
+            f"Reindexing {total_files} files with "
+            f"{content_store.data_loader.max_workers} chunking processes, "
+            f"{content_store.ingestion_embedding_workers} embedding workers, "
+            f"batch size {content_store.ingestion_batch_size}"
+        )
+
+        def on_progress(stats: dict) -> None:
+            elapsed_seconds = stats["elapsed_seconds"] or 1e-9
+            files_read = stats["sources_read"]
+            indexed_chunks = stats["stages"]["index"]["items"]
+            eta_seconds = (
+                elapsed_seconds / files_read * (total_files - files_read)
+                if files_read
+                else 0.0
+            )
+
+            click.echo(
+                f"{files_read}/{total_files} files, {indexed_chunks} chunks, "
+                f"{indexed_chunks / elapsed_seconds:.1f} chunks/s, "
+                f"{files_read / elapsed_seconds:.2f} docs/s, ETA {eta_seconds:.0f}s"
+            )
+
+        stats = content_store.refresh_index(on_progress=on_progress)
+
+        for name, stage_stats in stats["stages"].items():
+            click.echo(f"{name}: {stage_stats}")
+
+        output = (
+            f"Reindexed {stats['sources_read']} files in "
+            f"{stats['elapsed_seconds']:.1f}s, skipped "
+            f"{stats['skipped_duplicates']} near duplicate chunks"
+        )
+        click.echo(output)
+        app.logger_service.log(output)
+
+    @app.cli.command("compile_prompts")
+    def compile_prompts():
+        target_dir = app.config["PROMPT_TEMPLATES_COMPILED_DIR"]
+        app.app_llm.compile_prompt_templates(target_dir=target_dir)
+
+        output = f"Prompt templates compiled to {target_dir}"
+        click.echo(output)
+        app.logger_service.log(output)
+
+    @app.cli.command("bench_prompts")
+    @click.option("--iterations", default=1000, help="Renders per passage count.")
+    def bench_prompts(iterations: int):
+        app_llm = app.app_llm
+        passage = "The quick brown fox jumps over the lazy dog. " * 20
+        template_string = app_llm.prompt_templates["rag_with_sources"][
+            "template_string"
+        ]
+
+        for number_of_passages in [3, 5, 10, 20]:
+            context = {
+                "question": "What does the fox jump over?",
+                "documents": [
+                    {"content": passage, "source": f"document_{i}.txt"}
+                    for i in range(number_of_passages)
+                ],
+            }
+
+            # Previous approach for comparison: a bare Template per prompt
+            start = time.perf_counter()
+            for _ in range(iterations):
+                Template(template_string).render(context)
+            bare_template_time = (time.perf_counter() - start) / iterations
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                app_llm.render_prompt("rag_with_sources", context)
+            environment_time = (time.perf_counter() - start) / iterations
+
+            click.echo(
+                f"{number_of_passages:>2} passages: "
+                f"compile + render {bare_template_time * 1e6:.1f}us, "
+                f"render {environment_time * 1e6:.1f}us"
+            )
+
+    @app.cli.command("bench_prompt_prefix")
+    @click.option("--turns", default=20, help="User messages in the chat.")
+    @click.option("--passages", default=3, help="RAG passages per message.")
+    @click.option("--answer-words", default=150, help="Words per answer.")
+    @click.option("--use-summaries", is_flag=True)
+    def bench_prompt_prefix(
+        turns: int, passages: int, answer_words: int, use_summaries: bool
+    ):
+        # Offline: a synthetic chat with fixed passages, measures how much of
+        # each prompt repeats the previous one (what a prefix cache can skip)
+        app_llm = app.app_llm
+        original_prompt_layout = app_llm.prompt_layout
+        passage = "The quick brown fox jumps over the lazy dog. " * 20
+        context = [
+            {"content": passage, "source": f"document_{i}.txt"} for i in range(passages)
+        ]
+        system_message = {"role": "system", "content": app_llm.system_prompt}
+
+        def create_message(id: int, role: str, content: str) -> SimpleNamespace:
+            llm_message = {"role": role, "content": content}
+
+            return SimpleNamespace(
+                id=id, generated_media=None, as_llm_format=lambda: llm_message
+            )
+
+        try:
+            for prompt_layout in ("rag_first", "prefix_stable"):
+                app_llm.prompt_layout = prompt_layout
+                anchor_summary = prompt_layout == "prefix_stable"
+                tracker = PrefixReuseTracker()
+                chat = SimpleNamespace(id=1, chat_messages=[], chat_summary=None)
+                prompt_chars = 0
+
+                for turn in range(turns):
+                    chat.chat_messages.append(
+                        create_message(2 * turn, "user", f"Question number {turn}?")
+                    )
+                    messages = chat_messages_as_llm_format(
+                        chat=chat,
+                        assistant_role_value="assistant",
+                        use_summary=use_summaries,
+                        anchor_summary=anchor_summary,
+                    )
+                    messages = app_llm.render_last_message_with_rag_prompt(
+                        messages=messages, context=context
+                    )
+                    prompt = serialize_messages([system_message] + messages)
+                    tracker.record_prompt("bench", prompt)
+                    prompt_chars += len(prompt)
+
+                    response_message = create_message(
+                        2 * turn + 1,
+                        "assistant",
+                        f"Answer number {turn}." + " word" * answer_words,
+                    )
+                    chat.chat_messages.append(response_message)
+
+                    if use_summaries and app.chat_manager.should_update_summary(
+                        chat=chat, anchor_summary=anchor_summary
+                    ):
+                        chat.chat_summary = SimpleNamespace(
+                            content=f"Summary up to answer {turn}.",
+                            last_message_id=response_message.id,
+                        )
+
+                stats = tracker.get_stats()
+                recomputed_chars = prompt_chars * (1 - stats["prefix_reuse_ratio"])
+                click.echo(
+                    f"{prompt_layout}: prefix reuse {stats['prefix_reuse_ratio']:.1%}, "
+                    f"{recomputed_chars / turns:.0f} chars to evaluate per turn"
+                )
+        finally:
+            app_llm.prompt_layout = original_prompt_layout
+
+    @app.cli.command("bench_vector_index")
+    @click.option("--num-vectors", default=50000)
+    @click.option("--dimensions", default=384)
+    @click.option("--num-queries", default=200)
+    @click.option("--k", default=10)
+    def bench_vector_index(num_vectors: int, dimensions: int, num_queries: int, k: int):
+        vectors, queries = generate_clustered_vectors(
+            num_vectors=num_vectors, dimensions=dimensions, num_queries=num_queries
+        )
+
+        def run(search) -> tuple[list, float]:
+            start = time.perf_counter()
+            results = [search(query) for query in queries]
+            latency_ms = (time.perf_counter() - start) / num_queries * 1000
+
+            return results, latency_ms
+
+        exact_results, brute_force_ms = run(
+            lambda query: np.argsort(-(vectors @ query))[:k]
+        )
+        click.echo(f"brute force (full sort): {brute_force_ms:.2f}ms/query")
+
+        candidates = {
+            "argpartition": lambda query: top_k_dot_product(vectors, query, k)[0]
+        }
+
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                start = time.perf_counter()
+                hnsw_index = HnswIndex(
+                    dimensions=dimensions,
+                    filepath=os.path.join(temp_dir, "hnsw.bin"),
+                    initial_capacity=num_vectors,
+                )
+                hnsw_index.add(vectors=vectors, labels=np.arange(num_vectors))
+                click.echo(f"hnsw build: {time.perf_counter() - start:.2f}s")
+
+            candidates["hnsw"] = lambda query: hnsw_index.query(query, k)[0]
+        except ImportError:
+            click.echo("hnswlib not installed, skipping hnsw.")
+
+        for name, search in candidates.items():
+            results, latency_ms = run(search)
+            recall = np.mean(
+                [
+                    len(set(result) & set(exact_result)) / k
+                    for result, exact_result in zip(results, exact_results)
+                ]
+            )
+
+            click.echo(f"{name}: {latency_ms:.2f}ms/query, recall@{k} {recall:.3f}")
+
+    @app.cli.command("bench_vector_quantization")
+    @click.option("--num-vectors", default=100000)
+    @click.option("--dimensions", default=384)
+    @click.option("--num-queries", default=200)
+    @click.option("--k", default=10)
+    def bench_vector_quantization(
+        num_vectors: int, dimensions: int, num_queries: int, k: int
+    ):
+        vectors, queries = generate_clustered_vectors(
+            num_vectors=num_vectors, dimensions=dimensions, num_queries=num_queries
+        )
+        candidates = {
+            "float32": vectors,
+            "int8": Int8Vectors.from_float(vectors),
+        }
+        exact_results = [top_k_dot_product(vectors, query, k)[0] for query in queries]
+
+        for name, matrix in candidates.items():
+            start = time.perf_counter()
+            results = [top_k_dot_product(matrix, query, k)[0] for query in queries]
+            latency_ms = (time.perf_counter() - start) / num_queries * 1000
+
+            recall = np.mean(
+                [
+                    len(set(result) & set(exact_result)) / k
+                    for result, exact_result in zip(results, exact_results)
+                ]
+            )
+
+            click.echo(
+                f"{name}: {matrix.nbytes / 2**20:.1f}MiB, "
+                f"{latency_ms:.2f}ms/query, recall@{k} {recall:.3f}"
+            )
+
+    @app.cli.command("bench_opensearch_knn")
+    @click.option("--num-vectors", default=20000)
+    @click.option("--dimensions", default=384)
+    @click.option("--num-queries", default=200)
+    @click.option("--k", default=10)
+    @click.option("--m", "m_values", default="8,16,32")
+    @click.option("--ef-construction", "ef_construction_values", default="100,256")
+    @click.option("--ef-search", "ef_search_values", default="16,64,256")
+    @click.option("--engine", default=None, help="Defaults to the configured one.")
+    def bench_opensearch_knn(
+        num_vectors: int,
+        dimensions: int,
+        num_queries: int,
+        k: int,
+        m_values: str,
+        ef_construction_values: str,
+        ef_search_values: str,
+        engine: str | None,
+    ):
+        # Builds a throwaway index per (m, ef_construction) on the configured
+        # cluster and measures recall against exact search for each ef_search
+        # (faiss: per (m, ef_construction, ef_search))
+        search_backend = app.content_store.search_backend
+
+        if not isinstance(search_backend, OpenSearchBackend):
+            raise click.ClickException("Needs SEARCH_BACKEND=opensearch.")
+
+        vectors, queries = generate_clustered_vectors(
+            num_vectors=num_vectors, dimensions=dimensions, num_queries=num_queries
+        )
+        exact_results = [
+            set(top_k_dot_product(vectors, query, k)[0]) for query in queries
+        ]
+        documents = [
+            {"id": str(i), "page_content": "", "metadata": {}, "embeddings": vector}
+            for i, vector in enumerate(vectors)
+        ]
+
+        def parse_values(values: str) -> list[int]:
+            return [int(value) for value in values.split(",")]
+
+        engine = engine or search_backend.index_profile.engine
+
+        # faiss reads ef_search when the index is created and ignores later
+        # changes, so it gets an index per ef_search instead of a sweep
+        if engine == "faiss":
+            ef_search_groups = [[value] for value in parse_values(ef_search_values)]
+        else:
+            ef_search_groups = [parse_values(ef_search_values)]
+
+        for m, ef_construction, ef_search_group in itertools.product(
+            parse_values(m_values),
+            parse_values(ef_construction_values),
+            ef_search_groups,
+        ):
+            index_profile = dataclasses.replace(
+                search_backend.index_profile,
+                engine=engine,
+                m=m,
+                ef_construction=ef_construction,
+                ef_search=ef_search_group[0],
+                number_of_replicas=0,
+            )
+            bench_backend = OpenSearchBackend(
+                search_config=search_backend.search_config,
+                quantization=search_backend.quantization,
+                index_profile=index_profile,
+                index_name=f"{OpenSearchBackend.INDEX_NAME}_bench",
+            )
+            bench_backend.delete_index()
+            bench_backend.create_index(dimensions=dimensions)
+
+            try:
+                start = time.perf_counter()
+                bench_backend.begin_bulk_load()
+
+                for batch_start in range(0, num_vectors, 1000):
+                    bench_backend.index_documents(
+                        documents[batch_start : batch_start + 1000]
+                    )
+
+                bench_backend.end_bulk_load()
+                build_seconds = time.perf_counter() - start
+                build_ef_search = (
+                    f" ef_search={ef_search_group[0]}" if engine == "faiss" else ""
+                )
+                click.echo(
+                    f"{engine} m={m} ef_construction={ef_construction}"
+                    f"{build_ef_search}: build {build_seconds:.1f}s"
+                )
+
+                for ef_search in ef_search_group:
+                    bench_backend.set_ef_search(ef_search)
+                    latencies_ms = []
+                    recalls = []
+
+                    for query, exact_result in zip(queries, exact_results):
+                        start = time.perf_counter()
+                        hits = bench_backend.vector_query(query, size=k)
+                        latencies_ms.append((time.perf_counter() - start) * 1000)
+                        result = {int(hit["_id"]) for hit in hits}
+                        recalls.append(len(result & exact_result) / k)
+
+                    click.echo(
+                        f"  ef_search={ef_search}: "
+                        f"p50 {np.percentile(latencies_ms, 50):.1f}ms, "
+                        f"p99 {np.percentile(latencies_ms, 99):.1f}ms, "
+                        f"recall@{k} {np.mean(recalls):.3f}"
+                    )
+            finally:
+                bench_backend.delete_index()
+
+    @app.cli.command("bench_embedding_transport")
+    @click.option("--num-chunks", default=100000)
+    @click.option("--dimensions", default=384)
+    @click.option("--batch-size", default=64)
+    def bench_embedding_transport(num_chunks: int, dimensions: int, batch_size: int):
+        # Same payloads Infinity returns for a batch, parsed like the service does
+        rng = np.random.default_rng(42)
+        batch = rng.standard_normal((batch_size, dimensions), dtype=np.float32)
+        payloads = {
+            "float": json.dumps(
+                {
+                    "data": [
+                        {"index": i, "embedding": row.tolist()}
+                        for i, row in enumerate(batch)
+                    ]
+                }
+            ),
+            "base64": json.dumps(
+                {
+                    "data": [
+                        {
+                            "index": i,
+                            "embedding": base64.b64encode(row.tobytes()).decode(),
+                        }
+                        for i, row in enumerate(batch)
+                    ]
+                }
+            ),
+        }
+        decoders = {
+            # Previous approach: a list of Python floats per chunk
+            "float -> list": (
+                "float",
+                lambda data: [item["embedding"] for item in data],
+            ),
+            "float -> ndarray": (
+                "float",
+                lambda data: EmbeddingService.decode_embeddings(
+                    [item["embedding"] for item in data]
+                ),
+            ),
+            "base64 -> ndarray": (
+                "base64",
+                lambda data: EmbeddingService.decode_embeddings(
+                    [item["embedding"] for item in data]
+                ),
+            ),
+        }
+        number_of_batches = -(-num_chunks // batch_size)
+
+        def run(payload: str, decode) -> list:
+            # Keeps every batch, like ingestion did before streaming
+            return [
+                decode(json.loads(payload)["data"]) for _ in range(number_of_batches)
+            ]
+
+        for name, (encoding_format, decode) in decoders.items():
+            payload = payloads[encoding_format]
+
+            start = time.process_time()
+            run(payload, decode)
+            cpu_seconds = time.process_time() - start
+
+            tracemalloc.start()
+            results = run(payload, decode)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del results
+
+            click.echo(
+                f"{name}: {len(payload) * number_of_batches / 2**20:.0f}MiB on the "
+                f"wire, {cpu_seconds:.2f}s CPU, {peak_bytes / 2**20:.0f}MiB peak "
+                f"for {number_of_batches * batch_size} embeddings"
+            )
+
+    @app.cli.command("bench_search_fusion")
+    @click.option("--size", default=3, help="Results per query.")
+    @click.option("--runs", default=5, help="Timed runs over all queries.")
+    def bench_search_fusion(size: int, runs: int):
+        fixture_filepath = os.path.join(
+            app.root_path, "tests", "fixtures", "search_corpus.json"
+        )
+
+        with open(fixture_filepath, "r") as file:
+            corpus = json.load(file)
+
+        embedding_service = app.embedding_service
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            search_backend = LocalSearchBackend(
+                index_dir=os.path.join(temp_dir, "search-index")
+            )
+            search_backend.create_index(
+                dimensions=embedding_service.embedding_model_dimensions
+            )
+            search_backend.index_documents(
+                [
+                    {
+                        "id": document["id"],
+                        "page_content": document["page_content"],
+                        "metadata": {"source": document["source"]},
+                        "embedding_model": embedding_service.model,
+                        "embeddings": embedding_service.get_embeddings(
+                            document["page_content"]
+                        ),
+                    }
+                    for document in corpus["documents"]
+                ]
+            )
+
+            content_store = ContentStore(
+                search_backend=search_backend,
+                content_dir=temp_dir,
+                embedding_service=embedding_service,
+                fusion_weights=app.config["SEARCH_FUSION_WEIGHTS"],
+                fusion_candidates=app.config["SEARCH_FUSION_CANDIDATES"],
+                rrf_k=app.config["SEARCH_FUSION_RRF_K"],
+                # Measure the searches, not the caches
+                embedding_cache_size=0,
+                results_cache_size=0,
+            )
+
+            strategies = {
+                "backend (sequential)": content_store.hybrid_query,
+                "keyword": content_store.keyword_query,
+                "vector": content_store.vector_query,
+                "rrf (parallel)": lambda text, size: content_store.fused_query(
+                    text=text, size=size, method="rrf"
+                ),
+                "min_max (parallel)": lambda text, size: content_store.fused_query(
+                    text=text, size=size, method="min_max"
+                ),
+            }
+
+            for name, search in strategies.items():
+                latencies = []
+                recalls = []
+                reciprocal_ranks = []
+
+                for _ in range(runs):
+                    for query in corpus["queries"]:
+                        start = time.perf_counter()
+                        hits = search(text=query["text"], size=size)
+                        latencies.append(time.perf_counter() - start)
+
+                        hit_ids = [hit["_id"] for hit in hits]
+                        relevant_ids = set(query["relevant_ids"])
+                        recalls.append(
+                            len(relevant_ids & set(hit_ids)) / len(relevant_ids)
+                        )
+                        reciprocal_ranks.append(
+                            next(
+                                (
+                                    1 / rank
+                                    for rank, id in enumerate(hit_ids, start=1)
+                                    if id in relevant_ids
+                                ),
+                                0.0,
+                            )
+                        )
+
+                latencies_ms = np.array(latencies) * 1000
+                click.echo(
+                    f"{name}: p50 {np.percentile(latencies_ms, 50):.2f}ms, "
+                    f"p95 {np.percentile(latencies_ms, 95):.2f}ms, "
+                    f"recall@{size} {np.mean(recalls):.3f}, "
+                    f"MRR {np.mean(reciprocal_ranks):.3f}"
+                )
+
+    @app.cli.command("bench_image_gen")
+    @click.option("--runs", default=3, help="Number of timed runs.")
+    @click.option("--prompt", default="A photo of a cat sitting on a windowsill")
+    def bench_image_gen(runs: int, prompt: str):
+        image_gen = app.image_gen
+
+        if isinstance(image_gen, ImageGenStub):
+            click.echo("FAKE_GENERATION is enabled, nothing to benchmark.")
+            return
+
+        click.echo(
+            f"device={image_gen.device} dtype={image_gen.torch_dtype} "
+            f"backend={image_gen.backend} threads={torch.get_num_threads()} "
+            f"size={image_gen.width}x{image_gen.height} "
+            f"steps={image_gen.num_inference_steps}"
+        )
+
+        # Warm up run, the first call pays for lazy init / kernel selection
+        image_gen.generate_image(prompt=prompt)
+
+        timings = []
+
+        for run in range(runs):
+            start = time.perf_counter()
+            image_gen.generate_image(prompt=prompt)
+            timings.append(time.perf_counter() - start)
+
+            click.echo(f"run {run + 1}: {timings[-1]:.2f}s")
+
+        output = f"{sum(timings) / len(timings):.2f} seconds per image"
+        click.echo(output)
+        app.logger_service.log(f"bench_image_gen: {output}")
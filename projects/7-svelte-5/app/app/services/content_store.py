@@ -1,148 +1,200 @@
+import threading
+import time
 import uuid
 
-from dataclasses import dataclass
+import numpy as np
 
-from langchain_core.documents import Document
-from opensearchpy import OpenSearch
-
-from app.services.data_loader import DataLoader
-from app.services.embedding_service import EmbeddingService
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 
+from app.lib.lru_cache import LruCache
+from app.lib.near_duplicates import NearDuplicateIndex
+from app.lib.rank_fusion import DEFAULT_RRF_K, fuse_results
 
-@dataclass
-class OpenSearchConfig:
-    hostname: str
-    port: str
-    auth: tuple[str, str]
-    use_ssl: bool = True
-    verify_certs: bool = False
+from app.services.data_loader import DataLoader, Document
+from app.services.embedding_service import EmbeddingService
+from app.services.ingestion_pipeline import IngestionPipeline
+from app.services.reranker import Reranker
+from app.services.search_backends import SearchBackend
 
 
 class ContentStore:
-    INDEX_NAME = "app_documents"
-    SEARCH_PIPELINE_NAME = "nlp-search-pipeline"
-
-    SEARCH_PIPELINE_SETTINGS = {
-        "description": "Post processor for hybrid search (combine keyword and vector)",
-        "phase_results_processors": [
-            {
-                "normalization-processor": {
-                    "normalization": {"technique": "min_max"},
-                    "combination": {
-                        "technique": "arithmetic_mean",
-                        "parameters": {"weights": [0.3, 0.7]},
-                    },
-                }
-            }
-        ],
-    }
-
-    BASE_SEARCH_QUERY = {
-        "_source": False,
-        "fields": ["page_content", "metadata.source"],
-    }
-
     def __init__(
         self,
-        search_config: OpenSearchConfig,
+        search_backend: SearchBackend,
         content_dir: str,
         embedding_service: EmbeddingService,
+        data_loader: DataLoader | None = None,
+        fusion_method: str | None = None,
+        fusion_weights: list[float] | None = None,
+        fusion_candidates: int = 20,
+        rrf_k: int = DEFAULT_RRF_K,
+        embedding_cache_size: int = 1024,
+        results_cache_size: int = 512,
+        results_cache_ttl_seconds: float = 0,
+        reranker: Reranker | None = None,
+        rerank_candidates: int = 50,
+        rerank_deadline_seconds: float = 1.0,
+        ingestion_batch_size: int = 32,
+        ingestion_index_batch_size: int = 256,
+        ingestion_queue_size: int = 4,
+        ingestion_embedding_workers: int = 1,
+        dedup_threshold: float = 0.0,
+        dedup_max_entries: int = 0,
     ):
         self.content_dir = content_dir
-        self.data_loader = DataLoader(content_dir)
+        self.data_loader = data_loader or DataLoader(content_dir)
         self.embedding_service = embedding_service
-        self.search_client = self.initialize_search_client(config=search_config)
-        self.index_settings = {
-            "settings": {"index": {"number_of_shards": 4}, "index.knn": True},
-            "mappings": {
-                "properties": {
-                    "embeddings": {
-                        "type": "knn_vector",
-                        "dimension": self.embedding_service.get_embedding_model_dimensions(),
-                    },
-                }
-            },
-        }
+        self.search_backend = search_backend
+
+        # None leaves hybrid search to the backend (the OpenSearch pipeline),
+        # "rrf" or "min_max" fuse keyword and vector results here
+        self.fusion_method = fusion_method
+        # (keyword, vector)
+        self.fusion_weights = fusion_weights
+        self.fusion_candidates = fusion_candidates
+        self.rrf_k = rrf_k
+        self.query_executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="content-store-query"
+        )
+
+        # Query text -> embeddings and (query kind, text, size, index version)
+        # -> hits. Bumping the index version on every index change makes old
+        # results unreachable, so repeated questions skip both backends. The
+        # version includes the backend's own, if it has one, for changes made
+        # by other processes, the TTL bounds staleness for backends without.
+        self.embedding_cache = LruCache(max_size=embedding_cache_size)
+        self.results_cache = LruCache(
+            max_size=results_cache_size, ttl_seconds=results_cache_ttl_seconds
+        )
+        self.index_version = 0
+        self.index_version_lock = threading.Lock()
+
+        # Optional second stage: rerank the top rerank_candidates hits, if
+        # that takes longer than the deadline use the first stage order
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.rerank_deadline_seconds = rerank_deadline_seconds
+        self.rerank_fallbacks = 0
+        # Separate from query_executor, a rerank that runs past its deadline
+        # keeps its thread until the current batch is done and must not hold
+        # up the first stage queries
+        self.rerank_executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="content-store-rerank"
+        )
+
+        # See IngestionPipeline
+        self.ingestion_batch_size = ingestion_batch_size
+        self.ingestion_index_batch_size = ingestion_index_batch_size
+        self.ingestion_queue_size = ingestion_queue_size
+        self.ingestion_embedding_workers = ingestion_embedding_workers
+        # Estimated Jaccard similarity above which chunks loaded in the same
+        # run are dropped as near duplicates, 0 keeps everything
+        self.dedup_threshold = dedup_threshold
+        # Chunks remembered for that, see NearDuplicateIndex
+        self.dedup_max_entries = dedup_max_entries
 
         self.ensure_search_setup()
 
     ########
     # Setup
     ########
-    def initialize_search_client(self, config: OpenSearchConfig) -> OpenSearch:
-        return OpenSearch(
-            hosts=[{"host": config.hostname, "port": config.port}],
-            http_auth=config.auth,
-            use_ssl=config.use_ssl,
-            verify_certs=config.verify_certs,
-        )
-
     def ensure_search_setup(self) -> None:
         self.ensure_index_exists()
-        self.ensure_search_pipeline_exists()
+        self.search_backend.ensure_search_setup()
 
     def ensure_index_exists(self) -> None:
-        try:
-            self.search_client.indices.get(self.INDEX_NAME)
-        except:
+        if not self.search_backend.index_exists():
             self.refresh_index()
 
-    def refresh_index(self) -> None:
-        try:
-            self.search_client.indices.delete(self.INDEX_NAME)
-        except:
-            pass
+    def refresh_index(self, on_progress: Callable[[dict], None] | None = None) -> dict:
+        self.search_backend.delete_index()
+        self.bump_index_version()
+        self.search_backend.create_index(
+            dimensions=self.embedding_service.get_embedding_model_dimensions()
+        )
 
-        self.search_client.indices.create(self.INDEX_NAME, body=self.index_settings)
-        self.load_documents_from_disk_into_index()
+        return self.load_documents_from_disk_into_index(on_progress=on_progress)
 
-    def ensure_search_pipeline_exists(self) -> None:
-        try:
-            self.search_client.http.get(
-                f"/_search/pipeline/{self.SEARCH_PIPELINE_NAME}"
-            )
-        except:
-            self.refresh_search_pipeline()
+    def bump_index_version(self) -> None:
+        with self.index_version_lock:
+            self.index_version += 1
+            self.results_cache.clear()
 
-    def refresh_search_pipeline(self) -> None:
-        try:
-            self.search_client.http.delete(
-                f"/_search/pipeline/{self.SEARCH_PIPELINE_NAME}"
-            )
-        except:
-            pass
+    def get_index_version(self) -> tuple:
+        return (self.index_version, self.search_backend.get_index_version())
 
-        self.search_client.http.put(
-            f"/_search/pipeline/{self.SEARCH_PIPELINE_NAME}",
-            body=self.SEARCH_PIPELINE_SETTINGS,
-        )
+    def get_cache_stats(self) -> dict:
+        return {
+            "index_version": self.index_version,
+            "embeddings": self.embedding_cache.get_stats(),
+            "results": self.results_cache.get_stats(),
+            "rerank_fallbacks": self.rerank_fallbacks,
+        }
 
     ########
     # Loader
     ########
-    def load_documents_from_disk_into_index(self) -> None:
+    def load_documents_from_disk_into_index(
+        self, on_progress: Callable[[dict], None] | None = None
+    ) -> dict:
         documents = self.data_loader.load_documents_from_disk()
-        self.load_documents_into_index(documents)
 
-    def load_documents_into_index(self, documents: list[Document]) -> None:
-        for document in documents:
-            # Todo: use bulk upload
-            search_body = document.dict()
-            search_body.update(
+        return self.load_documents_into_index(documents, on_progress=on_progress)
+
+    def load_documents_into_index(
+        self,
+        documents: Iterable[Document],
+        on_progress: Callable[[dict], None] | None = None,
+    ) -> dict:
+        # Streams chunks through embedding and indexing, documents can be a
+        # generator and is never materialized
+        ingestion_pipeline = IngestionPipeline(
+            embed_documents=self.build_search_documents,
+            index_documents=self.search_backend.index_documents,
+            batch_size=self.ingestion_batch_size,
+            index_batch_size=self.ingestion_index_batch_size,
+            queue_size=self.ingestion_queue_size,
+            embedding_workers=self.ingestion_embedding_workers,
+            near_duplicate_index=(
+                NearDuplicateIndex(
+                    threshold=self.dedup_threshold,
+                    max_entries=self.dedup_max_entries,
+                )
+                if self.dedup_threshold
+                else None
+            ),
+            on_progress=on_progress,
+        )
+
+        # Lets the backend pause refreshes until everything is written
+        self.search_backend.begin_bulk_load()
+
+        try:
+            return ingestion_pipeline.run(documents)
+        finally:
+            self.search_backend.end_bulk_load()
+            self.bump_index_version()
+
+    def build_search_documents(self, documents: list[Document]) -> list[dict]:
+        embeddings = self.embedding_service.get_embeddings_batch(
+            [document.page_content for document in documents]
+        )
+        search_documents = []
+
+        for document, document_embeddings in zip(documents, embeddings):
+            search_document = document.dict()
+            search_document.update(
                 {
+                    "id": str(uuid.uuid1()),
                     "embedding_model": self.embedding_service.model,
-                    "embeddings": self.embedding_service.get_embeddings(
-                        document.page_content
-                    ),
+                    "embeddings": document_embeddings,
                 }
             )
 
-            self.search_client.index(
-                index=self.INDEX_NAME,
-                body=search_body,
-                id=str(uuid.uuid1()),
-                refresh=True,
-            )
+            search_documents.append(search_document)
+
+        return search_documents
 
     def add_document(self, title: str, body: str) -> None:
         document_file_path = self.data_loader.save_document_to_disk(title, body)
@@ -156,87 +208,146 @@ class ContentStore:
     # Search
     ########
     def query(self, text: str, size: int = 3) -> list:
+        if self.reranker:
+            return self.reranked_query(text=text, size=size)
+
         return self.hybrid_query(text=text, size=size)
 
+    def reranked_query(self, text: str, size: int = 3) -> list:
+        cache_key = ("reranked", text, size, self.get_index_version())
+        hits = self.results_cache.get(cache_key)
+
+        if hits is not None:
+            return list(hits)
+
+        candidates = self.hybrid_query(
+            text=text, size=max(size, self.rerank_candidates)
+        )
+
+        if len(candidates) <= 1:
+            return candidates[:size]
+
+        rerank_future = self.rerank_executor.submit(
+            self.reranker.rerank,
+            query=text,
+            documents=[hit["fields"]["page_content"][0] for hit in candidates],
+            deadline=time.monotonic() + self.rerank_deadline_seconds,
+        )
+
+        try:
+            scores = rerank_future.result(timeout=self.rerank_deadline_seconds)
+        except Exception:
+            # Deadline hit or the reranker failed. Not cached, so the next
+            # ask gets another chance at a rerank. A running rerank stops at
+            # its next batch, a queued one right away
+            rerank_future.cancel()
+            self.rerank_fallbacks += 1
+
+            return candidates[:size]
+
+        reranked_hits = sorted(
+            ({**hit, "_score": score} for hit, score in zip(candidates, scores)),
+            key=lambda hit: hit["_score"],
+            reverse=True,
+        )[:size]
+        self.results_cache.set(cache_key, reranked_hits)
+
+        return list(reranked_hits)
+
     def hybrid_query(self, text: str, size: int = 3) -> list:
-        query_embeddings = self.embedding_service.get_embeddings(text)
-
-        search_query = self.BASE_SEARCH_QUERY.copy()
-        search_query.update(
-            {
-                "size": size,
-                "query": {
-                    "hybrid": {
-                        "queries": [
-                            {"match": {"page_content": {"query": text}}},
-                            {
-                                "knn": {
-                                    "embeddings": {
-                                        "vector": query_embeddings,
-                                        "k": size,
-                                    }
-                                }
-                            },
-                        ]
-                    }
-                },
-            }
+        if self.fusion_method:
+            return self.fused_query(text=text, size=size)
+
+        return self.get_cached_results(
+            query_kind="hybrid",
+            text=text,
+            size=size,
+            search=lambda: self.search_backend.hybrid_query(
+                text=text, embeddings=self.get_query_embeddings(text), size=size
+            ),
         )
 
-        results = self.search_client.search(
-            index=self.INDEX_NAME,
-            body=search_query,
-            params={"search_pipeline": self.SEARCH_PIPELINE_NAME},
+    def fused_query(
+        self,
+        text: str,
+        size: int = 3,
+        method: str | None = None,
+        weights: list[float] | None = None,
+    ) -> list:
+        method = method or self.fusion_method or "rrf"
+        weights = weights or self.fusion_weights
+
+        return self.get_cached_results(
+            query_kind=("fused", method, tuple(weights or ())),
+            text=text,
+            size=size,
+            search=lambda: self.get_fused_results(
+                text=text, size=size, method=method, weights=weights
+            ),
         )
 
-        return results["hits"]["hits"]
+    def get_fused_results(
+        self, text: str, size: int, method: str, weights: list[float] | None
+    ) -> list:
+        candidates = max(size, self.fusion_candidates)
 
-    def keyword_query(self, text: str, size: int = 3) -> list:
-        search_query = self.BASE_SEARCH_QUERY.copy()
-        search_query.update(
-            {"size": size, "query": {"match": {"page_content": {"query": text}}}}
+        # The keyword query runs while the query gets embedded
+        keyword_future = self.query_executor.submit(
+            self.search_backend.keyword_query, text=text, size=candidates
+        )
+        vector_hits = self.search_backend.vector_query(
+            embeddings=self.get_query_embeddings(text), size=candidates
         )
 
-        results = self.search_client.search(index=self.INDEX_NAME, body=search_query)
+        return fuse_results(
+            [keyword_future.result(), vector_hits],
+            size=size,
+            method=method,
+            weights=weights,
+            rrf_k=self.rrf_k,
+        )
 
-        return results["hits"]["hits"]
+    def keyword_query(self, text: str, size: int = 3) -> list:
+        return self.get_cached_results(
+            query_kind="keyword",
+            text=text,
+            size=size,
+            search=lambda: self.search_backend.keyword_query(text=text, size=size),
+        )
 
     def vector_query(self, text: str, size: int = 3) -> list:
-        query_embeddings = self.embedding_service.get_embeddings(text)
-
-        search_query = self.BASE_SEARCH_QUERY.copy()
-        search_query.update(
-            {
-                "size": size,
-                "query": {
-                    "knn": {
-                        "embeddings": {
-                            "vector": query_embeddings,
-                            "k": size,
-                        }
-                    }
-                },
-            }
+        return self.get_cached_results(
+            query_kind="vector",
+            text=text,
+            size=size,
+            search=lambda: self.search_backend.vector_query(
+                embeddings=self.get_query_embeddings(text), size=size
+            ),
         )
 
-        results = self.search_client.search(index=self.INDEX_NAME, body=search_query)
+    def get_query_embeddings(self, text: str) -> np.ndarray:
+        cache_key = (self.embedding_service.model, text)
+        embeddings = self.embedding_cache.get(cache_key)
 
-        return results["hits"]["hits"]
+        if embeddings is None:
+            embeddings = self.embedding_service.get_embeddings(text)
+            self.embedding_cache.set(cache_key, embeddings)
 
-    def find_document(self, query: str) -> dict:
-        search_query = self.BASE_SEARCH_QUERY.copy()
-        search_query.update(
-            {"size": 1, "query": {"wildcard": {"metadata.source": f"*{query}*"}}}
-        )
+        return embeddings
 
-        results = self.search_client.search(index=self.INDEX_NAME, body=search_query)
+    def get_cached_results(
+        self, query_kind: str | tuple, text: str, size: int, search
+    ) -> list:
+        # Read the version before searching, so results that raced with an
+        # index change are stored under the old version and never served
+        cache_key = (query_kind, text, size, self.get_index_version())
+        hits = self.results_cache.get(cache_key)
 
-        if not results["hits"]["hits"]:
-            return {}
+        if hits is None:
+            hits = search()
+            self.results_cache.set(cache_key, hits)
 
-        hit = results["hits"]["hits"][0]
+        return list(hits)
 
-        return {
-            "source": hit["fields"]["metadata.source"][0],
-            "page_content": hit["fields"]["page_content"][0],
-        }
+    def find_document(self, query: str) -> dict:
+        return self.search_backend.find_document(query)
@@ -1,33 +1,136 @@
-from langchain_core.documents import Document
+import os
 
-from langchain_community.document_loaders import DirectoryLoader
-from langchain_community.document_loaders import TextLoader
-
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from collections import deque
+from collections.abc import Callable, Generator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
 
 from app.lib.fs_utils import save_document_to_disk
+from app.lib.text_chunker import TextChunker
+from app.lib.text_extractors import get_supported_extensions, iter_text_blocks
+
+
+@dataclass
+class Document:
+    page_content: str
+    metadata: dict = field(default_factory=dict)
+
+    def dict(self) -> dict:
+        return asdict(self)
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(tokenizer_name: str | None) -> Callable[[str], int] | None:
+    # Once per process, None falls back to the approximate count
+    if not tokenizer_name:
+        return None
+
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def iter_file_documents(
+    filepath: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    tokenizer_name: str | None = None,
+) -> Generator[Document, None, None]:
+    text_chunker = TextChunker(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        token_counter=get_token_counter(tokenizer_name),
+    )
+
+    for chunk in text_chunker.iter_chunks(iter_text_blocks(filepath)):
+        yield Document(page_content=chunk, metadata={"source": filepath})
+
+
+def load_file_documents(
+    filepath: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    tokenizer_name: str | None = None,
+) -> list[Document]:
+    # Runs in the process pool, so it has to be a module level function
+    return list(
+        iter_file_documents(
+            filepath=filepath,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            tokenizer_name=tokenizer_name,
+        )
+    )
 
 
 class DataLoader:
-    def __init__(self, content_dir: str):
+    def __init__(
+        self,
+        content_dir: str,
+        chunk_size: int = 200,
+        chunk_overlap: int = 20,
+        tokenizer_name: str | None = None,
+        max_workers: int = 1,
+        file_extensions: list[str] | None = None,
+    ):
         self.content_dir = content_dir
-        self.directory_loader = DirectoryLoader(self.content_dir, glob="**/*.txt")
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=2
-        )
+        # In tokens, see TextChunker
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.tokenizer_name = tokenizer_name
+        self.max_workers = max_workers
+        self.file_extensions = file_extensions or get_supported_extensions()
+
+    def iter_file_paths(self) -> Generator[str, None, None]:
+        for directory_path, directory_names, file_names in os.walk(self.content_dir):
+            directory_names.sort()
+
+            for file_name in sorted(file_names):
+                if os.path.splitext(file_name)[1].lower() in self.file_extensions:
+                    yield os.path.join(directory_path, file_name)
 
-    def load_documents_from_disk(self) -> list[Document]:
-        documents = self.directory_loader.load()
-        documents = self.text_splitter.split_documents(documents)
+    def load_documents_from_disk(self) -> Generator[Document, None, None]:
+        if self.max_workers <= 1:
+            for filepath in self.iter_file_paths():
+                yield from self.iter_file_documents(filepath)
 
-        return documents
+            return
+
+        # Files are chunked in worker processes. Only a few files are in
+        # flight per worker, so memory doesn't grow with the corpus.
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = deque()
+
+            for filepath in self.iter_file_paths():
+                futures.append(
+                    executor.submit(
+                        load_file_documents,
+                        filepath=filepath,
+                        chunk_size=self.chunk_size,
+                        chunk_overlap=self.chunk_overlap,
+                        tokenizer_name=self.tokenizer_name,
+                    )
+                )
+
+                if len(futures) >= 2 * self.max_workers:
+                    yield from futures.popleft().result()
+
+            while futures:
+                yield from futures.popleft().result()
 
     def load_document_from_disk(self, document_file_path: str) -> list[Document]:
-        text_loader = TextLoader(document_file_path)
-        document = text_loader.load()
-        documents = self.text_splitter.split_documents(document)
+        return list(self.iter_file_documents(document_file_path))
 
-        return documents
+    def iter_file_documents(self, filepath: str) -> Generator[Document, None, None]:
+        return iter_file_documents(
+            filepath=filepath,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            tokenizer_name=self.tokenizer_name,
+        )
 
     def save_document_to_disk(self, title: str, body: str) -> str:
         document_file_path = save_document_to_disk(
@@ -1,4 +1,9 @@
+import base64
+
 import httpx
+import numpy as np
+
+from app.lib.embedding_model_registry import EmbeddingModelInfo, EmbeddingModelRegistry
 
 
 class EmbeddingService:
@@ -6,39 +11,82 @@ class EmbeddingService:
         self,
         inference_api_url: str,
         model: str = "none",
-        encoding_format: str = "float",
+        encoding_format: str = "base64",
         api_key: str = "no-key",
+        model_registry: EmbeddingModelRegistry | None = None,
     ) -> None:
         self.inference_api_url = inference_api_url
         self.model = model
         self.encoding_format = encoding_format
         self.api_key = api_key
+        # Model metadata is looked up lazily, creating the service doesn't
+        # need the embedding server to be up
+        self.model_registry = model_registry or EmbeddingModelRegistry()
 
         self.http_client = httpx.Client(timeout=60)
 
         self.endpoint = f"{self.inference_api_url}/embeddings"
-        self.embedding_model_dimensions = self.get_embedding_model_dimensions()
+
+    @property
+    def embedding_model_dimensions(self) -> int:
+        return self.get_embedding_model_dimensions()
 
     def get_embedding_model_dimensions(self) -> int:
-        embedding_model_dimensions = 0
+        return self.get_model_info().dimensions
+
+    def get_model_info(self) -> EmbeddingModelInfo:
+        return self.model_registry.get_or_probe(self.model, self.probe_model_info)
+
+    def probe_model_info(self) -> EmbeddingModelInfo:
         test_embeddings = self.get_embeddings("")
-        embedding_model_dimensions = len(test_embeddings)
 
-        return embedding_model_dimensions
+        return self.build_model_info(test_embeddings)
+
+    def build_model_info(self, embeddings: np.ndarray) -> EmbeddingModelInfo:
+        # The server doesn't report pooling, only known models have it
+        return EmbeddingModelInfo(
+            model=self.model,
+            dimensions=len(embeddings),
+            normalized=bool(abs(np.linalg.norm(embeddings) - 1) < 1e-3),
+        )
 
-    def get_embeddings(self, embedding_input: str) -> list:
+    def get_embeddings(self, embedding_input: str) -> np.ndarray:
+        return self.get_embeddings_batch([embedding_input])[0]
+
+    def get_embeddings_batch(self, embedding_inputs: list[str]) -> np.ndarray:
+        # One request for the whole batch, one row per input
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}",
         }
 
         body = {
-            "input": embedding_input,
+            "input": embedding_inputs,
             "model": self.model,
             "encoding_format": self.encoding_format,
         }
 
         response = self.http_client.post(self.endpoint, headers=headers, json=body)
-        data = response.json()
+        response.raise_for_status()
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        embeddings = self.decode_embeddings([item["embedding"] for item in data])
+
+        # Any real response is as good as a probe
+        if len(embeddings) and self.model_registry.get(self.model) is None:
+            self.model_registry.set(self.build_model_info(embeddings[0]))
+
+        return embeddings
+
+    @staticmethod
+    def decode_embeddings(embeddings: list[list | str]) -> np.ndarray:
+        """
+        encoding_format="base64" sends little endian float32 bytes: about a
+        quarter of the JSON size, and np.frombuffer reads them without
+        creating a Python float per value.
+        """
+        if embeddings and isinstance(embeddings[0], str):
+            buffer = b"".join(base64.b64decode(embedding) for embedding in embeddings)
+
+            return np.frombuffer(buffer, dtype="<f4").reshape(len(embeddings), -1)
 
-        return data["data"][0]["embedding"]
+        return np.asarray(embeddings, dtype=np.float32)
@@ -1,37 +1,177 @@
+import base64
+import io
 import os
+import queue
+import threading
+
+from collections.abc import Callable, Generator
+from functools import cached_property
 
 import torch
 
 from diffusers import (
+    AutoencoderTiny,
     FluxPipeline,
     # StableDiffusionPipeline,
     # DPMSolverMultistepScheduler,
     LCMScheduler,
     AutoPipelineForText2Image,
 )
+from PIL.Image import Image
 
 from app.lib.fs_utils import get_safe_file_name
 
+# (step, total_steps, preview data url or None)
+StepCallback = Callable[[int, int, str | None], None]
+
+
+class ImageGenCancelled(Exception):
+    pass
+
+
+def stream_image_gen_progress(
+    gen_image_from_prompt: Callable[..., str],
+    prompt: str,
+    include_previews: bool = False,
+    delete_image: Callable[[str], None] | None = None,
+) -> Generator[dict, None, None]:
+    """
+    Runs the generation in a thread and yields progress events as they come in,
+    followed by a final "done" (or "error") event with the image filename.
+    Closing the generator (the client went away) stops the generation at the
+    next step, an image that got done anyway is deleted with delete_image.
+    """
+    events = queue.Queue()
+    cancelled = threading.Event()
+    # Deciding between delivering and deleting a finished image
+    done_lock = threading.Lock()
+
+    def on_step(step: int, total_steps: int, preview: str | None) -> None:
+        if cancelled.is_set():
+            raise ImageGenCancelled()
+
+        events.put(
+            {
+                "type": "progress",
+                "step": step,
+                "total_steps": total_steps,
+                "preview": preview,
+            }
+        )
+
+    def run() -> None:
+        try:
+            filename = gen_image_from_prompt(
+                prompt=prompt, on_step=on_step, include_previews=include_previews
+            )
+        except ImageGenCancelled:
+            return
+        except Exception as e:
+            events.put({"type": "error", "message": str(e)})
+            return
+
+        with done_lock:
+            if not cancelled.is_set():
+                events.put({"type": "done", "filename": filename})
+                return
+
+        if delete_image:
+            delete_image(filename)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            event = events.get()
+
+            yield event
+
+            if event["type"] in ("done", "error"):
+                break
+    finally:
+        with done_lock:
+            cancelled.set()
+
+            undelivered_events = []
+
+            while not events.empty():
+                undelivered_events.append(events.get())
+
+        for event in undelivered_events:
+            if event["type"] == "done" and delete_image:
+                delete_image(event["filename"])
+
 
 class ImageGenStub:
     TEST_IMAGE_FILENAME = "test.png"
+    NUM_INFERENCE_STEPS = 4
+
+    def gen_image_from_prompt(
+        self,
+        prompt: str,
+        on_step: StepCallback | None = None,
+        include_previews: bool = False,
+    ) -> str:
+        if on_step:
+            for step in range(1, self.NUM_INFERENCE_STEPS + 1):
+                on_step(step, self.NUM_INFERENCE_STEPS, None)
 
-    def gen_image_from_prompt(self, prompt: str) -> str:
         return self.TEST_IMAGE_FILENAME
 
+    def gen_image_from_prompt_stream(
+        self, prompt: str, include_previews: bool = False
+    ) -> Generator[dict, None, None]:
+        return stream_image_gen_progress(
+            self.gen_image_from_prompt,
+            prompt=prompt,
+            include_previews=include_previews,
+        )
+
 
 class ImageGen:
-    def __init__(self, images_dir: str):
+    TORCH_BACKEND = "torch"
+    OPENVINO_BACKEND = "openvino"
+    ONNX_BACKEND = "onnx"
+
+    # https://huggingface.co/madebyollin/taesd
+    PREVIEW_VAE_ID = "madebyollin/taesd"
+    PREVIEW_SIZE = 128
+
+    def __init__(
+        self,
+        images_dir: str,
+        device: str = "auto",
+        dtype: str = "auto",
+        num_threads: int = 0,
+        backend: str = TORCH_BACKEND,
+        export_dir: str | None = None,
+        height: int = 512,
+        width: int = 512,
+        num_inference_steps: int = 4,
+    ):
         self.images_dir = images_dir
 
-        self.torch_dtype = torch.float16
+        self.device = self.get_device(device)
+        self.torch_dtype = self.get_torch_dtype(dtype, device=self.device)
+        self.backend = backend
+        self.export_dir = export_dir
+
+        self.height = height
+        self.width = width
+        self.num_inference_steps = num_inference_steps
 
-        self.pipe_variant = "fp16"
+        # fp16 weight variants only make sense on the GPU, on CPU half precision
+        # matmuls are either unsupported or much slower than float32
+        self.pipe_variant = "fp16" if self.is_cuda else None
         self.bypass_safety_checker = False
         self.use_torch_compile = False
 
-        if torch.cuda.is_available() and torch.cuda.is_bf16_supported():
-            self.torch_dtype = torch.bfloat16
+        # The pipeline isn't thread safe and requests (and streams) run in threads
+        self.pipe_lock = threading.Lock()
+
+        if not self.is_cuda and num_threads > 0:
+            torch.set_num_threads(num_threads)
 
         # https://huggingface.co/docs/diffusers/tutorials/fast_diffusion#torchcompile
         if self.use_torch_compile:
@@ -43,9 +183,15 @@ class ImageGen:
         # https://huggingface.co/blog/lcm_lora
         self.model_id = "Lykon/absolute-reality-1.0"
         self.adapter_id = "latent-consistency/lcm-lora-sdv1-5"
-        self.pipe = self.get_sd_15_lcm_pipeline(
-            model_id=self.model_id, adapter_id=self.adapter_id
-        )
+
+        if self.backend == self.TORCH_BACKEND:
+            self.pipe = self.get_sd_15_lcm_pipeline(
+                model_id=self.model_id, adapter_id=self.adapter_id
+            )
+        else:
+            self.pipe = self.get_exported_sd_15_lcm_pipeline(
+                model_id=self.model_id, adapter_id=self.adapter_id
+            )
 
         # self.model_id = "black-forest-labs/FLUX.1-schnell"
         # self.pipe = self.get_flux_1_pipeline(model_id=self.model_id)
@@ -61,6 +207,50 @@ class ImageGen:
                 self.pipe.vae.decode, mode="max-autotune", fullgraph=True
             )
 
+    @property
+    def is_cuda(self) -> bool:
+        return self.device == "cuda"
+
+    ########
+    # Setup
+    ########
+    @staticmethod
+    def get_device(device: str = "auto") -> str:
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+
+        return device
+
+    @staticmethod
+    def get_torch_dtype(dtype: str = "auto", device: str = "cpu") -> torch.dtype:
+        if dtype != "auto":
+            return getattr(torch, dtype)
+
+        if device == "cuda":
+            if torch.cuda.is_bf16_supported():
+                return torch.bfloat16
+
+            return torch.float16
+
+        if ImageGen.cpu_supports_bf16():
+            return torch.bfloat16
+
+        return torch.float32
+
+    @staticmethod
+    def cpu_supports_bf16() -> bool:
+        # bfloat16 is only faster than float32 on CPUs with native bf16 support
+        # (AVX512_BF16 / AMX), everywhere else it gets emulated
+        native_bf16_flags = ("avx512_bf16", "amx_bf16")
+
+        try:
+            with open("/proc/cpuinfo", "r") as file:
+                cpuinfo = file.read()
+        except OSError:
+            return False
+
+        return any(flag in cpuinfo for flag in native_bf16_flags)
+
     def get_sd_15_lcm_pipeline(
         self, model_id: str, adapter_id: str
     ) -> AutoPipelineForText2Image:
@@ -82,13 +272,60 @@ class ImageGen:
 
         pipe.scheduler = LCMScheduler.from_config(pipe.scheduler.config)
 
-        if torch.cuda.is_available():
-            pipe = pipe.to("cuda")
+        pipe = pipe.to(self.device)
 
         # load and fuse lcm lora
         pipe.load_lora_weights(adapter_id)
         pipe.fuse_lora()
 
+        if not self.is_cuda:
+            self.apply_cpu_optimizations(pipe)
+
+        return pipe
+
+    def apply_cpu_optimizations(self, pipe: AutoPipelineForText2Image) -> None:
+        # https://huggingface.co/docs/diffusers/optimization/memory
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+        pipe.enable_attention_slicing()
+
+    def get_exported_sd_15_lcm_pipeline(self, model_id: str, adapter_id: str):
+        # The exporters can't apply a LoRA themselves, so fuse the LCM LoRA with
+        # torch once, save the merged weights and export from those.
+        # https://huggingface.co/docs/optimum/intel/openvino/inference
+        # https://huggingface.co/docs/optimum/onnxruntime/usage_guides/models
+        if self.backend == self.OPENVINO_BACKEND:
+            from optimum.intel import OVStableDiffusionPipeline as ExportedPipeline
+        elif self.backend == self.ONNX_BACKEND:
+            from optimum.onnxruntime import (
+                ORTStableDiffusionPipeline as ExportedPipeline,
+            )
+        else:
+            raise ValueError(f"Unknown image gen backend: {self.backend}")
+
+        if self.export_dir is None:
+            raise ValueError(
+                f"An export dir is required for the {self.backend} backend"
+            )
+
+        merged_model_dir = os.path.join(self.export_dir, "merged")
+        exported_model_dir = os.path.join(self.export_dir, self.backend)
+
+        if os.path.isdir(exported_model_dir):
+            pipe = ExportedPipeline.from_pretrained(exported_model_dir)
+        else:
+            if not os.path.isdir(merged_model_dir):
+                torch_pipe = self.get_sd_15_lcm_pipeline(
+                    model_id=model_id, adapter_id=adapter_id
+                )
+                torch_pipe.to(torch.float32).save_pretrained(merged_model_dir)
+                del torch_pipe
+
+            pipe = ExportedPipeline.from_pretrained(merged_model_dir, export=True)
+            pipe.save_pretrained(exported_model_dir)
+
+        pipe.scheduler = LCMScheduler.from_config(pipe.scheduler.config)
+
         return pipe
 
     def get_flux_1_pipeline(self, model_id: str) -> FluxPipeline:
@@ -97,30 +334,37 @@ class ImageGen:
             torch_dtype=self.torch_dtype,
         )
 
-        if torch.cuda.is_available():
-            pipe = pipe.to("cuda")
+        pipe = pipe.to(self.device)
 
         # pipe.enable_model_cpu_offload()
 
         return pipe
 
-    def gen_image_from_prompt(self, prompt: str) -> str:
-        # height = 512
-        # width = 512
-        guidance_scale = 0.0
-        num_inference_steps = 4
-        # max_sequence_length = 256
-        # generator = torch.Generator(device="cuda").manual_seed(30)
-        # negative_prompt = "poor details"
+    @cached_property
+    def preview_vae(self) -> AutoencoderTiny:
+        # Tiny VAE decodes latents in a few ms, the full VAE is too slow for
+        # decoding on every step
+        preview_vae = AutoencoderTiny.from_pretrained(
+            self.PREVIEW_VAE_ID, torch_dtype=self.torch_dtype
+        )
 
+        return preview_vae.to(self.device)
+
+    ############
+    # Generation
+    ############
+    def gen_image_from_prompt(
+        self,
+        prompt: str,
+        on_step: StepCallback | None = None,
+        include_previews: bool = False,
+    ) -> str:
         filename = get_safe_file_name(prompt, file_extension=".png")
         image_filepath = self.get_image_filepath(filename)
 
-        image = self.pipe(
-            prompt=prompt,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-        ).images[0]
+        image = self.generate_image(
+            prompt=prompt, on_step=on_step, include_previews=include_previews
+        )
 
         # image = self.pipe(
         #     prompt, height=height, width=width, guidance_scale=0.0, num_inference_steps=4, max_sequence_length=256
@@ -130,7 +374,89 @@ class ImageGen:
 
         return filename
 
+    def gen_image_from_prompt_stream(
+        self, prompt: str, include_previews: bool = True
+    ) -> Generator[dict, None, None]:
+        return stream_image_gen_progress(
+            self.gen_image_from_prompt,
+            prompt=prompt,
+            include_previews=include_previews,
+            delete_image=self.delete_image,
+        )
+
+    def generate_image(
+        self,
+        prompt: str,
+        on_step: StepCallback | None = None,
+        include_previews: bool = False,
+    ) -> Image:
+        guidance_scale = 0.0
+        # max_sequence_length = 256
+        # generator = torch.Generator(device="cuda").manual_seed(30)
+        # negative_prompt = "poor details"
+
+        pipe_kwargs = {}
+
+        # The exported (OpenVINO / ONNX) pipelines don't support step callbacks
+        if on_step and self.backend == self.TORCH_BACKEND:
+            pipe_kwargs = {
+                "callback_on_step_end": self.get_step_end_callback(
+                    on_step=on_step, include_previews=include_previews
+                ),
+                "callback_on_step_end_tensor_inputs": ["latents"],
+            }
+
+        with self.pipe_lock:
+            image = self.pipe(
+                prompt=prompt,
+                height=self.height,
+                width=self.width,
+                num_inference_steps=self.num_inference_steps,
+                guidance_scale=guidance_scale,
+                **pipe_kwargs,
+            ).images[0]
+
+        return image
+
+    def get_step_end_callback(
+        self, on_step: StepCallback, include_previews: bool = False
+    ) -> Callable:
+        # https://huggingface.co/docs/diffusers/using-diffusers/callback
+        def callback_on_step_end(pipe, step_index, timestep, callback_kwargs) -> dict:
+            preview = None
+
+            if include_previews:
+                preview = self.get_latents_preview(callback_kwargs["latents"])
+
+            on_step(step_index + 1, self.num_inference_steps, preview)
+
+            return callback_kwargs
+
+        return callback_on_step_end
+
+    @torch.no_grad()
+    def get_latents_preview(self, latents: torch.Tensor) -> str:
+        preview_vae = self.preview_vae
+
+        decoded = preview_vae.decode(
+            latents.to(preview_vae.dtype) / preview_vae.config.scaling_factor
+        ).sample
+        image = self.pipe.image_processor.postprocess(decoded, output_type="pil")[0]
+        image.thumbnail((self.PREVIEW_SIZE, self.PREVIEW_SIZE))
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=60)
+        encoded_image = base64.b64encode(buffer.getvalue()).decode("ascii")
+
+        return f"data:image/jpeg;base64,{encoded_image}"
+
     def get_image_filepath(self, filename: str) -> str:
         image_filepath = os.path.join(self.images_dir, filename)
 
         return image_filepath
+
+    def delete_image(self, filename: str) -> None:
+        image_filepath = self.get_image_filepath(filename)
+
+        if os.path.exists(image_filepath):
+            os.remove(image_filepath)
@@ -0,0 +1,130 @@
+import os
+
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image, features
+
+from app.services.app_logger import AppLogger
+
+
+class ImageProcessor:
+    """
+    Post processes generated images into smaller, web friendly variants
+    (WebP / AVIF at a few widths) in a background thread, so encoding stays
+    off the request path.
+    """
+
+    FORMATS = {
+        "avif": {"mime_type": "image/avif", "options": {"quality": 50}},
+        "webp": {"mime_type": "image/webp", "options": {"quality": 80, "method": 4}},
+    }
+
+    def __init__(
+        self,
+        images_dir: str,
+        widths: list[int] | None = None,
+        formats: list[str] | None = None,
+        max_workers: int = 1,
+        logger: AppLogger | None = None,
+    ):
+        self.images_dir = images_dir
+        self.logger = logger
+        self.widths = widths or [256, 512]
+
+        # AVIF support depends on how Pillow was built
+        formats = formats or list(self.FORMATS.keys())
+        self.formats = [
+            format
+            for format in formats
+            if format in self.FORMATS and features.check(format)
+        ]
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image_processor"
+        )
+
+    def submit(
+        self, filename: str, on_done: Callable[[list[dict]], None] | None = None
+    ) -> Future:
+        future = self.executor.submit(self.create_variants, filename)
+
+        if on_done:
+            future.add_done_callback(
+                lambda done_future: self._handle_done(done_future, filename, on_done)
+            )
+
+        return future
+
+    def create_variants(self, filename: str) -> list[dict]:
+        variants = []
+
+        image_filepath = os.path.join(self.images_dir, filename)
+        stem = os.path.splitext(filename)[0]
+
+        try:
+            with Image.open(image_filepath) as image:
+                image.load()
+
+                for width in self.get_variant_widths(original_width=image.width):
+                    height = round(image.height * width / image.width)
+                    resized_image = image
+
+                    if width != image.width:
+                        resized_image = image.resize((width, height), Image.LANCZOS)
+
+                    for format in self.formats:
+                        variant_filename = f"{stem}-{width}w.{format}"
+                        variants.append(
+                            {
+                                "filename": variant_filename,
+                                "mime_type": self.FORMATS[format]["mime_type"],
+                                "width": width,
+                                "height": height,
+                            }
+                        )
+                        resized_image.save(
+                            os.path.join(self.images_dir, variant_filename),
+                            format=format.upper(),
+                            **self.FORMATS[format]["options"],
+                        )
+        except Exception:
+            # All or nothing, the variants are never recorded, so nothing
+            # would ever delete the ones already written
+            for variant_filename in self.get_variant_filenames(variants):
+                variant_filepath = os.path.join(self.images_dir, variant_filename)
+
+                if os.path.exists(variant_filepath):
+                    os.remove(variant_filepath)
+
+            raise
+
+        return variants
+
+    def get_variant_widths(self, original_width: int) -> list[int]:
+        # Never upscale, but always keep a full size variant
+        widths = [width for width in self.widths if width < original_width]
+        widths.append(original_width)
+
+        return sorted(set(widths))
+
+    @staticmethod
+    def get_variant_filenames(variants: list[dict] | None) -> list[str]:
+        return [variant["filename"] for variant in variants or []]
+
+    def _handle_done(
+        self,
+        future: Future,
+        filename: str,
+        on_done: Callable[[list[dict]], None],
+    ) -> None:
+        # Leave the original image in place if encoding failed
+        exception = future.exception()
+
+        if exception is None:
+            on_done(future.result())
+        elif self.logger:
+            self.logger.log(
+                f"ImageProcessor: creating variants of {filename} failed: "
+                f"{exception!r}"
+            )
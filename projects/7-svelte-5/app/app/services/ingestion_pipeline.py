@@ -0,0 +1,265 @@
+import queue
+import threading
+import time
+
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+
+from app.lib.near_duplicates import NearDuplicateIndex
+
+from app.services.data_loader import Document
+
+STOP = object()
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+@dataclass
+class StageStats:
+    name: str
+    items: int = 0
+    batches: int = 0
+    busy_seconds: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, items: int, seconds: float) -> None:
+        with self.lock:
+            self.items += items
+            self.batches += 1
+            self.busy_seconds += seconds
+
+    def to_dict(self) -> dict:
+        # With several workers busy time adds up, so this is per worker
+        return {
+            "items": self.items,
+            "batches": self.batches,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_second": (
+                round(self.items / self.busy_seconds, 1) if self.busy_seconds else 0.0
+            ),
+        }
+
+
+class IngestionPipeline:
+    """
+    chunks -> batched embedder -> bulk indexer. Each stage runs in its own
+    thread and hands batches on through bounded queues, so a slow stage
+    blocks the ones before it and memory stays at a few batches per stage,
+    however large the corpus is.
+    """
+
+    def __init__(
+        self,
+        embed_documents: Callable[[list[Document]], list[dict]],
+        index_documents: Callable[[list[dict]], None],
+        batch_size: int = 32,
+        index_batch_size: int = 256,
+        queue_size: int = 4,
+        embedding_workers: int = 1,
+        near_duplicate_index: NearDuplicateIndex | None = None,
+        on_progress: Callable[[dict], None] | None = None,
+    ):
+        self.embed_documents = embed_documents
+        self.index_documents = index_documents
+        # Documents per embedding request
+        self.batch_size = batch_size
+        # Documents per write, bigger batches are cheaper for bulk writes
+        self.index_batch_size = index_batch_size
+        self.queue_size = queue_size
+        # Threads with an embedding request in flight each
+        self.embedding_workers = embedding_workers
+        # Optional, near duplicate chunks are dropped before embedding
+        self.near_duplicate_index = near_duplicate_index
+        self.on_progress = on_progress
+
+        self.stats = {
+            name: StageStats(name=name) for name in ("chunk", "dedup", "embed", "index")
+        }
+        self.skipped_duplicates = 0
+        # Distinct metadata sources (files) seen by the chunk stage
+        self.sources_read = 0
+        self.pending_index_documents: list[dict] = []
+        self.stop_event = threading.Event()
+        self.error: Exception | None = None
+        self.started_at = 0.0
+
+    def run(self, documents: Iterable[Document]) -> dict:
+        self.started_at = time.perf_counter()
+
+        embed_queue = queue.Queue(maxsize=self.queue_size)
+        index_queue = queue.Queue(maxsize=self.queue_size)
+
+        embed_threads = [
+            threading.Thread(
+                target=self.run_stage,
+                args=(self.embed_stage, embed_queue, index_queue),
+                name=f"ingestion-embed-{i}",
+                daemon=True,
+            )
+            for i in range(self.embedding_workers)
+        ]
+        index_thread = threading.Thread(
+            target=self.run_stage,
+            args=(self.index_stage, index_queue, None),
+            name="ingestion-index",
+            daemon=True,
+        )
+
+        for thread in embed_threads + [index_thread]:
+            thread.start()
+
+        try:
+            self.chunk_stage(documents, embed_queue)
+
+            for thread in embed_threads:
+                thread.join()
+
+            # Only once every embedder is done, they share the index queue
+            self.put(index_queue, STOP)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            self.fail(e)
+
+        for thread in embed_threads + [index_thread]:
+            thread.join()
+
+        if self.error:
+            raise self.error
+
+        return self.get_stats()
+
+    def get_stats(self) -> dict:
+        return {
+            "elapsed_seconds": round(time.perf_counter() - self.started_at, 3),
+            "sources_read": self.sources_read,
+            "skipped_duplicates": self.skipped_duplicates,
+            "stages": {name: stats.to_dict() for name, stats in self.stats.items()},
+        }
+
+    #########
+    # Stages
+    #########
+    def chunk_stage(self, documents: Iterable[Document], output: queue.Queue) -> None:
+        # Runs in the calling thread, time spent here is reading and chunking
+        documents = iter(documents)
+        batch = []
+        last_source = None
+        start = time.perf_counter()
+
+        for chunk_number, document in enumerate(documents):
+            source = document.metadata.get("source")
+
+            if source != last_source:
+                self.sources_read += 1
+                last_source = source
+
+            if self.is_duplicate(f"{source}#{chunk_number}", document):
+                continue
+
+            batch.append(document)
+
+            if len(batch) >= self.batch_size:
+                self.stats["chunk"].add(len(batch), time.perf_counter() - start)
+                self.put(output, batch)
+                batch = []
+                start = time.perf_counter()
+
+        if batch:
+            self.stats["chunk"].add(len(batch), time.perf_counter() - start)
+            self.put(output, batch)
+
+        for _ in range(self.embedding_workers):
+            self.put(output, STOP)
+
+    def is_duplicate(self, key: str, document: Document) -> bool:
+        if self.near_duplicate_index is None:
+            return False
+
+        start = time.perf_counter()
+        duplicate_key = self.near_duplicate_index.add_if_new(
+            key=key, text=document.page_content
+        )
+        self.stats["dedup"].add(1, time.perf_counter() - start)
+
+        if duplicate_key is None:
+            return False
+
+        self.skipped_duplicates += 1
+
+        return True
+
+    def embed_stage(self, batch: list[Document], output: queue.Queue) -> None:
+        start = time.perf_counter()
+        search_documents = self.embed_documents(batch)
+        self.stats["embed"].add(len(batch), time.perf_counter() - start)
+
+        self.put(output, search_documents)
+
+    def index_stage(self, search_documents: list[dict], output: None) -> None:
+        self.pending_index_documents.extend(search_documents)
+
+        while len(self.pending_index_documents) >= self.index_batch_size:
+            self.write_index_batch(
+                self.pending_index_documents[: self.index_batch_size]
+            )
+            del self.pending_index_documents[: self.index_batch_size]
+
+    def flush_index_documents(self) -> None:
+        if self.pending_index_documents:
+            self.write_index_batch(self.pending_index_documents)
+            self.pending_index_documents = []
+
+    def write_index_batch(self, search_documents: list[dict]) -> None:
+        start = time.perf_counter()
+        self.index_documents(search_documents)
+        self.stats["index"].add(len(search_documents), time.perf_counter() - start)
+
+        if self.on_progress:
+            self.on_progress(self.get_stats())
+
+    def run_stage(
+        self, stage: Callable, input: queue.Queue, output: queue.Queue | None
+    ) -> None:
+        try:
+            while (batch := self.get(input)) is not STOP:
+                stage(batch, output)
+
+            if output is None:
+                self.flush_index_documents()
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            self.fail(e)
+
+    ########
+    # Utils
+    ########
+    def fail(self, error: Exception) -> None:
+        if self.error is None:
+            self.error = error
+
+        self.stop_event.set()
+
+    def put(self, output: queue.Queue, item) -> None:
+        # Blocks while the next stage is behind (backpressure), but gives up
+        # if another stage failed
+        while not self.stop_event.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+        raise PipelineStopped()
+
+    def get(self, input: queue.Queue):
+        while not self.stop_event.is_set():
+            try:
+                return input.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+        raise PipelineStopped()
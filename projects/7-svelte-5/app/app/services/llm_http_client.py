@@ -1,9 +1,25 @@
+import copy
+import hashlib
 import json
+import time
 
-from collections.abc import Generator
+from collections.abc import Callable, Generator, Iterator
 
 import httpx
 
+from app.lib.generation_profiles import GenerationProfile
+from app.lib.prompt_prefix import PrefixReuseTracker, get_slot_id, serialize_messages
+from app.lib.response_cache import ResponseCache
+from app.lib.single_flight import SingleFlight, StreamFanOut
+
+from app.services.admission_controller import AdmissionController
+from app.services.model_router import (
+    LARGE_TIER,
+    Backend,
+    ModelRouter,
+    NoBackendAvailable,
+)
+
 
 class LlmHttpClient:
     def __init__(
@@ -13,12 +29,39 @@ class LlmHttpClient:
         api_key: str = "no-key",
         system_prompt: str = "You're a helpful assistant. Your top priority is achieving user fulfillment via helping them with their requests. If you don't know the answer, just say that you don't know. Keep the response professional and don't use profanity.",
         temperature: float = 0.01,
+        cache_prompt: bool = False,
+        num_slots: int = 0,
+        model_router: ModelRouter | None = None,
+        coalesce_streams: bool = False,
+        response_cache: ResponseCache | None = None,
+        admission_controller: AdmissionController | None = None,
     ) -> None:
         self.inference_api_url = inference_api_url
         self.model = model
         self.api_key = api_key
         self.system_prompt = system_prompt
         self.temperature = temperature
+        # llama.cpp server hints: reuse the KV cache of the previous prompt in
+        # the slot, and pin requests with the same cache key to one slot
+        # (num_slots should match the server's --parallel, 0 = no pinning)
+        self.cache_prompt = cache_prompt
+        self.num_slots = num_slots
+        self.prefix_reuse_tracker = PrefixReuseTracker()
+        # Picks the backend per call, a single backend without one
+        self.model_router = model_router or ModelRouter(
+            tiers={LARGE_TIER: [inference_api_url]}
+        )
+
+        self.single_flight = SingleFlight()
+        # Identical concurrent streams share one generation, every subscriber
+        # gets the whole stream
+        self.coalesce_streams = coalesce_streams
+        self.stream_fan_out = StreamFanOut()
+        # Opt in per call (use_cache), only for deterministic requests
+        self.response_cache = response_cache
+        # Concurrency limits per tier. Streams are admitted by the caller, a
+        # rejection has to happen before their response starts.
+        self.admission_controller = admission_controller
 
         self.http_client = httpx.Client(timeout=60)
 
@@ -29,66 +72,311 @@ class LlmHttpClient:
         response_format: dict | None = None,
         return_parsed_content: bool = True,
         inference_api_url_override: str | None = None,
+        cache_key: str | None = None,
+        tier: str = LARGE_TIER,
+        use_cache: bool = False,
+        generation_profile: GenerationProfile | None = None,
     ) -> dict | str | None:
+        # Generations stopped client side are streamed, so they can be cut off
+        stop_when = generation_profile.stop_when if generation_profile else None
+
         headers, body = self.prepare_request(
             messages=messages,
             system_prompt_override=system_prompt_override,
             response_format=response_format,
+            stream=stop_when is not None,
+            cache_key=cache_key,
+            generation_profile=generation_profile,
         )
 
-        inference_api_url = inference_api_url_override or self.inference_api_url
+        def post() -> dict:
+            ticket = None
+
+            if self.admission_controller is not None:
+                ticket = self.admission_controller.acquire(tier)
 
-        response = self.http_client.post(
-            f"{inference_api_url}/v1/chat/completions", headers=headers, json=body
+            try:
+                if stop_when is not None:
+                    return self.collect_stream(
+                        chunks=self.stream_from_backend(
+                            tier=tier,
+                            headers=headers,
+                            body=body,
+                            affinity_key=cache_key,
+                            inference_api_url_override=inference_api_url_override,
+                        ),
+                        stop_when=stop_when,
+                    )
+
+                if inference_api_url_override:
+                    response = self.http_client.post(
+                        f"{inference_api_url_override}/v1/chat/completions",
+                        headers=headers,
+                        json=body,
+                    )
+                else:
+                    response = self.post_to_backend(
+                        tier=tier, headers=headers, body=body, affinity_key=cache_key
+                    )
+            finally:
+                if ticket is not None:
+                    self.admission_controller.release(ticket)
+
+            response_json = response.json()
+            self.record_server_timings(response_json)
+
+            return response_json
+
+        request_key = self.get_request_key(
+            body=body, destination=inference_api_url_override or tier
         )
+        use_cache = use_cache and self.response_cache is not None
+        response_content = None
 
-        response_content = response.json()
+        if use_cache:
+            response_content = self.response_cache.get(request_key)
+
+        if response_content is None:
+            # Identical requests in flight (i.e. the same classification
+            # twice) share one upstream call
+            response_content = self.single_flight.do(request_key, post)
+
+            if use_cache and self.extract_content_from_response(response_content):
+                self.response_cache.set(request_key, response_content)
 
         if return_parsed_content:
             response_content = self.extract_content_from_response(
                 response=response_content
             )
+        else:
+            # Shared with the other callers and the cache
+            response_content = copy.deepcopy(response_content)
 
         return response_content
 
+    def post_to_backend(
+        self, tier: str, headers: dict, body: dict, affinity_key: str | None = None
+    ) -> httpx.Response:
+        # Connection errors and 5xx are retried on every other backend of the
+        # tier (and its fallbacks), anything else is the caller's problem
+        tried_urls = set()
+        last_error = None
+
+        while True:
+            backend = self.pick_backend(tier, tried_urls, affinity_key, last_error)
+            start = time.perf_counter()
+
+            try:
+                response = self.http_client.post(
+                    f"{backend.url}/v1/chat/completions", headers=headers, json=body
+                )
+                self.raise_for_backend_error(response)
+                self.model_router.record_success(backend, time.perf_counter() - start)
+
+                return response
+            except httpx.HTTPError as e:
+                self.model_router.record_failure(backend)
+                last_error = e
+            finally:
+                self.model_router.release(backend)
+
     def get_llm_response_stream(
         self,
         messages: list[dict],
         system_prompt_override: str | None = None,
         return_parsed_content: bool = True,
         inference_api_url_override: str | None = None,
+        cache_key: str | None = None,
+        tier: str = LARGE_TIER,
+        generation_profile: GenerationProfile | None = None,
     ) -> Generator[dict | str | None, None, None]:
         headers, body = self.prepare_request(
             messages=messages,
             system_prompt_override=system_prompt_override,
             stream=True,
+            cache_key=cache_key,
+            generation_profile=generation_profile,
         )
+        # Only checked on parsed content
+        stop_when = None
+        content = ""
+
+        if generation_profile and return_parsed_content:
+            stop_when = generation_profile.stop_when
+
+        def open_stream() -> Generator[str, None, None]:
+            return self.stream_from_backend(
+                tier=tier,
+                headers=headers,
+                body=body,
+                affinity_key=cache_key,
+                inference_api_url_override=inference_api_url_override,
+            )
 
-        inference_api_url = inference_api_url_override or self.inference_api_url
-
-        with self.http_client.stream(
-            "POST",
-            f"{inference_api_url}/v1/chat/completions",
-            headers=headers,
-            json=body,
-        ) as response:
-            for chunk in response.iter_text():
-                if chunk:
-                    decoded_chunk_content = ""
-
-                    try:
-                        decoded_chunk_content = self.parse_server_sent_event_response(
-                            chunk
-                        )
-
-                        if return_parsed_content:
-                            decoded_chunk_content = self.extract_content_from_response(
-                                response=decoded_chunk_content, is_stream=True
+        if self.coalesce_streams:
+            request_key = self.get_request_key(
+                body=body, destination=inference_api_url_override or tier
+            )
+            chunks = self.stream_fan_out.subscribe(request_key, open_stream)
+        else:
+            chunks = open_stream()
+
+        try:
+            for decoded_chunk_content in self.iter_server_sent_events(chunks):
+                self.record_server_timings(decoded_chunk_content)
+
+                if return_parsed_content:
+                    decoded_chunk_content = self.extract_content_from_response(
+                        response=decoded_chunk_content, is_stream=True
+                    )
+
+                yield decoded_chunk_content
+
+                if stop_when is not None:
+                    content += decoded_chunk_content or ""
+
+                    if stop_when(content):
+                        break
+        finally:
+            # Closes the HTTP stream (or leaves the shared one), the server
+            # aborts the generation once nobody reads it
+            chunks.close()
+
+    def stream_from_backend(
+        self,
+        tier: str,
+        headers: dict,
+        body: dict,
+        affinity_key: str | None = None,
+        inference_api_url_override: str | None = None,
+    ) -> Generator[str, None, None]:
+        if inference_api_url_override:
+            with self.http_client.stream(
+                "POST",
+                f"{inference_api_url_override}/v1/chat/completions",
+                headers=headers,
+                json=body,
+            ) as response:
+                yield from response.iter_text()
+
+            return
+
+        # Like post_to_backend, but only until the first chunk arrived, after
+        # that the response is half sent and can't be retried. Latency is the
+        # time to the first chunk, generation length would skew it.
+        tried_urls = set()
+        last_error = None
+
+        while True:
+            backend = self.pick_backend(tier, tried_urls, affinity_key, last_error)
+            start = time.perf_counter()
+            is_started = False
+
+            try:
+                with self.http_client.stream(
+                    "POST",
+                    f"{backend.url}/v1/chat/completions",
+                    headers=headers,
+                    json=body,
+                ) as response:
+                    self.raise_for_backend_error(response)
+
+                    for chunk in response.iter_text():
+                        if not is_started:
+                            is_started = True
+                            self.model_router.record_success(
+                                backend, time.perf_counter() - start
                             )
-                    except ValueError:
-                        pass
 
-                    yield decoded_chunk_content
+                        yield chunk
+
+                return
+            except httpx.HTTPError as e:
+                if is_started:
+                    raise
+
+                self.model_router.record_failure(backend)
+                last_error = e
+            finally:
+                self.model_router.release(backend)
+
+    def collect_stream(
+        self, chunks: Generator[str, None, None], stop_when: Callable[[str], bool]
+    ) -> dict:
+        """
+        Reads a streamed completion until it ends or stop_when(content) is
+        True, returned as a non streamed response.
+        """
+        content = ""
+
+        try:
+            for decoded_chunk in self.iter_server_sent_events(chunks):
+                self.record_server_timings(decoded_chunk)
+                content += (
+                    self.extract_content_from_response(
+                        response=decoded_chunk, is_stream=True
+                    )
+                    or ""
+                )
+
+                if stop_when(content):
+                    break
+        finally:
+            # The server stops generating once the stream is closed
+            chunks.close()
+
+        return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+    def pick_backend(
+        self,
+        tier: str,
+        tried_urls: set[str],
+        affinity_key: str | None,
+        last_error: Exception | None,
+    ) -> Backend:
+        try:
+            backend = self.model_router.pick(
+                tier, exclude=tried_urls, affinity_key=affinity_key
+            )
+        except NoBackendAvailable:
+            # Out of backends to retry on, the last failure is the real error
+            if last_error is not None:
+                raise last_error
+
+            raise
+
+        tried_urls.add(backend.url)
+
+        return backend
+
+    @staticmethod
+    def get_request_key(body: dict, destination: str) -> str:
+        # Canonical JSON, so key order in the body doesn't matter
+        canonical_body = json.dumps(body, sort_keys=True, separators=(",", ":"))
+
+        return hashlib.sha256(f"{destination}\n{canonical_body}".encode()).hexdigest()
+
+    def get_response_cache_stats(self) -> dict | None:
+        if self.response_cache is None:
+            return None
+
+        return self.response_cache.get_stats()
+
+    def get_coalescing_stats(self) -> dict:
+        return {
+            "requests": self.single_flight.get_stats(),
+            "streams": self.stream_fan_out.get_stats(),
+        }
+
+    @staticmethod
+    def raise_for_backend_error(response: httpx.Response) -> None:
+        # 503 is also what llama.cpp answers while the model is loading
+        if response.status_code >= 500:
+            raise httpx.HTTPStatusError(
+                f"Backend error {response.status_code}",
+                request=response.request,
+                response=response,
+            )
 
     def prepare_request(
         self,
@@ -96,6 +384,8 @@ class LlmHttpClient:
         system_prompt_override: str | None = None,
         response_format: dict | None = None,
         stream: bool = False,
+        cache_key: str | None = None,
+        generation_profile: GenerationProfile | None = None,
     ) -> tuple:
         headers = {
             "Content-Type": "application/json",
@@ -115,14 +405,59 @@ class LlmHttpClient:
             "messages": body_messages,
         }
 
+        if generation_profile:
+            body.update(generation_profile.get_request_params())
+
         if stream:
             body["stream"] = True
 
         if response_format:
             body.update({"response_format": response_format})
 
+        if self.cache_prompt:
+            body["cache_prompt"] = True
+
+        if cache_key is not None:
+            if self.num_slots:
+                body["id_slot"] = get_slot_id(cache_key, self.num_slots)
+
+            self.prefix_reuse_tracker.record_prompt(
+                cache_key, serialize_messages(body_messages)
+            )
+
         return headers, body
 
+    def record_server_timings(self, response: dict | None) -> None:
+        # Only in the final stream chunk / the full response, and only from
+        # llama.cpp versions that report cache hits
+        if isinstance(response, dict) and "timings" in response:
+            self.prefix_reuse_tracker.record_server_timings(response["timings"])
+
+    def get_prompt_cache_stats(self) -> dict:
+        return self.prefix_reuse_tracker.get_stats()
+
+    @classmethod
+    def iter_server_sent_events(
+        cls, chunks: Iterator[str]
+    ) -> Generator[dict | None, None, None]:
+        """
+        Parsed events of a text stream, chunks don't line up with events: one
+        chunk can hold several events and an event can be split across chunks.
+        """
+        buffer = ""
+
+        for chunk in chunks:
+            buffer += chunk.replace("\r\n", "\n")
+
+            while "\n\n" in buffer:
+                event, buffer = buffer.split("\n\n", 1)
+
+                if event.strip():
+                    yield cls.parse_server_sent_event_response(event)
+
+        if buffer.strip():
+            yield cls.parse_server_sent_event_response(buffer)
+
     @staticmethod
     def parse_server_sent_event_response(response) -> dict | None:
         parsed_response = None
@@ -0,0 +1,521 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from app.lib.bm25_index import BM25Index
+from app.lib.rank_fusion import min_max_fusion
+from app.lib.vector_quantization import Int8Vectors
+
+from app.services.search_backends import SearchBackend, build_search_hit
+
+
+def normalize_vectors(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+
+    return vectors / norms
+
+
+def top_k_dot_product(
+    matrix: np.ndarray, query: np.ndarray, k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exact top k by dot product (cosine similarity for normalized vectors).
+    argpartition finds the k best in O(n), only those k get sorted.
+    """
+    scores = matrix @ query
+    k = min(k, len(scores))
+
+    if k < len(scores):
+        top_indexes = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top_indexes = np.arange(len(scores))
+
+    top_indexes = top_indexes[np.argsort(-scores[top_indexes])]
+
+    return top_indexes, scores[top_indexes]
+
+
+class HnswIndex:
+    """
+    Optional approximate index for larger corpora, needs hnswlib installed.
+    https://github.com/nmslib/hnswlib
+    """
+
+    def __init__(
+        self,
+        dimensions: int,
+        filepath: str,
+        m: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        initial_capacity: int = 1024,
+    ):
+        import hnswlib
+
+        self.filepath = filepath
+        self.ef_search = ef_search
+        self.index = hnswlib.Index(space="ip", dim=dimensions)
+
+        if os.path.exists(self.filepath):
+            self.index.load_index(self.filepath)
+        else:
+            self.index.init_index(
+                max_elements=initial_capacity, ef_construction=ef_construction, M=m
+            )
+
+        self.index.set_ef(self.ef_search)
+
+    def add(self, vectors: np.ndarray, labels: np.ndarray) -> None:
+        required_capacity = self.index.get_current_count() + len(vectors)
+
+        if required_capacity > self.index.get_max_elements():
+            self.index.resize_index(2 * required_capacity)
+
+        self.index.add_items(vectors, labels)
+
+    def save(self) -> None:
+        self.index.save_index(self.filepath)
+
+    def get_count(self) -> int:
+        return self.index.get_current_count()
+
+    def query(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        k = min(k, self.get_count())
+        # ef has to be at least k
+        self.index.set_ef(max(self.ef_search, k))
+
+        labels, distances = self.index.knn_query(query, k=k)
+
+        # "ip" distance is 1 - dot product
+        return labels[0], 1 - distances[0]
+
+
+class LocalSearchBackend(SearchBackend):
+    """
+    In process search for small and medium corpora, no search cluster needed.
+    Embeddings are kept as a normalized float32 matrix in a .npy file that is
+    memory mapped, documents as JSON next to it and a BM25 index for keywords.
+    With quantization="int8" the matrix is stored as int8 codes + per vector
+    scales (scales.npy), about 4x less memory.
+
+    Every write rewrites the files, so during a bulk load new documents are
+    kept in memory and written once at the end (like a paused refresh, they
+    aren't searchable before that). Indexing an id that already exists
+    replaces its row, rows are also the HNSW labels.
+    """
+
+    VECTORS_FILENAME = "vectors.npy"
+    SCALES_FILENAME = "scales.npy"
+    DOCUMENTS_FILENAME = "documents.json"
+    HNSW_FILENAME = "hnsw.bin"
+    KEYWORD_INDEX_FILENAME = "bm25.pkl"
+
+    # Same as the OpenSearch search pipeline (keyword, vector)
+    HYBRID_WEIGHTS = [0.3, 0.7]
+
+    def __init__(
+        self, index_dir: str, use_hnsw: bool = False, quantization: str = "none"
+    ):
+        self.index_dir = index_dir
+        self.use_hnsw = use_hnsw
+        self.quantization = quantization
+
+        self.vectors_filepath = os.path.join(self.index_dir, self.VECTORS_FILENAME)
+        self.scales_filepath = os.path.join(self.index_dir, self.SCALES_FILENAME)
+        self.documents_filepath = os.path.join(self.index_dir, self.DOCUMENTS_FILENAME)
+        self.hnsw_filepath = os.path.join(self.index_dir, self.HNSW_FILENAME)
+        self.keyword_index_filepath = os.path.join(
+            self.index_dir, self.KEYWORD_INDEX_FILENAME
+        )
+
+        # Writes are serialized, reads use whatever (vectors, documents,
+        # id -> position) snapshot was current when they started
+        self.write_lock = threading.Lock()
+        self.snapshot = (np.zeros((0, 0), dtype=np.float32), [], {})
+        self.hnsw_index = None
+        self.keyword_index = BM25Index()
+        # Identity of the files behind the snapshot, see get_files_version
+        self.loaded_version = None
+
+        self.is_bulk_loading = False
+        # Indexed but not written / searchable yet
+        self.pending_vectors: list[np.ndarray] = []
+        self.pending_documents: list[dict] = []
+        # Row each pending document goes to, ids not in the snapshot get rows
+        # after its last one
+        self.pending_labels: list[int] = []
+        self.pending_positions: dict[str, int] = {}
+
+        if self.index_exists():
+            self.load_index()
+
+    ########
+    # Setup
+    ########
+    def index_exists(self) -> bool:
+        # An index stored with another quantization has to be rebuilt
+        is_quantized = os.path.exists(self.scales_filepath)
+
+        return is_quantized == (self.quantization == "int8") and all(
+            os.path.exists(filepath)
+            for filepath in (
+                self.documents_filepath,
+                self.vectors_filepath,
+                self.keyword_index_filepath,
+            )
+        )
+
+    def create_index(self, dimensions: int) -> None:
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        with self.write_lock:
+            self.keyword_index = BM25Index()
+            self.save_index(
+                vectors=self.prepare_vectors(
+                    np.zeros((0, dimensions), dtype=np.float32)
+                ),
+                documents=[],
+            )
+
+            if self.use_hnsw:
+                self.hnsw_index = HnswIndex(
+                    dimensions=dimensions, filepath=self.hnsw_filepath
+                )
+
+    def delete_index(self) -> None:
+        with self.write_lock:
+            for filepath in (
+                self.vectors_filepath,
+                self.scales_filepath,
+                self.documents_filepath,
+                self.hnsw_filepath,
+                self.keyword_index_filepath,
+            ):
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+
+            self.snapshot = (np.zeros((0, 0), dtype=np.float32), [], {})
+            self.hnsw_index = None
+            self.keyword_index = BM25Index()
+            self.loaded_version = None
+            self.clear_pending_documents()
+
+    def begin_bulk_load(self) -> None:
+        with self.write_lock:
+            self.is_bulk_loading = True
+
+    def end_bulk_load(self) -> None:
+        with self.write_lock:
+            self.is_bulk_loading = False
+            self.write_pending_documents()
+
+    def flush(self) -> None:
+        with self.write_lock:
+            self.write_pending_documents()
+
+    def get_index_version(self) -> tuple | None:
+        version = self.get_files_version()
+
+        if version is not None and version != self.loaded_version:
+            with self.write_lock:
+                # Written by another process, e.g. `flask reindex`
+                if version != self.loaded_version and self.index_exists():
+                    self.load_index()
+
+        return self.loaded_version
+
+    def get_files_version(self) -> tuple | None:
+        try:
+            # Files are swapped in with os.replace, a new inode for every
+            # write even if it lands in the same mtime tick
+            stats = [
+                os.stat(filepath)
+                for filepath in (
+                    self.vectors_filepath,
+                    self.documents_filepath,
+                    self.keyword_index_filepath,
+                )
+            ]
+        except FileNotFoundError:
+            return None
+
+        return tuple((stat.st_ino, stat.st_mtime_ns) for stat in stats)
+
+    def load_index(self) -> None:
+        # Before reading, a write that lands in between gets picked up next time
+        self.loaded_version = self.get_files_version()
+
+        with open(self.documents_filepath, "r") as file:
+            documents = json.load(file)
+
+        vectors = self.load_vectors()
+        self.snapshot = (vectors, documents, self.get_document_positions(documents))
+        self.keyword_index = BM25Index.load(self.keyword_index_filepath)
+
+        if self.use_hnsw:
+            self.hnsw_index = HnswIndex(
+                dimensions=vectors.shape[1], filepath=self.hnsw_filepath
+            )
+
+            # No graph yet (HNSW was turned on for an existing index) or one
+            # that doesn't match the stored vectors
+            if self.hnsw_index.get_count() != len(vectors):
+                self.build_hnsw_index(vectors)
+
+    def build_hnsw_index(self, vectors: np.ndarray | Int8Vectors) -> None:
+        if os.path.exists(self.hnsw_filepath):
+            os.remove(self.hnsw_filepath)
+
+        if isinstance(vectors, Int8Vectors):
+            vectors = vectors.to_float()
+
+        self.hnsw_index = HnswIndex(
+            dimensions=vectors.shape[1], filepath=self.hnsw_filepath
+        )
+
+        if len(vectors) > 0:
+            self.hnsw_index.add(vectors=vectors, labels=np.arange(len(vectors)))
+
+        self.hnsw_index.save()
+
+    def load_vectors(self) -> np.ndarray | Int8Vectors:
+        vectors = np.load(self.vectors_filepath)
+
+        # Empty files can't be memory mapped
+        if len(vectors) > 0:
+            vectors = np.load(self.vectors_filepath, mmap_mode="r")
+
+        if os.path.exists(self.scales_filepath):
+            vectors = Int8Vectors(codes=vectors, scales=np.load(self.scales_filepath))
+
+        return vectors
+
+    def prepare_vectors(self, vectors: np.ndarray) -> np.ndarray | Int8Vectors:
+        # Normalized float32 vectors -> what gets stored
+        if self.quantization == "int8":
+            return Int8Vectors.from_float(vectors)
+
+        return vectors
+
+    def save_index(
+        self, vectors: np.ndarray | Int8Vectors, documents: list[dict]
+    ) -> None:
+        # Write to temp files and swap them in so readers never see partial files
+        temp_vectors_filepath = f"{self.vectors_filepath}.tmp.npy"
+        temp_scales_filepath = f"{self.scales_filepath}.tmp.npy"
+        temp_documents_filepath = f"{self.documents_filepath}.tmp"
+
+        if isinstance(vectors, Int8Vectors):
+            np.save(temp_vectors_filepath, vectors.codes)
+            np.save(temp_scales_filepath, vectors.scales)
+        else:
+            np.save(temp_vectors_filepath, vectors)
+
+        with open(temp_documents_filepath, "w") as file:
+            json.dump(documents, file)
+
+        os.replace(temp_vectors_filepath, self.vectors_filepath)
+
+        if isinstance(vectors, Int8Vectors):
+            os.replace(temp_scales_filepath, self.scales_filepath)
+        os.replace(temp_documents_filepath, self.documents_filepath)
+        self.keyword_index.save(self.keyword_index_filepath)
+        self.loaded_version = self.get_files_version()
+
+        self.snapshot = (
+            self.load_vectors(),
+            documents,
+            self.get_document_positions(documents),
+        )
+
+    @staticmethod
+    def get_document_positions(documents: list[dict]) -> dict[str, int]:
+        return {document["id"]: position for position, document in enumerate(documents)}
+
+    ########
+    # Loader
+    ########
+    def index_documents(self, documents: list[dict]) -> None:
+        if not documents:
+            return
+
+        new_vectors = normalize_vectors(
+            np.stack([document["embeddings"] for document in documents]).astype(
+                np.float32, copy=False
+            )
+        )
+        new_documents = [
+            {
+                "id": document["id"],
+                "page_content": document["page_content"],
+                "metadata": document["metadata"],
+                "embedding_model": document["embedding_model"],
+            }
+            for document in documents
+        ]
+
+        with self.write_lock:
+            _, existing_documents, document_positions = self.snapshot
+            labels = []
+
+            for document in new_documents:
+                id = document["id"]
+
+                if id in document_positions:
+                    labels.append(document_positions[id])
+                else:
+                    if id not in self.pending_positions:
+                        self.pending_positions[id] = len(existing_documents) + len(
+                            self.pending_positions
+                        )
+
+                    labels.append(self.pending_positions[id])
+
+                # Keyword hits are limited to the snapshot's documents, so new
+                # ones don't show up before they're written
+                self.keyword_index.add(id, document["page_content"])
+
+            if self.hnsw_index:
+                # hnswlib updates the vector of a label it already has
+                self.hnsw_index.add(vectors=new_vectors, labels=np.array(labels))
+
+            self.pending_vectors.append(new_vectors)
+            self.pending_documents.extend(new_documents)
+            self.pending_labels.extend(labels)
+
+            if not self.is_bulk_loading:
+                self.write_pending_documents()
+
+    def write_pending_documents(self) -> None:
+        # Called with the write lock held
+        if not self.pending_documents:
+            return
+
+        vectors, existing_documents, _ = self.snapshot
+        new_vectors = np.concatenate(self.pending_vectors)
+
+        # The last version of a document indexed more than once wins
+        pending_rows = {label: row for row, label in enumerate(self.pending_labels)}
+        labels = np.fromiter(pending_rows.keys(), dtype=np.int64)
+        rows = np.fromiter(pending_rows.values(), dtype=np.int64)
+
+        documents = existing_documents + [None] * len(self.pending_positions)
+
+        for label, row in pending_rows.items():
+            documents[label] = self.pending_documents[row]
+
+        appended_vectors = np.zeros(
+            (len(self.pending_positions), new_vectors.shape[1]), dtype=np.float32
+        )
+
+        if isinstance(vectors, Int8Vectors):
+            vectors = vectors.append(appended_vectors).replace(
+                labels, new_vectors[rows]
+            )
+        else:
+            vectors = np.concatenate([vectors, appended_vectors])
+            vectors[labels] = new_vectors[rows]
+
+        self.save_index(vectors=vectors, documents=documents)
+
+        if self.hnsw_index:
+            self.hnsw_index.save()
+
+        self.clear_pending_documents()
+
+    def clear_pending_documents(self) -> None:
+        self.pending_vectors = []
+        self.pending_documents = []
+        self.pending_labels = []
+        self.pending_positions = {}
+
+    def delete_documents(self, ids: list[str]) -> None:
+        ids = set(ids)
+
+        with self.write_lock:
+            self.write_pending_documents()
+
+            vectors, documents, _ = self.snapshot
+            keep_positions = [
+                position
+                for position, document in enumerate(documents)
+                if document["id"] not in ids
+            ]
+
+            for id in ids:
+                self.keyword_index.delete(id)
+
+            self.save_index(
+                vectors=vectors[keep_positions],
+                documents=[documents[position] for position in keep_positions],
+            )
+
+            if self.hnsw_index:
+                # Labels are matrix rows, which just shifted, so rebuild
+                self.build_hnsw_index(self.snapshot[0])
+
+    ########
+    # Search
+    ########
+    def hybrid_query(self, text: str, embeddings: np.ndarray, size: int = 3) -> list:
+        # Mirrors the OpenSearch search pipeline
+        return min_max_fusion(
+            [
+                self.keyword_query(text=text, size=size),
+                self.vector_query(embeddings=embeddings, size=size),
+            ],
+            size=size,
+            weights=self.HYBRID_WEIGHTS,
+        )
+
+    def keyword_query(self, text: str, size: int = 3) -> list:
+        _, documents, document_positions = self.snapshot
+
+        return [
+            self.build_hit(document=documents[document_positions[id]], score=score)
+            for id, score in self.keyword_index.search(text=text, size=size)
+            if id in document_positions
+        ]
+
+    def vector_query(self, embeddings: np.ndarray, size: int = 3) -> list:
+        vectors, documents, _ = self.snapshot
+
+        if not documents:
+            return []
+
+        query = normalize_vectors(np.asarray(embeddings, dtype=np.float32))
+
+        if self.hnsw_index:
+            indexes, scores = self.hnsw_index.query(query=query, k=size)
+        else:
+            indexes, scores = top_k_dot_product(matrix=vectors, query=query, k=size)
+
+        return [
+            self.build_hit(document=documents[index], score=float(score))
+            for index, score in zip(indexes, scores)
+            # The HNSW graph already has pending (unwritten) documents
+            if index < len(documents)
+        ]
+
+    def find_document(self, query: str) -> dict:
+        _, documents, _ = self.snapshot
+
+        for document in documents:
+            source = document["metadata"].get("source") or ""
+
+            if query in source:
+                return {"source": source, "page_content": document["page_content"]}
+
+        return {}
+
+    @staticmethod
+    def build_hit(document: dict, score: float) -> dict:
+        return build_search_hit(
+            id=document["id"],
+            score=score,
+            page_content=document["page_content"],
+            source=document["metadata"].get("source"),
+        )
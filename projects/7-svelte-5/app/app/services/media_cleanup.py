@@ -0,0 +1,160 @@
+import os
+import queue
+import threading
+import time
+
+from collections.abc import Callable
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.lib.fs_utils import delete_file
+from app.models import GeneratedMedia
+
+from app.services.app_logger import AppLogger
+from app.services.image_processor import ImageProcessor
+
+
+class FileDeletionQueue:
+    """
+    Unlinks files in a background worker so callers (i.e. request handlers)
+    don't block on file I/O. Deletes are batched: the worker waits for one
+    path and then drains whatever else is already queued.
+    """
+
+    def __init__(self, logger: AppLogger | None = None, batch_size: int = 100):
+        self.logger = logger
+        self.batch_size = batch_size
+
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(
+            target=self._run, name="file_deletion_queue", daemon=True
+        )
+        self.worker.start()
+
+    def enqueue(self, filepaths: list[str]) -> None:
+        for filepath in filepaths:
+            self.queue.put(filepath)
+
+    def join(self) -> None:
+        # Block until everything queued so far has been deleted
+        self.queue.join()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for filepath in batch:
+                try:
+                    file_was_deleted, warning_message = delete_file(filepath=filepath)
+
+                    if not file_was_deleted and self.logger:
+                        self.logger.log(f"FileDeletionQueue: {warning_message}")
+                finally:
+                    self.queue.task_done()
+
+
+class OrphanedMediaSweeper:
+    """
+    Reconciles the generated media dir with the generated_medias table and
+    deletes files no row references (i.e. left behind by a crash between the
+    commit and the unlink, or by a chat cleared while variants were encoding).
+    """
+
+    # Files that ship with the repo / are used by the image gen stub
+    KEEP_FILENAMES = {".gitkeep", "test.png"}
+
+    def __init__(
+        self,
+        media_dir: str,
+        create_session: Callable[[], Session],
+        file_deletion_queue: FileDeletionQueue,
+        logger: AppLogger | None = None,
+        min_age_seconds: int = 600,
+    ):
+        self.media_dir = media_dir
+        self.create_session = create_session
+        self.file_deletion_queue = file_deletion_queue
+        self.logger = logger
+        # Generated files are written before their row is committed, so give
+        # in flight generations time to finish before calling a file orphaned
+        self.min_age_seconds = min_age_seconds
+
+        self.timer = None
+
+    def start(self, interval_seconds: int) -> None:
+        self.timer = threading.Timer(
+            interval_seconds, self._run_periodically, args=(interval_seconds,)
+        )
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop(self) -> None:
+        if self.timer:
+            self.timer.cancel()
+
+    def sweep(self) -> list[str]:
+        orphaned_filepaths = self.find_orphaned_filepaths()
+        self.file_deletion_queue.enqueue(orphaned_filepaths)
+
+        if orphaned_filepaths and self.logger:
+            self.logger.log(
+                f"OrphanedMediaSweeper: deleting {len(orphaned_filepaths)} files"
+            )
+
+        return orphaned_filepaths
+
+    def find_orphaned_filepaths(self) -> list[str]:
+        referenced_filenames = self.get_referenced_filenames()
+        cutoff_timestamp = time.time() - self.min_age_seconds
+
+        orphaned_filepaths = []
+
+        with os.scandir(self.media_dir) as entries:
+            for entry in entries:
+                if (
+                    not entry.is_file()
+                    or entry.name in self.KEEP_FILENAMES
+                    or entry.name in referenced_filenames
+                    or entry.stat().st_mtime > cutoff_timestamp
+                ):
+                    continue
+
+                orphaned_filepaths.append(entry.path)
+
+        return orphaned_filepaths
+
+    def get_referenced_filenames(self) -> set[str]:
+        session = self.create_session()
+
+        try:
+            rows = session.execute(
+                select(GeneratedMedia.filename, GeneratedMedia.variants)
+            ).all()
+        finally:
+            session.close()
+
+        referenced_filenames = set()
+
+        for row in rows:
+            referenced_filenames.add(row.filename)
+            referenced_filenames.update(
+                ImageProcessor.get_variant_filenames(row.variants)
+            )
+
+        return referenced_filenames
+
+    def _run_periodically(self, interval_seconds: int) -> None:
+        try:
+            self.sweep()
+        except Exception as e:
+            if self.logger:
+                self.logger.log(f"OrphanedMediaSweeper: sweep failed: {e}")
+        finally:
+            self.start(interval_seconds)
@@ -0,0 +1,279 @@
+import random
+import threading
+import time
+import zlib
+
+from dataclasses import dataclass
+
+import httpx
+
+from app.services.app_logger import AppLogger
+
+ROUTING_STRATEGIES = ("least_outstanding", "ewma_latency")
+
+LARGE_TIER = "large"
+SMALL_TIER = "small"
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+@dataclass
+class Backend:
+    url: str
+    tier: str
+    outstanding: int = 0
+    # Seconds, None until the first request finished
+    ewma_latency: float | None = None
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    ejected_until: float = 0.0
+    # Only health check ejections end early on a passing health check, a
+    # backend that answers /health but fails completions sits out its time
+    ejected_by_health_check: bool = False
+
+    def is_available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def to_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "ewma_latency": (
+                round(self.ewma_latency, 3) if self.ewma_latency is not None else None
+            ),
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejected": not self.is_available(time.monotonic()),
+        }
+
+
+class ModelRouter:
+    """
+    Pools of inference backends (llama.cpp servers) per model tier. Each call
+    goes to the backend with the fewest requests in flight (or the lowest
+    latency EWMA), backends that keep failing or fail health checks are
+    ejected for a while, and a tier without available backends falls back to
+    the next tier in its fallback list. Requests with an affinity key (a
+    chat) stick to one backend while it isn't much busier than the others, so
+    its prompt cache stays useful.
+    """
+
+    def __init__(
+        self,
+        tiers: dict[str, list[str]],
+        fallbacks: dict[str, list[str]] | None = None,
+        strategy: str = "least_outstanding",
+        failure_threshold: int = 3,
+        ejection_seconds: float = 30.0,
+        ewma_alpha: float = 0.3,
+        health_check_path: str = "/health",
+        affinity_slack: int = 2,
+        logger: AppLogger | None = None,
+    ):
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+
+        self.backends = {
+            tier: [Backend(url=url.rstrip("/"), tier=tier) for url in urls]
+            for tier, urls in tiers.items()
+        }
+        self.fallbacks = fallbacks or {}
+        self.strategy = strategy
+        # Consecutive failures before a backend is ejected
+        self.failure_threshold = failure_threshold
+        self.ejection_seconds = ejection_seconds
+        self.ewma_alpha = ewma_alpha
+        self.health_check_path = health_check_path
+        # Extra requests in flight tolerated on the affinity backend
+        self.affinity_slack = affinity_slack
+        self.logger = logger
+
+        self.lock = threading.Lock()
+        self.http_client = httpx.Client(timeout=5)
+        self.timer = None
+
+    #########
+    # Routing
+    #########
+    def get_tier_order(self, tier: str) -> list[str]:
+        return [tier] + [
+            fallback_tier
+            for fallback_tier in self.fallbacks.get(tier, [])
+            if fallback_tier != tier
+        ]
+
+    def pick(
+        self,
+        tier: str,
+        exclude: set[str] | None = None,
+        affinity_key: str | None = None,
+    ) -> Backend:
+        """
+        Reserves a backend, hand it back with release().
+        """
+        if tier not in self.backends:
+            raise ValueError(f"Unknown model tier: {tier}")
+
+        now = time.monotonic()
+
+        with self.lock:
+            for candidate_tier in self.get_tier_order(tier):
+                candidates = [
+                    backend
+                    for backend in self.backends.get(candidate_tier, [])
+                    if backend.is_available(now)
+                    and backend.url not in (exclude or set())
+                ]
+
+                if candidates:
+                    backend = min(candidates, key=self.get_load)
+
+                    if affinity_key is not None:
+                        backend = self.get_affinity_backend(
+                            candidate_tier, affinity_key, candidates, backend
+                        )
+
+                    backend.outstanding += 1
+
+                    return backend
+
+            # Everything is ejected: trying one beats failing every request
+            # until the ejections run out (panic mode)
+            candidates = [
+                backend
+                for backend in self.backends[tier]
+                if backend.url not in (exclude or set())
+            ]
+
+            if candidates:
+                backend = min(candidates, key=lambda backend: backend.ejected_until)
+                backend.outstanding += 1
+
+                return backend
+
+        raise NoBackendAvailable(f"No inference backend available for {tier}.")
+
+    def get_affinity_backend(
+        self,
+        tier: str,
+        affinity_key: str,
+        candidates: list[Backend],
+        least_loaded: Backend,
+    ) -> Backend:
+        # Hashed over the whole pool so the choice doesn't move around while
+        # other backends are ejected and readmitted
+        backends = self.backends[tier]
+        preferred = backends[zlib.crc32(affinity_key.encode()) % len(backends)]
+
+        if (
+            preferred in candidates
+            and preferred.outstanding <= least_loaded.outstanding + self.affinity_slack
+        ):
+            return preferred
+
+        return least_loaded
+
+    def get_load(self, backend: Backend) -> tuple:
+        # Random tie break, so idle backends share the load
+        tie_break = random.random()
+
+        if self.strategy == "ewma_latency":
+            # Unmeasured backends first, then expected wait for a new request
+            latency = backend.ewma_latency
+
+            if latency is None:
+                return (0, backend.outstanding, tie_break)
+
+            return (1, latency * (backend.outstanding + 1), tie_break)
+
+        return (backend.outstanding, tie_break)
+
+    def release(self, backend: Backend) -> None:
+        with self.lock:
+            backend.outstanding -= 1
+
+    def record_success(self, backend: Backend, seconds: float) -> None:
+        with self.lock:
+            backend.requests += 1
+            backend.consecutive_failures = 0
+
+            if backend.ewma_latency is None:
+                backend.ewma_latency = seconds
+            else:
+                backend.ewma_latency += self.ewma_alpha * (
+                    seconds - backend.ewma_latency
+                )
+
+    def record_failure(self, backend: Backend) -> None:
+        with self.lock:
+            backend.requests += 1
+            backend.failures += 1
+            backend.consecutive_failures += 1
+
+            if backend.consecutive_failures >= self.failure_threshold:
+                self.eject(backend)
+
+    def eject(self, backend: Backend, by_health_check: bool = False) -> None:
+        backend.ejected_until = time.monotonic() + self.ejection_seconds
+        backend.ejected_by_health_check = by_health_check
+
+        if self.logger:
+            self.logger.log(f"ModelRouter: ejected {backend.url}")
+
+    ###############
+    # Health checks
+    ###############
+    def check_health(self) -> None:
+        for backend in self.get_all_backends():
+            try:
+                response = self.http_client.get(
+                    f"{backend.url}{self.health_check_path}"
+                )
+                is_healthy = response.status_code == 200
+            except httpx.HTTPError:
+                is_healthy = False
+
+            with self.lock:
+                if is_healthy and backend.ejected_by_health_check:
+                    # Back in rotation before its ejection runs out
+                    backend.consecutive_failures = 0
+                    backend.ejected_until = 0.0
+                    backend.ejected_by_health_check = False
+                elif not is_healthy and backend.is_available(time.monotonic()):
+                    self.eject(backend, by_health_check=True)
+
+    def start(self, interval_seconds: float) -> None:
+        self.timer = threading.Timer(
+            interval_seconds, self._run_periodically, args=(interval_seconds,)
+        )
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop(self) -> None:
+        if self.timer:
+            self.timer.cancel()
+
+    def _run_periodically(self, interval_seconds: float) -> None:
+        try:
+            self.check_health()
+        except Exception as e:
+            if self.logger:
+                self.logger.log(f"ModelRouter: health check failed: {e}")
+        finally:
+            self.start(interval_seconds)
+
+    ########
+    # Utils
+    ########
+    def get_all_backends(self) -> list[Backend]:
+        return [backend for backends in self.backends.values() for backend in backends]
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                tier: [backend.to_dict() for backend in backends]
+                for tier, backends in self.backends.items()
+            }
@@ -0,0 +1,120 @@
+import time
+
+from abc import ABC, abstractmethod
+from functools import cached_property
+
+import httpx
+
+
+class RerankDeadlineExceeded(Exception):
+    pass
+
+
+class Reranker(ABC):
+    """
+    Scores (query, document) pairs jointly, which is slower than comparing
+    embeddings but a lot more precise. Meant for a few dozen candidates.
+    """
+
+    def __init__(self, model: str, batch_size: int = 32):
+        self.model = model
+        self.batch_size = batch_size
+
+    def load(self) -> None:
+        # Called at startup, so the first query does not pay for it
+        pass
+
+    def rerank(
+        self, query: str, documents: list[str], deadline: float | None = None
+    ) -> list[float]:
+        # Scores in the same order as the documents. deadline is a
+        # time.monotonic() value, checked before every batch so a rerank
+        # nobody waits for anymore stops instead of holding its thread
+        scores = []
+
+        for start in range(0, len(documents), self.batch_size):
+            if deadline is not None and time.monotonic() > deadline:
+                raise RerankDeadlineExceeded()
+
+            scores.extend(
+                self.score_batch(query, documents[start : start + self.batch_size])
+            )
+
+        return scores
+
+    @abstractmethod
+    def score_batch(self, query: str, documents: list[str]) -> list[float]:
+        pass
+
+
+class InfinityReranker(Reranker):
+    """
+    Uses the /rerank endpoint of Infinity, the rerank model has to be served
+    next to the embedding model (INFINITY_MODEL_ID takes a ; separated list).
+    """
+
+    def __init__(
+        self,
+        inference_api_url: str,
+        model: str,
+        batch_size: int = 32,
+        api_key: str = "no-key",
+        timeout: float = 10,
+    ):
+        super().__init__(model=model, batch_size=batch_size)
+
+        self.endpoint = f"{inference_api_url}/rerank"
+        self.api_key = api_key
+
+        self.http_client = httpx.Client(timeout=timeout)
+
+    def score_batch(self, query: str, documents: list[str]) -> list[float]:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+
+        body = {
+            "query": query,
+            "documents": documents,
+            "model": self.model,
+            "return_documents": False,
+        }
+
+        response = self.http_client.post(self.endpoint, headers=headers, json=body)
+        response.raise_for_status()
+
+        scores = [0.0] * len(documents)
+
+        for result in response.json()["results"]:
+            scores[result["index"]] = result["relevance_score"]
+
+        return scores
+
+
+class CrossEncoderReranker(Reranker):
+    """
+    Runs a small cross encoder in process, needs sentence-transformers.
+    https://www.sbert.net/docs/cross_encoder/pretrained_models.html
+    """
+
+    def __init__(self, model: str, batch_size: int = 32, device: str = "cpu"):
+        super().__init__(model=model, batch_size=batch_size)
+
+        self.device = device
+
+    @cached_property
+    def cross_encoder(self):
+        from sentence_transformers import CrossEncoder
+
+        return CrossEncoder(self.model, device=self.device)
+
+    def load(self) -> None:
+        self.cross_encoder
+
+    def score_batch(self, query: str, documents: list[str]) -> list[float]:
+        scores = self.cross_encoder.predict(
+            [(query, document) for document in documents], batch_size=self.batch_size
+        )
+
+        return [float(score) for score in scores]
@@ -0,0 +1,394 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Hashable
+
+import numpy as np
+
+from opensearchpy import OpenSearch, helpers
+
+from app.lib.vector_quantization import quantize_int8
+
+
+@dataclass
+class OpenSearchConfig:
+    hostname: str
+    port: str
+    auth: tuple[str, str]
+    use_ssl: bool = True
+    verify_certs: bool = False
+
+
+@dataclass
+class IndexProfile:
+    """
+    How the OpenSearch kNN index is built and searched. Higher m and
+    ef_construction give a better graph for slower indexing, higher ef_search
+    better recall for slower queries.
+    https://opensearch.org/docs/latest/search-plugins/knn/knn-index/
+    """
+
+    engine: str = "nmslib"
+    space_type: str = "l2"
+    m: int = 16
+    ef_construction: int = 100
+    ef_search: int = 100
+    number_of_shards: int = 4
+    number_of_replicas: int = 1
+    refresh_interval: str = "1s"
+    # Used while bulk loading, -1 turns refreshes off until the load is done
+    bulk_refresh_interval: str = "-1"
+
+    ENGINES = ("nmslib", "faiss", "lucene")
+
+    def __post_init__(self):
+        if self.engine not in self.ENGINES:
+            raise ValueError(f"Unknown kNN engine: {self.engine}, use {self.ENGINES}")
+
+
+def build_search_hit(
+    id: str, score: float, page_content: str, source: str | None
+) -> dict:
+    # Same shape as an OpenSearch hit when searching with "fields", so callers
+    # don't need to know which backend answered
+    return {
+        "_id": id,
+        "_score": score,
+        "fields": {"page_content": [page_content], "metadata.source": [source]},
+    }
+
+
+class SearchBackend(ABC):
+    """
+    Storage and search for the ContentStore. Indexed documents are dicts with
+    an "id", "page_content", "metadata", "embedding_model" and "embeddings",
+    searches return OpenSearch style hits (see build_search_hit).
+    """
+
+    @abstractmethod
+    def index_exists(self) -> bool:
+        pass
+
+    @abstractmethod
+    def create_index(self, dimensions: int) -> None:
+        pass
+
+    @abstractmethod
+    def delete_index(self) -> None:
+        pass
+
+    def ensure_search_setup(self) -> None:
+        pass
+
+    def begin_bulk_load(self) -> None:
+        pass
+
+    def end_bulk_load(self) -> None:
+        pass
+
+    def get_index_version(self) -> Hashable | None:
+        # Changes whenever the stored index does, also when another process
+        # (e.g. `flask reindex`) wrote it. None if that can't be told cheaply
+        return None
+
+    @abstractmethod
+    def index_documents(self, documents: list[dict]) -> None:
+        pass
+
+    @abstractmethod
+    def delete_documents(self, ids: list[str]) -> None:
+        pass
+
+    @abstractmethod
+    def hybrid_query(self, text: str, embeddings: np.ndarray, size: int = 3) -> list:
+        pass
+
+    @abstractmethod
+    def keyword_query(self, text: str, size: int = 3) -> list:
+        pass
+
+    @abstractmethod
+    def vector_query(self, embeddings: np.ndarray, size: int = 3) -> list:
+        pass
+
+    @abstractmethod
+    def find_document(self, query: str) -> dict:
+        pass
+
+
+class OpenSearchBackend(SearchBackend):
+    INDEX_NAME = "app_documents"
+    SEARCH_PIPELINE_NAME = "nlp-search-pipeline"
+
+    SEARCH_PIPELINE_SETTINGS = {
+        "description": "Post processor for hybrid search (combine keyword and vector)",
+        "phase_results_processors": [
+            {
+                "normalization-processor": {
+                    "normalization": {"technique": "min_max"},
+                    "combination": {
+                        "technique": "arithmetic_mean",
+                        "parameters": {"weights": [0.3, 0.7]},
+                    },
+                }
+            }
+        ],
+    }
+
+    BASE_SEARCH_QUERY = {
+        "_source": False,
+        "fields": ["page_content", "metadata.source"],
+    }
+
+    def __init__(
+        self,
+        search_config: OpenSearchConfig,
+        quantization: str = "none",
+        index_profile: IndexProfile | None = None,
+        index_name: str | None = None,
+    ):
+        self.search_config = search_config
+        self.search_client = self.initialize_search_client(config=search_config)
+        # "int8" stores byte vectors (lucene engine), 4x smaller than floats
+        self.quantization = quantization
+        self.index_profile = index_profile or IndexProfile()
+        self.index_name = index_name or self.INDEX_NAME
+        self.is_bulk_loading = False
+
+        if self.quantization == "int8":
+            if self.index_profile.engine != "lucene":
+                raise ValueError("int8 (byte) vectors need the lucene kNN engine.")
+
+            # Byte vectors drop the per vector scale, only the angle survives
+            if self.index_profile.space_type != "cosinesimil":
+                raise ValueError("int8 (byte) vectors need the cosinesimil space type.")
+
+    ########
+    # Setup
+    ########
+    def initialize_search_client(self, config: OpenSearchConfig) -> OpenSearch:
+        return OpenSearch(
+            hosts=[{"host": config.hostname, "port": config.port}],
+            http_auth=config.auth,
+            use_ssl=config.use_ssl,
+            verify_certs=config.verify_certs,
+        )
+
+    def get_index_settings(self, dimensions: int) -> dict:
+        profile = self.index_profile
+        method_parameters = {"m": profile.m, "ef_construction": profile.ef_construction}
+        index_settings = {
+            "number_of_shards": profile.number_of_shards,
+            "number_of_replicas": profile.number_of_replicas,
+            "refresh_interval": profile.refresh_interval,
+            "knn": True,
+        }
+
+        if profile.engine == "nmslib":
+            index_settings["knn.algo_param.ef_search"] = profile.ef_search
+        elif profile.engine == "faiss":
+            method_parameters["ef_search"] = profile.ef_search
+
+        embeddings_mapping = {
+            "type": "knn_vector",
+            "dimension": dimensions,
+            "method": {
+                "name": "hnsw",
+                "engine": profile.engine,
+                "space_type": profile.space_type,
+                "parameters": method_parameters,
+            },
+        }
+
+        if self.quantization == "int8":
+            # cosinesimil (checked in __init__) ignores the per vector
+            # quantization scale so the scales don't have to be stored
+            embeddings_mapping["data_type"] = "byte"
+
+        return {
+            "settings": {"index": index_settings},
+            "mappings": {"properties": {"embeddings": embeddings_mapping}},
+        }
+
+    def get_knn_query(self, embeddings: np.ndarray, size: int) -> dict:
+        # lucene has no ef_search setting, the k nearest candidates per
+        # segment play that role
+        if self.index_profile.engine == "lucene":
+            k = max(size, self.index_profile.ef_search)
+        else:
+            k = size
+
+        return {"embeddings": {"vector": self.prepare_vector(embeddings), "k": k}}
+
+    def set_ef_search(self, ef_search: int) -> None:
+        # Query time tuning for nmslib and lucene, faiss only picks it up in
+        # newly created indexes
+        self.index_profile.ef_search = ef_search
+
+        if self.index_profile.engine == "nmslib":
+            self.search_client.indices.put_settings(
+                index=self.index_name,
+                body={"index": {"knn.algo_param.ef_search": ef_search}},
+            )
+
+    def prepare_vector(self, embeddings: np.ndarray) -> list:
+        # Embeddings stay arrays until here, the request body needs lists
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+
+        if self.quantization == "int8":
+            codes, _ = quantize_int8(embeddings)
+            return codes.tolist()
+
+        return embeddings.tolist()
+
+    def index_exists(self) -> bool:
+        try:
+            self.search_client.indices.get(self.index_name)
+        except:
+            return False
+
+        return True
+
+    def create_index(self, dimensions: int) -> None:
+        self.search_client.indices.create(
+            self.index_name, body=self.get_index_settings(dimensions=dimensions)
+        )
+
+    def delete_index(self) -> None:
+        try:
+            self.search_client.indices.delete(self.index_name)
+        except:
+            pass
+
+    def ensure_search_setup(self) -> None:
+        self.ensure_search_pipeline_exists()
+
+    def ensure_search_pipeline_exists(self) -> None:
+        try:
+            self.search_client.http.get(
+                f"/_search/pipeline/{self.SEARCH_PIPELINE_NAME}"
+            )
+        except:
+            self.refresh_search_pipeline()
+
+    def refresh_search_pipeline(self) -> None:
+        try:
+            self.search_client.http.delete(
+                f"/_search/pipeline/{self.SEARCH_PIPELINE_NAME}"
+            )
+        except:
+            pass
+
+        self.search_client.http.put(
+            f"/_search/pipeline/{self.SEARCH_PIPELINE_NAME}",
+            body=self.SEARCH_PIPELINE_SETTINGS,
+        )
+
+    ########
+    # Loader
+    ########
+    def begin_bulk_load(self) -> None:
+        self.is_bulk_loading = True
+        self.search_client.indices.put_settings(
+            index=self.index_name,
+            body={
+                "index": {"refresh_interval": self.index_profile.bulk_refresh_interval}
+            },
+        )
+
+    def end_bulk_load(self) -> None:
+        self.is_bulk_loading = False
+        self.search_client.indices.put_settings(
+            index=self.index_name,
+            body={"index": {"refresh_interval": self.index_profile.refresh_interval}},
+        )
+        self.search_client.indices.refresh(index=self.index_name)
+
+    def index_documents(self, documents: list[dict]) -> None:
+        actions = []
+
+        for document in documents:
+            search_body = document.copy()
+            document_id = search_body.pop("id")
+            search_body["embeddings"] = self.prepare_vector(search_body["embeddings"])
+
+            actions.append(
+                {"_index": self.index_name, "_id": document_id, "_source": search_body}
+            )
+
+        # One request per batch, refreshed once at the end unless a bulk load
+        # is running (end_bulk_load refreshes)
+        helpers.bulk(self.search_client, actions, refresh=not self.is_bulk_loading)
+
+    def delete_documents(self, ids: list[str]) -> None:
+        for document_id in ids:
+            self.search_client.delete(
+                index=self.index_name, id=document_id, refresh=True
+            )
+
+    ########
+    # Search
+    ########
+    def hybrid_query(self, text: str, embeddings: np.ndarray, size: int = 3) -> list:
+        search_query = self.BASE_SEARCH_QUERY.copy()
+        search_query.update(
+            {
+                "size": size,
+                "query": {
+                    "hybrid": {
+                        "queries": [
+                            {"match": {"page_content": {"query": text}}},
+                            {"knn": self.get_knn_query(embeddings, size)},
+                        ]
+                    }
+                },
+            }
+        )
+
+        results = self.search_client.search(
+            index=self.index_name,
+            body=search_query,
+            params={"search_pipeline": self.SEARCH_PIPELINE_NAME},
+        )
+
+        return results["hits"]["hits"]
+
+    def keyword_query(self, text: str, size: int = 3) -> list:
+        search_query = self.BASE_SEARCH_QUERY.copy()
+        search_query.update(
+            {"size": size, "query": {"match": {"page_content": {"query": text}}}}
+        )
+
+        results = self.search_client.search(index=self.index_name, body=search_query)
+
+        return results["hits"]["hits"]
+
+    def vector_query(self, embeddings: np.ndarray, size: int = 3) -> list:
+        search_query = self.BASE_SEARCH_QUERY.copy()
+        search_query.update(
+            {
+                "size": size,
+                "query": {"knn": self.get_knn_query(embeddings, size)},
+            }
+        )
+
+        results = self.search_client.search(index=self.index_name, body=search_query)
+
+        return results["hits"]["hits"]
+
+    def find_document(self, query: str) -> dict:
+        search_query = self.BASE_SEARCH_QUERY.copy()
+        search_query.update(
+            {"size": 1, "query": {"wildcard": {"metadata.source": f"*{query}*"}}}
+        )
+
+        results = self.search_client.search(index=self.index_name, body=search_query)
+
+        if not results["hits"]["hits"]:
+            return {}
+
+        hit = results["hits"]["hits"][0]
+
+        return {
+            "source": hit["fields"]["metadata.source"][0],
+            "page_content": hit["fields"]["page_content"][0],
+        }
@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+
+from app.services.admission_controller import AdmissionController, AdmissionRejected
+from app.services.model_router import LARGE_TIER
+
+
+class TestAdmissionController(unittest.TestCase):
+    def setUp(self):
+        self.admission_controller = AdmissionController(
+            limits={LARGE_TIER: 1}, max_queue_size=1, queue_timeout_seconds=0.1
+        )
+
+    def test_admits_up_to_the_limit(self):
+        ticket = self.admission_controller.acquire(LARGE_TIER)
+
+        with self.assertRaises(AdmissionRejected):
+            self.admission_controller.acquire(LARGE_TIER)
+
+        self.admission_controller.release(ticket)
+        self.admission_controller.acquire(LARGE_TIER)
+
+        stats = self.admission_controller.get_stats()["tiers"][LARGE_TIER]
+        self.assertEqual(2, stats["admitted"])
+        self.assertEqual(1, stats["timed_out"])
+
+    def test_full_queue_is_rejected_right_away(self):
+        ticket = self.admission_controller.acquire(LARGE_TIER)
+        waiter = threading.Thread(
+            target=self.admission_controller.acquire, args=(LARGE_TIER, 1.0)
+        )
+        waiter.start()
+
+        while not self.admission_controller.get_stats()["tiers"][LARGE_TIER]["waiting"]:
+            time.sleep(0.01)
+
+        start = time.monotonic()
+
+        with self.assertRaises(AdmissionRejected) as context:
+            self.admission_controller.acquire(LARGE_TIER)
+
+        self.assertLess(time.monotonic() - start, 0.05)
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+
+        self.admission_controller.release(ticket)
+        waiter.join()
+
+    def test_released_slot_goes_to_the_first_waiter(self):
+        admission_controller = AdmissionController(
+            limits={LARGE_TIER: 1}, max_queue_size=4, queue_timeout_seconds=1.0
+        )
+        ticket = admission_controller.acquire(LARGE_TIER)
+        admitted = []
+
+        def acquire(name: str):
+            admitted.append((name, admission_controller.acquire(LARGE_TIER)))
+
+        for waiting, name in enumerate(("first", "second"), start=1):
+            threading.Thread(target=acquire, args=(name,)).start()
+
+            while (
+                admission_controller.get_stats()["tiers"][LARGE_TIER]["waiting"]
+                < waiting
+            ):
+                time.sleep(0.01)
+
+        admission_controller.release(ticket)
+
+        while not admitted:
+            time.sleep(0.01)
+
+        self.assertEqual("first", admitted[0][0])
+
+        # Releasing twice doesn't free a second slot
+        admission_controller.release(ticket)
+        self.assertEqual(1, len(admitted))
+
+        admission_controller.release(admitted[0][1])
+
+        while len(admitted) < 2:
+            time.sleep(0.01)
+
+        self.assertEqual(
+            1, admission_controller.get_stats()["tiers"][LARGE_TIER]["in_flight"]
+        )
+
+    def test_unknown_tiers_are_unlimited(self):
+        for _ in range(3):
+            self.admission_controller.acquire("other")
+
+        self.assertEqual(
+            3, self.admission_controller.get_stats()["tiers"]["other"]["in_flight"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
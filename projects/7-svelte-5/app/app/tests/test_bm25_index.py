@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from app.lib.bm25_index import BM25Index, decode_varints, encode_varint
+
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add("cats", "Cats are small furry animals. Cats purr.")
+        self.index.add("dogs", "Dogs are loyal animals that bark.")
+        self.index.add("cpu", "A CPU executes instructions.")
+
+    def test_varint_round_trip(self):
+        values = [0, 1, 127, 128, 300, 2**32]
+        encoded = bytearray()
+
+        for value in values:
+            encode_varint(value, encoded)
+
+        self.assertEqual(values, decode_varints(encoded), "Varints don't round trip.")
+
+    def test_search(self):
+        results = self.index.search("why do cats purr", size=2)
+
+        self.assertEqual("cats", results[0][0], "The best match is wrong.")
+        self.assertEqual(1, len(results), "Only one document mentions cats.")
+
+    def test_delete(self):
+        self.index.delete("cats")
+
+        self.assertEqual([], self.index.search("cats"), "Deleted doc was returned.")
+        self.assertEqual(2, len(self.index), "The doc count is wrong.")
+
+    def test_re_add_replaces_document(self):
+        self.index.add("cats", "Now this chunk is about birds.")
+
+        self.assertEqual([], self.index.search("purr"), "Old content was returned.")
+        self.assertEqual("cats", self.index.search("birds")[0][0])
+
+    def test_compact_keeps_results(self):
+        expected_results = self.index.search("animals")
+        self.index.add("tmp", "temporary")
+        self.index.delete("tmp")
+        self.index.compact()
+
+        self.assertEqual(expected_results, self.index.search("animals"))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, "bm25.pkl")
+            self.index.save(filepath)
+            loaded_index = BM25Index.load(filepath)
+
+        self.assertEqual(
+            self.index.search("loyal animals"), loaded_index.search("loyal animals")
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import json
+import os
+import tempfile
+import unittest
+
+import httpx
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.database import db
+from app.models import Chat, ChatMessage, ChatMessageRole
+
+from app.services.admission_controller import AdmissionController
+from app.services.app_llm import AppLlm
+from app.services.chat_manager import ChatManager
+from app.services.llm_http_client import LlmHttpClient
+from app.services.model_router import LARGE_TIER
+
+
+class UpstreamStream(httpx.SyncByteStream):
+    def __init__(self, tokens: list[str]):
+        self.tokens = tokens
+        self.sent = 0
+        self.is_closed = False
+
+    def __iter__(self):
+        for token in self.tokens:
+            chunk = {"choices": [{"delta": {"content": token}}]}
+            self.sent += 1
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+
+    def close(self):
+        self.is_closed = True
+
+
+class TestChatManagerStream(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        db_uri = f"sqlite:///{os.path.join(self.temp_dir.name, 'app.db')}"
+        db.metadata.create_all(create_engine(db_uri))
+
+        self.upstream_streams = []
+        self.summary_requests = 0
+
+        def handle_request(request: httpx.Request) -> httpx.Response:
+            if json.loads(request.content).get("stream"):
+                upstream_stream = UpstreamStream(["Hello", " there", ", friend."])
+                self.upstream_streams.append(upstream_stream)
+
+                return httpx.Response(200, stream=upstream_stream)
+
+            self.summary_requests += 1
+
+            return httpx.Response(
+                200, json={"choices": [{"message": {"content": "A greeting."}}]}
+            )
+
+        self.admission_controller = AdmissionController(
+            limits={LARGE_TIER: 1}, queue_timeout_seconds=0.2
+        )
+        llm_http_client = LlmHttpClient(
+            inference_api_url="http://llm",
+            admission_controller=self.admission_controller,
+        )
+        llm_http_client.http_client = httpx.Client(
+            transport=httpx.MockTransport(handle_request)
+        )
+
+        self.chat_manager = ChatManager(
+            db_uri=db_uri,
+            app_llm=AppLlm(
+                llm_http_client=llm_http_client, content_store=None, logger=None
+            ),
+            image_gen=None,
+            images_dir_url_path="",
+        )
+        self.chat_manager.use_summaries = True
+
+        with self.chat_manager.create_new_session() as session:
+            chat = Chat(title="chat")
+            session.add(chat)
+            session.add(ChatMessage(content="Hi", role=ChatMessageRole.USER, chat=chat))
+            session.commit()
+            self.chat_id = chat.id
+
+    def tearDown(self):
+        self.chat_manager.engine.dispose()
+        self.temp_dir.cleanup()
+
+    def get_chat(self, session: Session) -> Chat:
+        return session.get(Chat, self.chat_id)
+
+    def start_stream(self):
+        with self.chat_manager.create_new_session() as session:
+            chat = self.get_chat(session)
+            session.expunge(chat)
+
+        # Like /prompt-stream: the stream holds the only slot of the tier
+        ticket = self.admission_controller.acquire(LARGE_TIER)
+
+        return self.chat_manager.get_llm_response_stream_and_save_messages(
+            chat=chat, on_stream_end=lambda: self.admission_controller.release(ticket)
+        )
+
+    def get_assistant_message(self, session: Session) -> ChatMessage:
+        return next(
+            chat_message
+            for chat_message in self.get_chat(session).chat_messages
+            if chat_message.role == ChatMessageRole.ASSISTANT
+        )
+
+    def test_summary_gets_a_slot_after_the_stream(self):
+        self.assertEqual("Hello there, friend.", "".join(self.start_stream()))
+
+        with self.chat_manager.create_new_session() as session:
+            self.assertEqual(
+                "Hello there, friend.", self.get_assistant_message(session).content
+            )
+            self.assertEqual("A greeting.", self.get_chat(session).chat_summary.content)
+
+        self.assertEqual(1, self.summary_requests)
+        self.assertEqual(
+            0,
+            self.admission_controller.get_stats()["tiers"][LARGE_TIER]["in_flight"],
+        )
+
+    def test_disconnect_saves_the_partial_answer_without_a_summary(self):
+        stream = self.start_stream()
+        self.assertEqual("Hello", next(stream))
+        # What Flask does when the client goes away
+        stream.close()
+
+        self.assertTrue(self.upstream_streams[0].is_closed)
+        self.assertEqual(0, self.summary_requests)
+        self.assertEqual(
+            0,
+            self.admission_controller.get_stats()["tiers"][LARGE_TIER]["in_flight"],
+        )
+
+        with self.chat_manager.create_new_session() as session:
+            assistant_message = self.get_assistant_message(session)
+
+            self.assertEqual("Hello", assistant_message.content)
+            self.assertTrue(assistant_message.is_truncated)
+            self.assertIsNone(self.get_chat(session).chat_summary)
+
+
+class TestLlmHttpClientStream(unittest.TestCase):
+    def test_closing_the_stream_closes_the_upstream_response(self):
+        upstream_stream = UpstreamStream([str(i) for i in range(100)])
+
+        llm_http_client = LlmHttpClient(inference_api_url="http://up")
+        llm_http_client.http_client = httpx.Client(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, stream=upstream_stream)
+            )
+        )
+
+        stream = llm_http_client.get_llm_response_stream(
+            messages=[{"role": "user", "content": "hi"}]
+        )
+        next(stream)
+        stream.close()
+
+        self.assertTrue(upstream_stream.is_closed)
+        self.assertLess(upstream_stream.sent, 100)
+        self.assertEqual(
+            0, llm_http_client.model_router.backends[LARGE_TIER][0].outstanding
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import tempfile
+import unittest
+
+from app.services.content_store import ContentStore
+from app.services.local_search_backend import LocalSearchBackend
+from app.tests.test_local_search_backend import get_documents
+
+
+class FakeEmbeddingService:
+    model = "test"
+
+    def get_embeddings(self, embedding_input: str) -> list[float]:
+        return [1.0, 0.0, 0.0, 0.0]
+
+
+class TestContentStoreResultsCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+        search_backend = LocalSearchBackend(index_dir=self.temp_dir.name)
+        search_backend.create_index(dimensions=4)
+        search_backend.index_documents(get_documents(0, 5))
+
+        self.content_store = ContentStore(
+            search_backend=search_backend,
+            content_dir=self.temp_dir.name,
+            embedding_service=FakeEmbeddingService(),
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_keyword_hit_ids(self) -> list[str]:
+        return [hit["_id"] for hit in self.content_store.keyword_query("document")]
+
+    def test_repeated_queries_are_cached(self):
+        self.get_keyword_hit_ids()
+        self.get_keyword_hit_ids()
+
+        self.assertEqual(1, self.content_store.results_cache.get_stats()["hits"])
+
+    def test_reindex_by_another_process_invalidates_cached_results(self):
+        self.assertTrue(
+            set(self.get_keyword_hit_ids()) <= {f"doc-{i}" for i in range(5)}
+        )
+
+        # Like `flask reindex`: same files, another backend instance
+        other_backend = LocalSearchBackend(index_dir=self.temp_dir.name)
+        other_backend.delete_index()
+        other_backend.create_index(dimensions=4)
+        other_backend.index_documents(get_documents(10, 3))
+
+        self.assertEqual(
+            {"doc-10", "doc-11", "doc-12"}, set(self.get_keyword_hit_ids())
+        )
+
+    def test_own_writes_invalidate_cached_results(self):
+        self.get_keyword_hit_ids()
+        self.content_store.search_backend.delete_documents(
+            [f"doc-{i}" for i in range(5)]
+        )
+
+        self.assertEqual([], self.get_keyword_hit_ids())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from app.lib.embedding_model_registry import EmbeddingModelInfo, EmbeddingModelRegistry
+
+
+class TestEmbeddingModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.probe_calls = 0
+
+    def probe(self) -> EmbeddingModelInfo:
+        self.probe_calls += 1
+        time.sleep(0.05)
+
+        return EmbeddingModelInfo(model="custom-model", dimensions=512)
+
+    def test_known_model_is_not_probed(self):
+        registry = EmbeddingModelRegistry()
+        info = registry.get_or_probe("BAAI/bge-small-en-v1.5", self.probe)
+
+        self.assertEqual((384, "cls"), (info.dimensions, info.pooling))
+        self.assertEqual(0, self.probe_calls)
+
+    def test_concurrent_callers_share_one_probe(self):
+        registry = EmbeddingModelRegistry()
+        results = []
+
+        def get_info():
+            results.append(registry.get_or_probe("custom-model", self.probe))
+
+        threads = [threading.Thread(target=get_info) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, self.probe_calls)
+        self.assertEqual({512}, {info.dimensions for info in results})
+
+    def test_probed_models_are_stored_on_disk(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, "cache", "embedding-models.json")
+            EmbeddingModelRegistry(filepath=filepath).get_or_probe(
+                "custom-model", self.probe
+            )
+
+            info = EmbeddingModelRegistry(filepath=filepath).get_or_probe(
+                "custom-model", self.probe
+            )
+
+        self.assertEqual(512, info.dimensions)
+        self.assertEqual(1, self.probe_calls, "The stored model was probed again.")
+
+    def test_broken_file_is_ignored(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, "embedding-models.json")
+
+            with open(filepath, "w") as file:
+                file.write("{not json")
+
+            registry = EmbeddingModelRegistry(filepath=filepath)
+            registry.get_or_probe("custom-model", self.probe)
+
+        self.assertEqual(1, self.probe_calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import json
+import unittest
+
+import httpx
+
+from app.lib.generation_profiles import (
+    GenerationProfile,
+    get_json_object_end,
+    is_json_object_complete,
+)
+from app.services.llm_http_client import LlmHttpClient
+
+
+class TestGenerationProfiles(unittest.TestCase):
+    def test_request_params(self):
+        self.assertEqual({}, GenerationProfile().get_request_params())
+        self.assertEqual(
+            {"max_tokens": 64, "stop": ["\n\n"], "temperature": 0.0},
+            GenerationProfile(
+                max_tokens=64, stop=("\n\n",), temperature=0.0
+            ).get_request_params(),
+        )
+
+    def test_json_object_end(self):
+        self.assertIsNone(get_json_object_end('{"is_image": tr'))
+        self.assertIsNone(get_json_object_end('{"a": {"b": 1}'))
+        self.assertEqual(15, get_json_object_end('{"a": {"b": 1}}\n\n  '))
+
+    def test_braces_in_strings_are_ignored(self):
+        self.assertFalse(is_json_object_complete('{"a": "}'))
+        self.assertFalse(is_json_object_complete('{"a": "\\"}"'))
+        self.assertTrue(is_json_object_complete('{"a": "}"}'))
+
+
+class TestLlmHttpClientEarlyStop(unittest.TestCase):
+    def test_stream_is_cut_off_once_the_json_is_complete(self):
+        tokens = ['{"is_image"', ": false", "}", "\n", "\n", "more"]
+        request_bodies = []
+
+        class UpstreamStream(httpx.SyncByteStream):
+            sent = 0
+            is_closed = False
+
+            def __iter__(self):
+                for token in tokens:
+                    chunk = {"choices": [{"delta": {"content": token}}]}
+                    UpstreamStream.sent += 1
+                    yield f"data: {json.dumps(chunk)}\n\n".encode()
+
+            def close(self):
+                UpstreamStream.is_closed = True
+
+        def handle_request(request: httpx.Request) -> httpx.Response:
+            request_bodies.append(json.loads(request.content))
+
+            return httpx.Response(200, stream=UpstreamStream())
+
+        llm_http_client = LlmHttpClient(inference_api_url="http://llm")
+        llm_http_client.http_client = httpx.Client(
+            transport=httpx.MockTransport(handle_request)
+        )
+
+        response = llm_http_client.get_llm_response(
+            messages=[{"role": "user", "content": "hi"}],
+            generation_profile=GenerationProfile(
+                max_tokens=64, stop_when=is_json_object_complete
+            ),
+        )
+
+        self.assertEqual('{"is_image": false}', response)
+        self.assertTrue(UpstreamStream.is_closed)
+        self.assertLess(UpstreamStream.sent, len(tokens))
+        self.assertEqual(64, request_bodies[0]["max_tokens"])
+        self.assertTrue(request_bodies[0]["stream"])
+
+    def test_events_merged_and_split_across_chunks(self):
+        events = "".join(
+            "data: " + json.dumps({"choices": [{"delta": {"content": token}}]}) + "\n\n"
+            for token in ['{"is_image"', ": false", ', "is_text": true', "}"]
+        )
+        # Two events in the first chunk, then the rest cut mid event
+        split_at = events.index("data:", events.index("data:", 1) + 1) + 20
+        chunks = [events[:split_at], events[split_at:-7], events[-7:]]
+
+        llm_http_client = LlmHttpClient(inference_api_url="http://llm")
+        llm_http_client.http_client = httpx.Client(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(
+                    200, stream=ChunkedStream([chunk.encode() for chunk in chunks])
+                )
+            )
+        )
+
+        response = llm_http_client.get_llm_response(
+            messages=[{"role": "user", "content": "hi"}],
+            generation_profile=GenerationProfile(stop_when=is_json_object_complete),
+        )
+
+        self.assertEqual('{"is_image": false, "is_text": true}', response)
+
+        streamed = "".join(
+            llm_http_client.get_llm_response_stream(
+                messages=[{"role": "user", "content": "hi"}]
+            )
+        )
+        self.assertEqual('{"is_image": false, "is_text": true}', streamed)
+
+
+class ChunkedStream(httpx.SyncByteStream):
+    def __init__(self, chunks: list[bytes]):
+        self.chunks = chunks
+
+    def __iter__(self):
+        yield from self.chunks
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import threading
+import unittest
+
+from app.services.image_gen import stream_image_gen_progress
+
+
+class FakeImageGen:
+    def __init__(self, num_steps: int = 100, reports_every_step: bool = True):
+        self.num_steps = num_steps
+        self.reports_every_step = reports_every_step
+        self.steps_run = 0
+        self.deleted_filenames = []
+        self.is_finished = threading.Event()
+        self.is_stopped = threading.Event()
+        self.is_deleted = threading.Event()
+        self.step_gate = threading.Semaphore(0)
+
+    def gen_image_from_prompt(self, prompt: str, on_step, include_previews=False):
+        try:
+            for step in range(1, self.num_steps + 1):
+                # One step per release, so the test controls the pace
+                self.step_gate.acquire(timeout=1)
+                self.steps_run += 1
+
+                if self.reports_every_step or step == 1:
+                    on_step(step, self.num_steps, None)
+        finally:
+            self.is_stopped.set()
+
+        self.is_finished.set()
+
+        return f"{prompt}.png"
+
+    def delete_image(self, filename: str) -> None:
+        self.deleted_filenames.append(filename)
+        self.is_deleted.set()
+
+
+class TestStreamImageGenProgress(unittest.TestCase):
+    def get_stream(self, image_gen: FakeImageGen):
+        return stream_image_gen_progress(
+            image_gen.gen_image_from_prompt,
+            prompt="cat",
+            delete_image=image_gen.delete_image,
+        )
+
+    def test_delivers_progress_and_the_image(self):
+        image_gen = FakeImageGen(num_steps=3)
+
+        for _ in range(3):
+            image_gen.step_gate.release()
+
+        events = list(self.get_stream(image_gen))
+
+        self.assertEqual(["progress"] * 3 + ["done"], [e["type"] for e in events])
+        self.assertEqual("cat.png", events[-1]["filename"])
+        self.assertEqual([], image_gen.deleted_filenames)
+
+    def test_closing_the_stream_stops_at_the_next_step(self):
+        image_gen = FakeImageGen()
+        stream = self.get_stream(image_gen)
+
+        image_gen.step_gate.release()
+        self.assertEqual("progress", next(stream)["type"])
+        stream.close()
+
+        image_gen.step_gate.release()
+        self.assertTrue(image_gen.is_stopped.wait(timeout=1))
+
+        self.assertFalse(image_gen.is_finished.is_set())
+        self.assertEqual(2, image_gen.steps_run)
+        self.assertEqual([], image_gen.deleted_filenames)
+
+    def test_an_image_finished_after_closing_is_deleted(self):
+        # A pipeline that can't be stopped halfway still finishes its image
+        image_gen = FakeImageGen(num_steps=3, reports_every_step=False)
+        stream = self.get_stream(image_gen)
+
+        image_gen.step_gate.release()
+        self.assertEqual("progress", next(stream)["type"])
+        stream.close()
+
+        image_gen.step_gate.release()
+        image_gen.step_gate.release()
+        self.assertTrue(image_gen.is_deleted.wait(timeout=1))
+        self.assertEqual(["cat.png"], image_gen.deleted_filenames)
+
+
+if __name__ == "__main__":
+    unittest.main()
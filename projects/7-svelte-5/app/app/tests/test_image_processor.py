@@ -0,0 +1,151 @@
+import os
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+from PIL import Image
+
+from app.models import get_image_tag_for_generated_image
+from app.services.image_processor import ImageProcessor
+
+
+class ListLogger:
+    def __init__(self):
+        self.messages = []
+
+    def log(self, message: str) -> None:
+        self.messages.append(message)
+
+
+class TestImageProcessor(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.images_dir = self.temp_dir.name
+        self.filename = "cat.png"
+        Image.new("RGB", (600, 400), color="orange").save(
+            os.path.join(self.images_dir, self.filename)
+        )
+
+        self.logger = ListLogger()
+        self.image_processor = ImageProcessor(
+            images_dir=self.images_dir,
+            widths=[256, 512, 1024],
+            formats=["webp"],
+            logger=self.logger,
+        )
+
+    def tearDown(self):
+        self.image_processor.executor.shutdown()
+        self.temp_dir.cleanup()
+
+    def submit(self) -> list[dict]:
+        received_variants = []
+
+        self.image_processor.submit(self.filename, on_done=received_variants.extend)
+        # One worker, which runs done callbacks right after its task, so the
+        # next task only starts once on_done (or the logging) is finished
+        self.image_processor.executor.submit(lambda: None).result()
+
+        return received_variants
+
+    def test_creates_variants_without_upscaling(self):
+        variants = self.submit()
+
+        self.assertEqual(
+            [(256, 171), (512, 341), (600, 400)],
+            [(variant["width"], variant["height"]) for variant in variants],
+        )
+
+        for variant in variants:
+            self.assertEqual("image/webp", variant["mime_type"])
+
+            with Image.open(
+                os.path.join(self.images_dir, variant["filename"])
+            ) as image:
+                self.assertEqual("WEBP", image.format)
+                self.assertEqual(variant["width"], image.width)
+
+    def test_failed_encode_is_logged_and_cleaned_up(self):
+        save = Image.Image.save
+        saved_filepaths = []
+
+        def failing_save(image, filepath, *args, **kwargs):
+            # The first variant gets written, the second one fails
+            if saved_filepaths:
+                raise OSError("encoder error")
+
+            saved_filepaths.append(filepath)
+            save(image, filepath, *args, **kwargs)
+
+        with patch.object(Image.Image, "save", failing_save):
+            variants = self.submit()
+
+        self.assertEqual([], variants)
+        self.assertEqual(1, len(self.logger.messages))
+        self.assertIn(self.filename, self.logger.messages[0])
+        self.assertIn("encoder error", self.logger.messages[0])
+        self.assertFalse(os.path.exists(saved_filepaths[0]))
+        self.assertEqual([self.filename], os.listdir(self.images_dir))
+
+
+class TestGeneratedImageTag(unittest.TestCase):
+    VARIANTS = [
+        {"filename": "cat-256w.avif", "mime_type": "image/avif", "width": 256},
+        {"filename": "cat-600w.avif", "mime_type": "image/avif", "width": 600},
+        {"filename": "cat-256w.webp", "mime_type": "image/webp", "width": 256},
+        {"filename": "cat-600w.webp", "mime_type": "image/webp", "width": 600},
+    ]
+
+    def get_image_tag(self, variants: list[dict] | None) -> str:
+        return get_image_tag_for_generated_image(
+            prompt="a cat",
+            filename="cat.png",
+            files_dir_path="/images",
+            link_to_image=False,
+            variants=(
+                [
+                    {**variant, "height": round(variant["width"] * 2 / 3)}
+                    for variant in variants
+                ]
+                if variants is not None
+                else None
+            ),
+        )
+
+    def test_picture_with_a_source_per_format(self):
+        image_tag = self.get_image_tag(self.VARIANTS)
+
+        self.assertTrue(image_tag.startswith("<picture>"))
+        self.assertIn(
+            '<source type="image/avif" '
+            'srcset="/images/cat-256w.avif 256w, /images/cat-600w.avif 600w"',
+            image_tag,
+        )
+        self.assertIn('<source type="image/webp"', image_tag)
+        self.assertIn('src="/images/cat.png"', image_tag)
+        self.assertIn('width="600" height="400"', image_tag)
+
+    def test_missing_format_has_no_source(self):
+        image_tag = self.get_image_tag(
+            [
+                variant
+                for variant in self.VARIANTS
+                if variant["mime_type"] == "image/webp"
+            ]
+        )
+
+        self.assertNotIn("image/avif", image_tag)
+        self.assertIn('<source type="image/webp"', image_tag)
+
+    def test_falls_back_to_the_original_without_variants(self):
+        for variants in (None, []):
+            image_tag = self.get_image_tag(variants)
+
+            self.assertNotIn("<picture>", image_tag)
+            self.assertNotIn("srcset", image_tag)
+            self.assertIn('src="/images/cat.png"', image_tag)
+
+
+if __name__ == "__main__":
+    unittest.main()
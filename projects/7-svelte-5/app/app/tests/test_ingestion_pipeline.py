@@ -0,0 +1,124 @@
+import threading
+import unittest
+
+from app.lib.near_duplicates import NearDuplicateIndex
+
+from app.services.data_loader import Document
+from app.services.ingestion_pipeline import IngestionPipeline
+
+
+def embed_documents(documents: list[Document]) -> list[dict]:
+    return [
+        {"id": document.page_content, "embeddings": [1.0]} for document in documents
+    ]
+
+
+class TestIngestionPipeline(unittest.TestCase):
+    def test_all_documents_are_indexed_in_batches(self):
+        indexed_batches = []
+        pipeline = IngestionPipeline(
+            embed_documents=embed_documents,
+            index_documents=lambda batch: indexed_batches.append(list(batch)),
+            batch_size=4,
+            index_batch_size=10,
+        )
+
+        stats = pipeline.run(Document(page_content=str(i)) for i in range(25))
+
+        self.assertEqual([10, 10, 5], [len(batch) for batch in indexed_batches])
+        self.assertEqual(
+            [str(i) for i in range(25)],
+            [document["id"] for batch in indexed_batches for document in batch],
+        )
+        self.assertEqual(25, stats["stages"]["index"]["items"])
+        self.assertEqual(7, stats["stages"]["embed"]["batches"])
+
+    def test_several_embedding_workers(self):
+        indexed_ids = []
+        pipeline = IngestionPipeline(
+            embed_documents=embed_documents,
+            index_documents=lambda batch: indexed_ids.extend(
+                document["id"] for document in batch
+            ),
+            batch_size=3,
+            embedding_workers=4,
+        )
+
+        stats = pipeline.run(
+            Document(page_content=str(i), metadata={"source": f"file_{i // 10}"})
+            for i in range(100)
+        )
+
+        self.assertEqual(sorted(str(i) for i in range(100)), sorted(indexed_ids))
+        self.assertEqual(10, stats["sources_read"])
+
+    def test_near_duplicates_are_skipped(self):
+        indexed_ids = []
+        footer = "Copyright Example Inc, all rights reserved, do not redistribute."
+        pipeline = IngestionPipeline(
+            embed_documents=embed_documents,
+            index_documents=lambda batch: indexed_ids.extend(
+                document["id"] for document in batch
+            ),
+            near_duplicate_index=NearDuplicateIndex(threshold=0.9),
+        )
+
+        stats = pipeline.run(
+            [
+                Document(page_content=footer),
+                Document(page_content="Something else entirely, about sourdough."),
+                Document(page_content=footer),
+            ]
+        )
+
+        self.assertEqual(2, len(indexed_ids))
+        self.assertEqual(1, stats["skipped_duplicates"])
+
+    def test_backpressure_bounds_documents_in_flight(self):
+        read_count = 0
+        release_index = threading.Event()
+
+        def iter_documents():
+            nonlocal read_count
+
+            for i in range(1000):
+                read_count += 1
+                yield Document(page_content=str(i))
+
+        def index_documents(batch):
+            release_index.wait()
+
+        pipeline = IngestionPipeline(
+            embed_documents=embed_documents,
+            index_documents=index_documents,
+            batch_size=2,
+            index_batch_size=2,
+            queue_size=1,
+        )
+        thread = threading.Thread(target=pipeline.run, args=(iter_documents(),))
+        thread.start()
+        thread.join(timeout=0.5)
+
+        self.assertLess(read_count, 20, "The reader didn't wait for the indexer.")
+
+        release_index.set()
+        thread.join()
+        self.assertEqual(1000, read_count)
+
+    def test_errors_are_raised(self):
+        def index_documents(batch):
+            raise RuntimeError("index is down")
+
+        pipeline = IngestionPipeline(
+            embed_documents=embed_documents,
+            index_documents=index_documents,
+            batch_size=1,
+            index_batch_size=1,
+        )
+
+        with self.assertRaises(RuntimeError):
+            pipeline.run(Document(page_content=str(i)) for i in range(100))
+
+
+if __name__ == "__main__":
+    unittest.main()
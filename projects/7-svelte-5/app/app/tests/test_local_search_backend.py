@@ -0,0 +1,167 @@
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+import numpy as np
+
+from app.services.local_search_backend import LocalSearchBackend
+
+
+def get_documents(start: int, count: int, dimensions: int = 4) -> list[dict]:
+    rng = np.random.default_rng(start)
+
+    return [
+        {
+            "id": f"doc-{i}",
+            "page_content": f"document number {i}",
+            "metadata": {"source": f"doc-{i}.txt"},
+            "embedding_model": "test",
+            "embeddings": rng.normal(size=dimensions).tolist(),
+        }
+        for i in range(start, start + count)
+    ]
+
+
+class TestLocalSearchBackend(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.search_backend = LocalSearchBackend(index_dir=self.temp_dir.name)
+        self.search_backend.create_index(dimensions=4)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_bulk_load_writes_the_index_once(self):
+        with patch.object(
+            self.search_backend,
+            "save_index",
+            wraps=self.search_backend.save_index,
+        ) as save_index:
+            self.search_backend.begin_bulk_load()
+
+            for start in range(0, 50, 10):
+                self.search_backend.index_documents(get_documents(start, 10))
+
+            # Not searchable until the bulk load is done
+            self.assertEqual([], self.search_backend.keyword_query("document number 7"))
+
+            self.search_backend.end_bulk_load()
+
+        self.assertEqual(1, save_index.call_count)
+        self.assertEqual(
+            "doc-7",
+            self.search_backend.keyword_query("document number 7", size=50)[0]["_id"],
+        )
+
+        # What was written is what gets loaded
+        reloaded = LocalSearchBackend(index_dir=self.temp_dir.name)
+        self.assertEqual(50, len(reloaded.snapshot[1]))
+        self.assertEqual((50, 4), reloaded.snapshot[0].shape)
+
+    def test_writes_outside_bulk_loads_are_immediate(self):
+        documents = get_documents(0, 3)
+        self.search_backend.index_documents(documents)
+
+        embeddings = documents[1]["embeddings"]
+        hits = self.search_backend.vector_query(embeddings=embeddings, size=1)
+
+        self.assertEqual("doc-1", hits[0]["_id"])
+
+    def test_delete_writes_pending_documents_first(self):
+        self.search_backend.begin_bulk_load()
+        self.search_backend.index_documents(get_documents(0, 3))
+        self.search_backend.delete_documents(["doc-0"])
+        self.search_backend.end_bulk_load()
+
+        self.assertEqual(
+            ["doc-1", "doc-2"],
+            [document["id"] for document in self.search_backend.snapshot[1]],
+        )
+
+    def test_reindexing_an_id_replaces_its_row(self):
+        documents = get_documents(0, 10)
+        self.search_backend.index_documents(documents)
+
+        changed_document = {**get_documents(20, 1)[0], "id": "doc-3"}
+        changed_document["page_content"] = "a rewritten document"
+
+        # Also indexed twice within one bulk load, the last version wins
+        self.search_backend.begin_bulk_load()
+        self.search_backend.index_documents([documents[3]])
+        self.search_backend.index_documents([changed_document])
+        self.search_backend.end_bulk_load()
+
+        vectors, stored_documents, _ = self.search_backend.snapshot
+
+        self.assertEqual(10, len(stored_documents))
+        self.assertEqual(10, len(vectors))
+        self.assertEqual("doc-3", stored_documents[3]["id"])
+        self.assertEqual("a rewritten document", stored_documents[3]["page_content"])
+
+        hits = self.search_backend.vector_query(
+            embeddings=changed_document["embeddings"], size=1
+        )
+        self.assertEqual("doc-3", hits[0]["_id"])
+        self.assertEqual(
+            "doc-3", self.search_backend.keyword_query("rewritten")[0]["_id"]
+        )
+
+    def test_reindexing_an_id_with_int8_vectors(self):
+        search_backend = LocalSearchBackend(
+            index_dir=self.temp_dir.name, quantization="int8"
+        )
+        search_backend.create_index(dimensions=4)
+        search_backend.index_documents(get_documents(0, 3))
+
+        changed_document = {**get_documents(20, 1)[0], "id": "doc-0"}
+        search_backend.index_documents([changed_document, *get_documents(3, 1)])
+
+        self.assertEqual(4, len(search_backend.snapshot[0]))
+        self.assertEqual(
+            "doc-0",
+            search_backend.vector_query(
+                embeddings=changed_document["embeddings"], size=1
+            )[0]["_id"],
+        )
+
+
+class TestLocalSearchBackendHnsw(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_graph_is_built_for_an_index_without_one(self):
+        documents = get_documents(0, 10)
+
+        search_backend = LocalSearchBackend(index_dir=self.temp_dir.name)
+        search_backend.create_index(dimensions=4)
+        search_backend.index_documents(documents)
+
+        hnsw_backend = LocalSearchBackend(index_dir=self.temp_dir.name, use_hnsw=True)
+        hits = hnsw_backend.vector_query(embeddings=documents[4]["embeddings"], size=3)
+
+        self.assertEqual(3, len(hits))
+        self.assertEqual("doc-4", hits[0]["_id"])
+
+    def test_reindexing_an_id_updates_the_graph(self):
+        search_backend = LocalSearchBackend(index_dir=self.temp_dir.name, use_hnsw=True)
+        search_backend.create_index(dimensions=4)
+        search_backend.index_documents(get_documents(0, 10))
+
+        changed_document = {**get_documents(20, 1)[0], "id": "doc-3"}
+        search_backend.index_documents([changed_document])
+
+        self.assertEqual(10, search_backend.hnsw_index.get_count())
+        self.assertEqual(
+            "doc-3",
+            search_backend.vector_query(
+                embeddings=changed_document["embeddings"], size=1
+            )[0]["_id"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
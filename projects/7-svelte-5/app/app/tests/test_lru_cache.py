@@ -0,0 +1,45 @@
+import time
+import unittest
+
+from app.lib.lru_cache import LruCache
+
+
+class TestLruCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LruCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"), "The least recently used item was kept.")
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(3, cache.get("c"))
+
+    def test_stats(self):
+        cache = LruCache(max_size=2)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("missing")
+
+        stats = cache.get_stats()
+        self.assertEqual((1, 1, 1), (stats["size"], stats["hits"], stats["misses"]))
+
+    def test_zero_size_disables_cache(self):
+        cache = LruCache(max_size=0)
+        cache.set("a", 1)
+
+        self.assertIsNone(cache.get("a"), "A disabled cache stored an item.")
+
+    def test_expired_entries_are_misses(self):
+        cache = LruCache(max_size=2, ttl_seconds=0.05)
+        cache.set("a", 1)
+
+        self.assertEqual(1, cache.get("a"))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, len(cache))
+
+
+if __name__ == "__main__":
+    unittest.main()
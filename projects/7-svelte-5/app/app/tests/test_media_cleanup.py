@@ -0,0 +1,184 @@
+import os
+import tempfile
+import time
+import unittest
+
+from unittest.mock import patch
+
+from flask import Flask
+from sqlalchemy import create_engine
+
+from app.database import db
+from app.models import (
+    Chat,
+    ChatMessage,
+    ChatMessageRole,
+    GeneratedImage,
+    GeneratedMediaType,
+)
+
+from app.services.chat_manager import ChatManager
+from app.services.media_cleanup import FileDeletionQueue, OrphanedMediaSweeper
+
+
+class ListLogger:
+    def __init__(self):
+        self.messages = []
+
+    def log(self, message: str) -> None:
+        self.messages.append(message)
+
+
+class FakeImageGen:
+    def __init__(self, images_dir: str):
+        self.images_dir = images_dir
+
+    def get_image_filepath(self, filename: str) -> str:
+        return os.path.join(self.images_dir, filename)
+
+
+class MediaCleanupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.media_dir = os.path.join(self.temp_dir.name, "media")
+        os.makedirs(self.media_dir)
+
+        self.db_uri = f"sqlite:///{os.path.join(self.temp_dir.name, 'app.db')}"
+        db.metadata.create_all(create_engine(self.db_uri))
+
+        self.logger = ListLogger()
+        self.file_deletion_queue = FileDeletionQueue(logger=self.logger, batch_size=2)
+        self.chat_manager = ChatManager(
+            db_uri=self.db_uri,
+            app_llm=None,
+            image_gen=FakeImageGen(self.media_dir),
+            images_dir_url_path="",
+            file_deletion_queue=self.file_deletion_queue,
+        )
+
+        with self.chat_manager.create_new_session() as session:
+            chat = Chat(title="chat")
+            generated_image = GeneratedImage(
+                filename="cat.png",
+                prompt="a cat",
+                type=GeneratedMediaType.GENERATED_IMAGE,
+                variants=[
+                    {
+                        "filename": "cat-256w.webp",
+                        "mime_type": "image/webp",
+                        "width": 256,
+                        "height": 256,
+                    }
+                ],
+            )
+            session.add(chat)
+            session.add(
+                ChatMessage(
+                    content="",
+                    role=ChatMessageRole.ASSISTANT,
+                    chat=chat,
+                    generated_media=generated_image,
+                )
+            )
+            session.commit()
+            self.chat_id = chat.id
+
+    def tearDown(self):
+        self.chat_manager.engine.dispose()
+        self.temp_dir.cleanup()
+
+    def create_file(self, filename: str, age_seconds: float = 0) -> str:
+        filepath = os.path.join(self.media_dir, filename)
+
+        with open(filepath, "w") as file:
+            file.write(filename)
+
+        if age_seconds:
+            timestamp = time.time() - age_seconds
+            os.utime(filepath, (timestamp, timestamp))
+
+        return filepath
+
+    def get_media_filenames(self) -> set[str]:
+        return set(os.listdir(self.media_dir))
+
+
+class TestFileDeletionQueue(MediaCleanupTestCase):
+    def test_deletes_everything_queued(self):
+        filepaths = [self.create_file(f"{i}.png") for i in range(5)]
+        missing_filepath = os.path.join(self.media_dir, "missing.png")
+
+        self.file_deletion_queue.enqueue(filepaths + [missing_filepath])
+        self.file_deletion_queue.join()
+
+        self.assertEqual(set(), self.get_media_filenames())
+        self.assertEqual(1, len(self.logger.messages))
+        self.assertIn("missing.png", self.logger.messages[0])
+
+    def test_clearing_a_chat_deletes_its_files_after_the_commit(self):
+        self.create_file("cat.png")
+        self.create_file("cat-256w.webp")
+
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = self.db_uri
+        db.init_app(app)
+
+        with app.app_context():
+            chat = db.session.get(Chat, self.chat_id)
+
+            with patch.object(
+                db.session, "commit", side_effect=RuntimeError("commit failed")
+            ):
+                with self.assertRaises(RuntimeError):
+                    self.chat_manager.delete_chat_content(chat)
+
+            self.file_deletion_queue.join()
+            self.assertEqual({"cat.png", "cat-256w.webp"}, self.get_media_filenames())
+
+            self.chat_manager.delete_chat_content(chat)
+            self.file_deletion_queue.join()
+
+            self.assertEqual(set(), self.get_media_filenames())
+            db.session.remove()
+
+
+class TestOrphanedMediaSweeper(MediaCleanupTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.sweeper = OrphanedMediaSweeper(
+            media_dir=self.media_dir,
+            create_session=self.chat_manager.create_new_session,
+            file_deletion_queue=self.file_deletion_queue,
+            logger=self.logger,
+            min_age_seconds=600,
+        )
+
+    def test_sweep(self):
+        one_hour = 3600
+        orphaned_filepath = self.create_file("orphan.png", age_seconds=one_hour)
+        # Referenced original and variant, files that ship with the repo
+        for filename in ("cat.png", "cat-256w.webp", ".gitkeep", "test.png"):
+            self.create_file(filename, age_seconds=one_hour)
+        # Unreferenced, but maybe a generation whose row isn't committed yet
+        self.create_file("in-flight.png")
+
+        self.assertEqual([orphaned_filepath], self.sweeper.sweep())
+        self.file_deletion_queue.join()
+
+        self.assertEqual(
+            {"cat.png", "cat-256w.webp", ".gitkeep", "test.png", "in-flight.png"},
+            self.get_media_filenames(),
+        )
+
+    def test_files_within_the_grace_period_are_kept(self):
+        self.create_file("orphan.png", age_seconds=599)
+
+        self.assertEqual([], self.sweeper.find_orphaned_filepaths())
+
+        self.sweeper.min_age_seconds = 0
+        self.assertEqual(1, len(self.sweeper.find_orphaned_filepaths()))
+
+
+if __name__ == "__main__":
+    unittest.main()
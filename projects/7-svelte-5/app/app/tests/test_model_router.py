@@ -0,0 +1,157 @@
+import time
+import unittest
+
+import httpx
+
+from app.services.llm_http_client import LlmHttpClient
+from app.services.model_router import (
+    LARGE_TIER,
+    SMALL_TIER,
+    ModelRouter,
+    NoBackendAvailable,
+)
+
+
+def get_completion(content: str) -> dict:
+    return {"choices": [{"message": {"content": content}}]}
+
+
+class TestModelRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = ModelRouter(
+            tiers={
+                LARGE_TIER: ["http://large-1", "http://large-2"],
+                SMALL_TIER: ["http://small-1"],
+            },
+            fallbacks={SMALL_TIER: [LARGE_TIER]},
+            failure_threshold=2,
+        )
+
+    def test_least_outstanding_spreads_requests(self):
+        first = self.router.pick(LARGE_TIER)
+        second = self.router.pick(LARGE_TIER)
+
+        self.assertNotEqual(first.url, second.url)
+
+        self.router.release(first)
+        self.assertEqual(first.url, self.router.pick(LARGE_TIER).url)
+
+    def test_failing_backend_is_ejected(self):
+        backend = self.router.backends[LARGE_TIER][0]
+
+        for _ in range(2):
+            self.router.record_failure(backend)
+
+        picked_urls = set()
+
+        for _ in range(4):
+            picked = self.router.pick(LARGE_TIER)
+            picked_urls.add(picked.url)
+            self.router.release(picked)
+
+        self.assertEqual({"http://large-2"}, picked_urls)
+
+    def test_falls_back_to_the_next_tier(self):
+        small_backend = self.router.backends[SMALL_TIER][0]
+
+        for _ in range(2):
+            self.router.record_failure(small_backend)
+
+        self.assertEqual(LARGE_TIER, self.router.pick(SMALL_TIER).tier)
+
+    def test_panics_when_everything_is_ejected(self):
+        for backend in self.router.get_all_backends():
+            for _ in range(2):
+                self.router.record_failure(backend)
+
+        self.assertEqual(LARGE_TIER, self.router.pick(LARGE_TIER).tier)
+
+        with self.assertRaises(NoBackendAvailable):
+            self.router.pick(LARGE_TIER, exclude={"http://large-1", "http://large-2"})
+
+    def test_affinity_sticks_until_the_backend_is_busy(self):
+        preferred = self.router.pick(LARGE_TIER, affinity_key="chat-1")
+        self.router.release(preferred)
+
+        for _ in range(3):
+            backend = self.router.pick(LARGE_TIER, affinity_key="chat-1")
+            self.assertEqual(preferred.url, backend.url)
+
+        # 3 in flight on the preferred backend, 0 on the other one
+        self.assertNotEqual(
+            preferred.url, self.router.pick(LARGE_TIER, affinity_key="chat-1").url
+        )
+
+    def test_ewma_latency_prefers_the_faster_backend(self):
+        router = ModelRouter(
+            tiers={LARGE_TIER: ["http://slow", "http://fast"]},
+            strategy="ewma_latency",
+        )
+        slow, fast = router.backends[LARGE_TIER]
+        router.record_success(slow, 2.0)
+        router.record_success(fast, 0.5)
+
+        self.assertEqual(fast.url, router.pick(LARGE_TIER).url)
+
+    def test_health_check_only_readmits_what_it_ejected(self):
+        failing_urls = {"http://large-1"}
+
+        def handle_request(request: httpx.Request) -> httpx.Response:
+            if f"http://{request.url.host}" in failing_urls:
+                return httpx.Response(503)
+
+            return httpx.Response(200)
+
+        self.router.http_client = httpx.Client(
+            transport=httpx.MockTransport(handle_request)
+        )
+        health_ejected, request_ejected = self.router.backends[LARGE_TIER]
+
+        self.router.check_health()
+        # Completions fail while /health still answers
+        for _ in range(2):
+            self.router.record_failure(request_ejected)
+
+        self.assertFalse(health_ejected.is_available(time.monotonic()))
+        self.assertFalse(request_ejected.is_available(time.monotonic()))
+
+        failing_urls.clear()
+        self.router.check_health()
+
+        self.assertTrue(health_ejected.is_available(time.monotonic()))
+        self.assertFalse(request_ejected.is_available(time.monotonic()))
+
+
+class TestLlmHttpClientRouting(unittest.TestCase):
+    def test_retries_on_another_backend(self):
+        requested_hosts = []
+
+        def handle_request(request: httpx.Request) -> httpx.Response:
+            requested_hosts.append(request.url.host)
+
+            if request.url.host == "down":
+                return httpx.Response(503)
+
+            return httpx.Response(200, json=get_completion("hello"))
+
+        router = ModelRouter(tiers={LARGE_TIER: ["http://down", "http://up"]})
+        # First pick is random between idle backends, make it the broken one
+        router.backends[LARGE_TIER][1].outstanding = 1
+        llm_http_client = LlmHttpClient(
+            inference_api_url="http://down", model_router=router
+        )
+        llm_http_client.http_client = httpx.Client(
+            transport=httpx.MockTransport(handle_request)
+        )
+
+        response = llm_http_client.get_llm_response(
+            messages=[{"role": "user", "content": "hi"}]
+        )
+
+        self.assertEqual("hello", response)
+        self.assertEqual(["down", "up"], requested_hosts)
+        self.assertEqual(1, router.backends[LARGE_TIER][0].failures)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+from app.lib.near_duplicates import NearDuplicateIndex, get_lsh_bands
+
+BOILERPLATE = (
+    "This document is provided for internal use only. Do not distribute it "
+    "outside the company without written approval from the legal team. All "
+    "rights reserved, see the intranet for the full terms of use."
+)
+
+
+class TestNearDuplicateIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = NearDuplicateIndex(threshold=0.8)
+
+    def test_exact_and_near_duplicates(self):
+        self.assertIsNone(self.index.add_if_new("a", BOILERPLATE))
+        self.assertEqual("a", self.index.add_if_new("b", BOILERPLATE))
+        self.assertEqual(
+            "a",
+            self.index.add_if_new("c", BOILERPLATE.upper().replace(",", "")),
+            "Case and punctuation changes should not matter.",
+        )
+        self.assertEqual(1, len(self.index))
+
+    def test_different_texts_are_kept(self):
+        self.assertIsNone(self.index.add_if_new("a", BOILERPLATE))
+        self.assertIsNone(
+            self.index.add_if_new(
+                "b",
+                "Cats purr when content but also when stressed. Indoor cats need "
+                "scratching posts and daily play to stay healthy and happy.",
+            )
+        )
+        self.assertEqual(2, len(self.index))
+
+    def test_oldest_texts_are_evicted_past_max_entries(self):
+        index = NearDuplicateIndex(threshold=0.8, max_entries=2)
+        index.add_if_new("a", BOILERPLATE)
+        index.add_if_new("b", "Cats purr when content but also when stressed.")
+        index.add_if_new("c", "Indoor cats need scratching posts and daily play.")
+
+        self.assertEqual(2, len(index))
+        self.assertEqual(1, index.evicted)
+        # "a" was forgotten, so its duplicate is new again
+        self.assertIsNone(index.add_if_new("d", BOILERPLATE))
+        self.assertNotIn(
+            "a",
+            {
+                key
+                for buckets in index.buckets
+                for keys in buckets.values()
+                for key in keys
+            },
+        )
+
+    def test_lsh_bands(self):
+        bands, rows = get_lsh_bands(num_perm=128, threshold=0.8)
+
+        self.assertEqual(128, bands * rows)
+        self.assertAlmostEqual(0.8, (1 / bands) ** (1 / rows), delta=0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from app.lib.prompt_prefix import (
+    PrefixReuseTracker,
+    get_common_prefix_length,
+    get_slot_id,
+    serialize_messages,
+)
+
+
+class TestPromptPrefix(unittest.TestCase):
+    def test_common_prefix_length(self):
+        self.assertEqual(3, get_common_prefix_length("abcd", "abcx"))
+        self.assertEqual(0, get_common_prefix_length("", "abc"))
+
+    def test_slot_id_is_stable(self):
+        slot_ids = {get_slot_id("42", num_slots=4) for _ in range(10)}
+
+        self.assertEqual(1, len(slot_ids))
+        self.assertIn(slot_ids.pop(), range(4))
+
+    def test_appended_messages_reuse_the_prefix(self):
+        tracker = PrefixReuseTracker()
+        history = [{"role": "user", "content": "Hello"}]
+        first_prompt = serialize_messages(history)
+
+        self.assertEqual(0.0, tracker.record_prompt("chat", first_prompt))
+
+        history += [
+            {"role": "assistant", "content": "Hi"},
+            {"role": "user", "content": "How are you?"},
+        ]
+        reuse_ratio = tracker.record_prompt("chat", serialize_messages(history))
+
+        # Everything up to the closing bracket of the first prompt is reused
+        expected_ratio = (len(first_prompt) - 1) / len(serialize_messages(history))
+        self.assertAlmostEqual(expected_ratio, reuse_ratio)
+
+    def test_keys_are_tracked_separately(self):
+        tracker = PrefixReuseTracker()
+        tracker.record_prompt("chat_1", "same prompt")
+
+        self.assertEqual(0.0, tracker.record_prompt("chat_2", "same prompt"))
+
+    def test_server_timings(self):
+        tracker = PrefixReuseTracker()
+        tracker.record_server_timings({"prompt_n": 25, "cache_n": 75})
+
+        stats = tracker.get_stats()
+        self.assertEqual(75, stats["server_cached_tokens"])
+        self.assertEqual(0.75, stats["server_cache_ratio"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from app.lib.rank_fusion import fuse_results, min_max_fusion, reciprocal_rank_fusion
+
+
+def build_hits(*id_score_pairs) -> list[dict]:
+    return [{"_id": id, "_score": score} for id, score in id_score_pairs]
+
+
+class TestRankFusion(unittest.TestCase):
+    def setUp(self):
+        self.keyword_hits = build_hits(("a", 12.0), ("b", 7.5), ("c", 1.0))
+        self.vector_hits = build_hits(("b", 0.91), ("d", 0.85), ("a", 0.2))
+
+    def test_rrf_prefers_docs_found_by_both(self):
+        results = reciprocal_rank_fusion([self.keyword_hits, self.vector_hits], size=4)
+
+        self.assertEqual(["b", "a", "d", "c"], [hit["_id"] for hit in results])
+
+    def test_rrf_weights(self):
+        results = reciprocal_rank_fusion(
+            [self.keyword_hits, self.vector_hits], size=1, weights=[0.0, 1.0]
+        )
+
+        self.assertEqual("b", results[0]["_id"], "Keyword hits should be ignored.")
+
+    def test_min_max_fusion(self):
+        results = min_max_fusion(
+            [self.keyword_hits, self.vector_hits], size=2, weights=[0.3, 0.7]
+        )
+
+        self.assertEqual(["b", "d"], [hit["_id"] for hit in results])
+        self.assertAlmostEqual(0.3 * 6.5 / 11 + 0.7, results[0]["_score"])
+
+    def test_empty_lists(self):
+        self.assertEqual([], fuse_results([[], []], size=3))
+        self.assertEqual(
+            ["a", "b"],
+            [hit["_id"] for hit in fuse_results([self.keyword_hits, []], size=2)],
+        )
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            fuse_results([self.keyword_hits], size=3, method="unknown")
+
+        with self.assertRaises(ValueError):
+            reciprocal_rank_fusion([self.keyword_hits], size=3, weights=[0.5, 0.5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import time
+import unittest
+
+from app.services.reranker import RerankDeadlineExceeded, Reranker
+
+
+class SlowReranker(Reranker):
+    def __init__(self, batch_seconds: float):
+        super().__init__(model="slow", batch_size=2)
+
+        self.batch_seconds = batch_seconds
+        self.scored_batches = 0
+
+    def score_batch(self, query: str, documents: list[str]) -> list[float]:
+        time.sleep(self.batch_seconds)
+        self.scored_batches += 1
+
+        return [float(len(document)) for document in documents]
+
+
+class TestReranker(unittest.TestCase):
+    def test_scores_keep_the_document_order(self):
+        reranker = SlowReranker(batch_seconds=0)
+
+        self.assertEqual(
+            [1.0, 3.0, 2.0], reranker.rerank(query="q", documents=["a", "abc", "ab"])
+        )
+        self.assertEqual(2, reranker.scored_batches)
+
+    def test_stops_between_batches_once_the_deadline_passed(self):
+        reranker = SlowReranker(batch_seconds=0.05)
+
+        with self.assertRaises(RerankDeadlineExceeded):
+            reranker.rerank(
+                query="q",
+                documents=["a"] * 10,
+                deadline=time.monotonic() + 0.01,
+            )
+
+        self.assertEqual(1, reranker.scored_batches)
+
+    def test_score_batch_is_required(self):
+        with self.assertRaises(TypeError):
+            Reranker(model="none")
+
+
+if __name__ == "__main__":
+    unittest.main()
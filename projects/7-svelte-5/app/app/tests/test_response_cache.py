@@ -0,0 +1,128 @@
+import os
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+import httpx
+
+from app.lib.response_cache import MemoryResponseCache, SqliteResponseCache
+from app.services.llm_http_client import LlmHttpClient
+
+
+class ResponseCacheTests:
+    def create_cache(self, max_entries: int = 10, ttl_seconds: float = 0):
+        raise NotImplementedError
+
+    def test_get_set(self):
+        cache = self.create_cache()
+        cache.set("a", {"choices": [1]})
+
+        self.assertEqual({"choices": [1]}, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+
+    def test_entries_expire(self):
+        cache = self.create_cache(ttl_seconds=60)
+
+        with patch("app.lib.response_cache.time.time", return_value=1000):
+            cache.set("a", "value")
+
+        with patch("app.lib.response_cache.time.time", return_value=1030):
+            self.assertEqual("value", cache.get("a"))
+
+        with patch("app.lib.response_cache.time.time", return_value=1061):
+            self.assertIsNone(cache.get("a"))
+
+        self.assertEqual(1, cache.get_stats()["expired"])
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = self.create_cache(max_entries=2)
+
+        with patch("app.lib.response_cache.time.time", return_value=1000):
+            cache.set("a", 1)
+
+        with patch("app.lib.response_cache.time.time", return_value=1001):
+            cache.set("b", 2)
+
+        with patch("app.lib.response_cache.time.time", return_value=1002):
+            cache.get("a")
+
+        with patch("app.lib.response_cache.time.time", return_value=1003):
+            cache.set("c", 3)
+
+        self.assertEqual(1, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(2, cache.get_stats()["size"])
+
+
+class TestMemoryResponseCache(ResponseCacheTests, unittest.TestCase):
+    def create_cache(self, max_entries: int = 10, ttl_seconds: float = 0):
+        return MemoryResponseCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+
+class TestSqliteResponseCache(ResponseCacheTests, unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.temp_dir.name, "responses.sqlite3")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_cache(self, max_entries: int = 10, ttl_seconds: float = 0):
+        return SqliteResponseCache(
+            filepath=self.filepath, max_entries=max_entries, ttl_seconds=ttl_seconds
+        )
+
+    def test_survives_reopening(self):
+        self.create_cache().set("a", {"choices": []})
+
+        self.assertEqual({"choices": []}, self.create_cache().get("a"))
+
+
+class TestLlmHttpClientResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.requests = 0
+
+        def handle_request(request: httpx.Request) -> httpx.Response:
+            self.requests += 1
+
+            return httpx.Response(
+                200, json={"choices": [{"message": {"content": "cached"}}]}
+            )
+
+        self.llm_http_client = LlmHttpClient(
+            inference_api_url="http://llm", response_cache=MemoryResponseCache()
+        )
+        self.llm_http_client.http_client = httpx.Client(
+            transport=httpx.MockTransport(handle_request)
+        )
+
+    def test_only_opted_in_calls_are_cached(self):
+        messages = [{"role": "user", "content": "hi"}]
+
+        for _ in range(2):
+            self.llm_http_client.get_llm_response(messages=messages)
+
+        self.assertEqual(2, self.requests)
+
+        for _ in range(2):
+            response = self.llm_http_client.get_llm_response(
+                messages=messages, use_cache=True
+            )
+
+        self.assertEqual("cached", response)
+        self.assertEqual(3, self.requests)
+
+    def test_different_requests_are_not_shared(self):
+        self.llm_http_client.get_llm_response(
+            messages=[{"role": "user", "content": "hi"}], use_cache=True
+        )
+        self.llm_http_client.get_llm_response(
+            messages=[{"role": "user", "content": "hello"}], use_cache=True
+        )
+
+        self.assertEqual(2, self.requests)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from app.services.search_backends import (
+    IndexProfile,
+    OpenSearchBackend,
+    OpenSearchConfig,
+)
+
+
+def get_search_config() -> OpenSearchConfig:
+    return OpenSearchConfig(hostname="localhost", port="9200", auth=("admin", ""))
+
+
+class TestOpenSearchBackend(unittest.TestCase):
+    def test_int8_vectors_need_cosine_similarity(self):
+        for space_type in ("l2", "innerproduct"):
+            with self.assertRaises(ValueError):
+                OpenSearchBackend(
+                    search_config=get_search_config(),
+                    quantization="int8",
+                    index_profile=IndexProfile(engine="lucene", space_type=space_type),
+                )
+
+    def test_int8_index_settings(self):
+        search_backend = OpenSearchBackend(
+            search_config=get_search_config(),
+            quantization="int8",
+            index_profile=IndexProfile(engine="lucene", space_type="cosinesimil"),
+        )
+        embeddings_mapping = search_backend.get_index_settings(dimensions=4)[
+            "mappings"
+        ]["properties"]["embeddings"]
+
+        self.assertEqual("byte", embeddings_mapping["data_type"])
+        self.assertEqual("cosinesimil", embeddings_mapping["method"]["space_type"])
+
+
+if __name__ == "__main__":
+    unittest.main()
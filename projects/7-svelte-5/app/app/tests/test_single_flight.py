@@ -0,0 +1,125 @@
+import threading
+import time
+import unittest
+
+from app.lib.single_flight import Broadcast, SingleFlight, StreamFanOut
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        single_flight = SingleFlight()
+        executions = []
+        results = []
+
+        def slow_function():
+            executions.append(1)
+            time.sleep(0.1)
+
+            return "result"
+
+        def call():
+            results.append(single_flight.do("key", slow_function))
+
+        threads = [threading.Thread(target=call) for _ in range(5)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(executions))
+        self.assertEqual(["result"] * 5, results)
+        self.assertEqual(4, single_flight.get_stats()["shared"])
+
+    def test_errors_are_shared_and_not_kept(self):
+        single_flight = SingleFlight()
+
+        def failing_function():
+            raise ValueError("upstream failed")
+
+        with self.assertRaises(ValueError):
+            single_flight.do("key", failing_function)
+
+        self.assertEqual("ok", single_flight.do("key", lambda: "ok"))
+
+
+class TestStreamFanOut(unittest.TestCase):
+    def test_subscribers_get_the_whole_stream(self):
+        stream_fan_out = StreamFanOut()
+        opened_streams = []
+        release = threading.Event()
+
+        def open_stream():
+            opened_streams.append(1)
+            release.wait()
+            yield from ["a", "b", "c"]
+
+        first = stream_fan_out.subscribe("key", open_stream)
+        second = stream_fan_out.subscribe("key", open_stream)
+        release.set()
+
+        self.assertEqual(["a", "b", "c"], list(first))
+        self.assertEqual(["a", "b", "c"], list(second))
+        self.assertEqual(1, len(opened_streams))
+
+    def test_upstream_is_closed_when_every_subscriber_left(self):
+        stream_fan_out = StreamFanOut()
+        closed = threading.Event()
+
+        def open_stream():
+            try:
+                while True:
+                    time.sleep(0.01)
+                    yield "token"
+            finally:
+                closed.set()
+
+        subscriber = stream_fan_out.subscribe("key", open_stream)
+        next(subscriber)
+        subscriber.close()
+
+        self.assertTrue(closed.wait(timeout=1), "The upstream kept running.")
+
+    def test_late_subscriber_does_not_join_a_cancelled_broadcast(self):
+        stream_fan_out = StreamFanOut()
+        opened_streams = []
+        resume_first = threading.Event()
+
+        def open_stream():
+            opened_streams.append(1)
+            yield "a"
+
+            # The first upstream is stuck here while it gets cancelled
+            if len(opened_streams) == 1:
+                resume_first.wait()
+
+            yield from ["b", "c"]
+
+        first = stream_fan_out.subscribe("key", open_stream)
+        self.assertEqual("a", next(first))
+        first.close()
+
+        # Still registered, the pump thread hasn't noticed the cancel yet
+        second = stream_fan_out.subscribe("key", open_stream)
+        resume_first.set()
+
+        self.assertEqual(["a", "b", "c"], list(second))
+        self.assertEqual(2, len(opened_streams))
+
+    def test_cancelled_broadcast_takes_no_subscribers(self):
+        broadcast = Broadcast(on_finished=lambda: None)
+        self.assertTrue(broadcast.add_subscriber())
+
+        subscriber = broadcast.subscribe()
+        broadcast.items.append("a")
+        next(subscriber)
+        subscriber.close()
+
+        self.assertTrue(broadcast.is_cancelled)
+        self.assertFalse(broadcast.add_subscriber())
+        self.assertEqual(0, broadcast.subscribers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+from jinja2 import ChoiceLoader, Environment, FileSystemLoader
+
+from app.lib.template_loaders import FreshModuleLoader
+
+
+class TestFreshModuleLoader(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.templates_dir = os.path.join(self.temp_dir.name, "templates")
+        self.compiled_dir = os.path.join(self.temp_dir.name, "compiled")
+        os.makedirs(self.templates_dir)
+
+        self.write_template("Hello {{ name }}")
+        Environment(loader=FileSystemLoader(self.templates_dir)).compile_templates(
+            self.compiled_dir, zip=None
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_template(self, source: str, mtime: float | None = None):
+        template_path = os.path.join(self.templates_dir, "greeting.j2")
+
+        with open(template_path, "w") as file:
+            file.write(source)
+
+        if mtime is not None:
+            os.utime(template_path, (mtime, mtime))
+
+    def get_template(self):
+        source_loader = FileSystemLoader(self.templates_dir)
+        environment = Environment(
+            loader=ChoiceLoader(
+                [
+                    FreshModuleLoader(self.compiled_dir, source_loader=source_loader),
+                    source_loader,
+                ]
+            )
+        )
+
+        return environment.get_template("greeting.j2")
+
+    def test_uses_the_compiled_module_when_fresh(self):
+        template = self.get_template()
+
+        self.assertTrue(template.filename.startswith(self.compiled_dir))
+        self.assertEqual("Hello Ada", template.render(name="Ada"))
+
+    def test_falls_back_to_a_newer_source(self):
+        compiled_mtime = max(
+            os.path.getmtime(os.path.join(self.compiled_dir, filename))
+            for filename in os.listdir(self.compiled_dir)
+        )
+        self.write_template("Hi {{ name }}", mtime=compiled_mtime + 10)
+
+        template = self.get_template()
+
+        self.assertTrue(template.filename.startswith(self.templates_dir))
+        self.assertEqual("Hi Ada", template.render(name="Ada"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+
+from app.lib.text_chunker import (
+    TextChunker,
+    count_tokens_approximately,
+    split_sentences,
+)
+from app.lib.text_extractors import iter_text_blocks
+
+
+class TestTextChunker(unittest.TestCase):
+    def test_split_sentences(self):
+        text = 'First one. Second one? "Third!" Fourth\n\nNew paragraph'
+
+        self.assertEqual(
+            ["First one.", "Second one?", '"Third!"', "Fourth", "New paragraph"],
+            split_sentences(text),
+        )
+
+    def test_chunks_respect_size_and_sentences(self):
+        text = " ".join(f"Sentence number {i} is here." for i in range(50))
+        chunker = TextChunker(chunk_size=20, chunk_overlap=6)
+        chunks = list(chunker.iter_chunks([text]))
+
+        self.assertGreater(len(chunks), 1)
+
+        for chunk in chunks:
+            self.assertLessEqual(count_tokens_approximately(chunk), 20)
+            self.assertTrue(chunk.endswith("here."), "A sentence was cut.")
+
+    def test_overlap(self):
+        chunker = TextChunker(chunk_size=9, chunk_overlap=4)
+        chunks = list(chunker.iter_chunks(["One two three. Four five six. Seven."]))
+
+        self.assertEqual(
+            ["One two three. Four five six.", "Four five six. Seven."], chunks
+        )
+
+    def test_long_sentence_is_split_on_words(self):
+        chunker = TextChunker(chunk_size=10, chunk_overlap=2)
+        chunks = list(chunker.iter_chunks([" ".join(["word"] * 35)]))
+
+        self.assertEqual(4, len(chunks))
+        self.assertTrue(all(count_tokens_approximately(c) <= 10 for c in chunks))
+
+    def test_invalid_overlap(self):
+        with self.assertRaises(ValueError):
+            TextChunker(chunk_size=10, chunk_overlap=10)
+
+
+class TestTextExtractors(unittest.TestCase):
+    def test_html_text(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, "page.html")
+
+            with open(filepath, "w") as file:
+                file.write(
+                    "<html><head><title>x</title><style>p {}</style></head>"
+                    "<body><p>Hello &amp; welcome.</p><script>var a;</script>"
+                    "<p>Bye.</p></body></html>"
+                )
+
+            text = "".join(iter_text_blocks(filepath))
+
+        self.assertEqual(["Hello & welcome.", "Bye."], split_sentences(text))
+
+    def test_unknown_extension(self):
+        with self.assertRaises(ValueError):
+            list(iter_text_blocks("file.xyz"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+
+from app.lib.vector_quantization import Int8Vectors, dequantize_int8, quantize_int8
+
+
+class TestVectorQuantization(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((1000, 64), dtype=np.float32)
+        self.query = rng.standard_normal(64, dtype=np.float32)
+
+    def test_round_trip_error_is_small(self):
+        codes, scales = quantize_int8(self.vectors)
+        restored = dequantize_int8(codes, scales)
+
+        self.assertEqual(np.int8, codes.dtype)
+        max_error = np.abs(restored - self.vectors).max(axis=1)
+        # Rounding error is at most half a quantization step
+        self.assertTrue(np.all(max_error <= scales / 2 + 1e-6))
+
+    def test_scores_match_float_scores(self):
+        int8_vectors = Int8Vectors.from_float(self.vectors)
+        int8_vectors.BLOCK_ROWS = 100
+
+        np.testing.assert_allclose(
+            self.vectors @ self.query, int8_vectors @ self.query, atol=0.2
+        )
+        self.assertLess(int8_vectors.nbytes, self.vectors.nbytes / 3.5)
+
+    def test_indexing_and_append(self):
+        int8_vectors = Int8Vectors.from_float(self.vectors[:10])
+        int8_vectors = int8_vectors.append(self.vectors[10:20])[[0, 15]]
+
+        self.assertEqual((2, 64), int8_vectors.shape)
+        np.testing.assert_allclose(
+            self.vectors[[0, 15]], int8_vectors.to_float(), atol=0.05
+        )
+
+    def test_zero_vector(self):
+        codes, scales = quantize_int8(np.zeros((1, 4), dtype=np.float32))
+
+        self.assertTrue(np.all(codes == 0))
+        self.assertTrue(np.all(np.isfinite(scales)))
+
+    def test_single_vector(self):
+        codes, scale = quantize_int8(self.query)
+
+        self.assertEqual((64,), codes.shape)
+        self.assertEqual(127, np.abs(codes).max())
+        np.testing.assert_allclose(self.query, dequantize_int8(codes, scale), atol=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
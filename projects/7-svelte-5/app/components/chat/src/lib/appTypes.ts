@@ -31,6 +31,7 @@ export interface ChatMessage {
   content: string;
   role: ChatMessageRole;
   state: ChatMessageState;
+  is_truncated?: boolean;
   created_at: string | null;
   updated_at: string | null;
   title?: string | null;
@@ -32,6 +32,42 @@ export async function doRequest(
   return response;
 }
 
+export function isImageProgressStream(response: Response): boolean {
+  // See STREAM_TYPE_HEADER in config.py
+  return response.headers.get("x-stream-type") === "image-progress";
+}
+
+export function parseServerSentEvents(buffer: string): {
+  events: { event: string; data: any }[];
+  remainder: string;
+} {
+  // Events are separated by a blank line, the last chunk may be incomplete
+  const rawEvents = buffer.split("\n\n");
+  const remainder = rawEvents.pop() ?? "";
+  const events = [];
+
+  for (const rawEvent of rawEvents) {
+    let event = "message";
+    let data = "";
+
+    for (const line of rawEvent.split("\n")) {
+      if (line.startsWith("event: ")) {
+        event = line.slice("event: ".length);
+      } else if (line.startsWith("data: ")) {
+        data += line.slice("data: ".length);
+      }
+    }
+
+    try {
+      events.push({ event, data: JSON.parse(data) });
+    } catch (err) {
+      console.warn(err.message);
+    }
+  }
+
+  return { events, remainder };
+}
+
 export function getFileNameWithoutExtensionAndTimeStamp(filename: string): string {
   let newFileName = filename
     .split(".")
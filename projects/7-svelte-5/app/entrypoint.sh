@@ -6,7 +6,6 @@ then
     echo "pip could not be found. Reinstalling..."
     python -m ensurepip
     pip install -r requirements.txt
-    python -c "import nltk; nltk.download('popular'); nltk.download('punkt_tab'); nltk.download('averaged_perceptron_tagger_eng')"
 fi
 
 if [ "${APP_USE_FLASH_ATTENTION}" = "TRUE" ]; then